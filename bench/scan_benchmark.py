@@ -0,0 +1,70 @@
+"""Compares the time taken by the laser to scan with each engine: 'rays'
+(all the beams cast at once, vectorized, against the segments in range
+sorted by distance, each beam tested only against those nearer than the
+segment it hit last scan, as Laser.scan does for plain maps with
+cast_rays_bounded) and 'sweep' (ranges sampled from the visibility polygon
+of the laser). The laser has the beams of the SICK LMS111
+(270 deg at 0.25 deg) by default, in a map of random square landmarks, and
+the largest difference between the engines' ranges is reported.
+
+    python scan_benchmark.py [--landmarks N] [--resolution DEG] [--runs N]
+"""
+# Python imports
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    os.pardir, 'src'))
+
+# MSL Sim imports
+from sim.line_map import LineMap
+from sim.mapgen import random_landmarks
+from sim.model import Laser
+
+
+def time_scans(laser, line_map, poses):
+    """Returns the median time [s] of a scan and the scans from each pose."""
+    times, scans = [], []
+    for pose in poses:
+        laser.pose = tuple(pose)
+        start = time.time()
+        scans.append(laser.scan(line_map))
+        times.append(time.time() - start)
+    return sorted(times)[len(times)//2], np.array(scans)
+
+
+parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+parser.add_argument('--landmarks', type=int, default=400)
+parser.add_argument('--resolution', type=float, default=0.25,
+        help='angle between beams [deg]')
+parser.add_argument('--range', type=float, default=20.0, help='[m]')
+parser.add_argument('--runs', type=int, default=5, help='scans per engine')
+parser.add_argument('--seed', type=int, default=0)
+args = parser.parse_args()
+
+line_map = LineMap()
+line_map.add_segments(random_landmarks(args.landmarks, seed=args.seed))
+rng = np.random.RandomState(args.seed)
+bounds = line_map.segments[:, 0::2].min(), line_map.segments[:, 0::2].max(), \
+        line_map.segments[:, 1::2].min(), line_map.segments[:, 1::2].max()
+poses = np.column_stack((rng.uniform(bounds[0], bounds[1], args.runs),
+    rng.uniform(bounds[2], bounds[3], args.runs),
+    rng.uniform(-np.pi, np.pi, args.runs)))
+laser = Laser((0, 0, 0))
+laser.min_angle, laser.max_angle = -135, 135
+laser.resolution = args.resolution
+laser.range = args.range
+laser.noise = 0.0
+print('%d segments, %d beams, %.0f m range' % (len(line_map.segments),
+    laser.num_beams, laser.range))
+results = {}
+for engine in ('rays', 'sweep'):
+    laser.engine = engine
+    results[engine] = time_scans(laser, line_map, poses)
+    print('%-8s median %9.2f ms per scan' % (engine, 1000*results[engine][0]))
+print('speedup  %.1fx' % (results['rays'][0] / results['sweep'][0]))
+print('largest difference %.2g m' % np.abs(results['rays'][1] -
+    results['sweep'][1]).max())
@@ -0,0 +1,62 @@
+"""Measures the cold-start time of the simulator: the wall time taken to
+launch a fresh Python process, import the simulator and simulate nothing (a
+zero second headless run), averaged over several runs. The time taken to
+import each startup module on its own is also reported.
+
+    python startup_benchmark.py [--runs N] [--map MAP_FILE] [--ros]
+"""
+# Python imports
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+        os.pardir, 'src')
+MAIN = os.path.join(SRC_DIR, 'main.py')
+MODULES = ['sim.headless', 'sim.core', 'sim.controller']
+
+
+def time_command(command, runs):
+    """Returns the sorted wall times [s] of running a command several times,
+    or None if it fails."""
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([SRC_DIR, env.get('PYTHONPATH', '')])
+    times = []
+    for _ in range(runs):
+        start = time.time()
+        with open(os.devnull, 'w') as devnull:
+            if subprocess.call(command, env=env, stdout=devnull,
+                    stderr=devnull) != 0:
+                return None
+        times.append(time.time() - start)
+    return sorted(times)
+
+
+def report(label, times):
+    if times is None:
+        print('%-32s failed (missing dependency?)' % label)
+    else:
+        print('%-32s min %7.1f ms   median %7.1f ms' % (label,
+            1000*times[0], 1000*times[len(times)//2]))
+
+
+parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+parser.add_argument('--runs', type=int, default=10)
+parser.add_argument('--map', help='map file to load')
+parser.add_argument('--ros', action='store_true',
+        help='include starting the ROS node (needs a roscore)')
+args = parser.parse_args()
+
+report('python (no imports)', time_command([sys.executable, '-c', 'pass'],
+    args.runs))
+for module in MODULES:
+    report('import ' + module, time_command([sys.executable, '-c',
+        'import ' + module], args.runs))
+command = [sys.executable, MAIN, '--headless', '--duration', '0']
+if args.map:
+    command += ['--map', args.map]
+if not args.ros:
+    command.append('--no-ros')
+report('headless cold start', time_command(command, args.runs))
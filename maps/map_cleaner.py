@@ -0,0 +1,16 @@
+"""Cleans a segment map (.txt or .npy): removes duplicate and zero length
+segments, merges collinear ones and, optionally, simplifies chains of
+segments, then reports how many were removed and how much faster the laser
+scans the cleaned map. Run with --help for the options, e.g.
+
+    python map_cleaner.py random_wall.txt random_wall_clean.txt --simplify 0.05
+"""
+import os
+import sys
+
+# Use the cleaner in the sim package next to this directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    os.pardir, 'src'))
+from sim.map_clean import clean_main
+
+clean_main()
@@ -0,0 +1,16 @@
+"""Converts a segment map (.txt or .npy) to an occupancy grid (a .yaml file
+and a .pgm image, as used by the ROS map_server), or an occupancy grid to a
+segment map outlining its occupied cells. Run with --help for the options,
+e.g.
+
+    python map_converter.py landmarks.txt landmarks.yaml --resolution 0.05
+"""
+import os
+import sys
+
+# Use the converter in the sim package next to this directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    os.pardir, 'src'))
+from sim.grid_map import convert_main
+
+convert_main()
@@ -0,0 +1,15 @@
+"""Generates a map of a branching network of rough-walled tunnels, written
+as it is generated along with a tile index for .npy maps. Run with --help for
+the options, e.g.
+
+    python tunnel_generator.py mine.npy --length 20000 --seed 1
+"""
+import os
+import sys
+
+# Use the generators in the sim package next to this directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    os.pardir, 'src'))
+from sim.mapgen import tunnels_main
+
+tunnels_main()
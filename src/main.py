@@ -1,16 +1,122 @@
 #!/usr/bin/env python
 
 # Python imports
+import argparse
 import sys
 
-# PySide imports
-from PySide import QtGui
 
-# MSL Sim imports
-from sim.controller import MainWindow
+def parse_args():
+    parser = argparse.ArgumentParser(description='MSL Simulator')
+    parser.add_argument('--headless', action='store_true',
+            help='simulate without the GUI (PySide is not imported)')
+    parser.add_argument('--map', help='map file to load at startup')
+    parser.add_argument('--obstacles',
+            help='file of moving obstacles to add at startup')
+    parser.add_argument('--duration', type=float,
+            help='headless: seconds to simulate (forever if not given)')
+    parser.add_argument('--vel', type=float, default=0.0,
+            help='headless: linear velocity of the robot [m/s]')
+    parser.add_argument('--ang-vel', type=float, default=0.0,
+            help='headless: angular velocity of the robot [rad/s]')
+    parser.add_argument('--rtf', type=float, default=1.0,
+            help='headless: target real-time factor, the sim time simulated '
+            'per second (as fast as possible if 0)')
+    parser.add_argument('--laser-overload', default='skip',
+            choices=('skip', 'resolution', 'rate', 'none'),
+            help='what the laser does when scans take longer than its period '
+            'allows: skip frames, or halve its resolution or rate')
+    parser.add_argument('--transport', action='append', default=[],
+            choices=('ros', 'shm', 'socket'),
+            help='publish on this transport too: ROS, shared memory rings '
+            '(see sim/shm.py) or a socket stream (see sim/stream.py)')
+    parser.add_argument('--stream-address', default='127.0.0.1:11411',
+            help='socket stream: host:port, or the path of a Unix socket')
+    parser.add_argument('--shared-memory', action='store_true',
+            help='same as --transport shm')
+    parser.add_argument('--no-ros', action='store_true',
+            help='do not publish on ROS')
+    parser.add_argument('--range-cache', action='store_true',
+            help='precompute the ranges of the (static) map at startup')
+    parser.add_argument('--lut-bins', type=int, default=0,
+            help='range cache: directions in the range lookup table '
+            '(none if 0, in which case only the distance field is used)')
+    parser.add_argument('--clean-map', action='store_true',
+            help='remove duplicate and zero length segments from the map and '
+            'merge collinear ones when loading it')
+    parser.add_argument('--simplify', type=float, default=0.0,
+            help='clean map: also simplify chains of segments with this '
+            'Douglas-Peucker tolerance [m]')
+    parser.add_argument('--noise-models', action='store_true',
+            help='add range dependent laser noise with dropouts, gyroscope '
+            'bias drift, GPS multipath and outages and compass hard-iron '
+            'bias to the white noise of the sensors')
+    parser.add_argument('--seed', type=int,
+            help='seed of the noise models (random if not given)')
+    # Ignore the remapping arguments added by roslaunch/rosrun
+    return parser.parse_known_args()[0]
 
 
-app = QtGui.QApplication(sys.argv)
-main_window = MainWindow()
-main_window.show()
-sys.exit(app.exec_())
+def transports(args):
+    names = [] if args.no_ros else ['ros']
+    if args.shared_memory:
+        names.append('shm')
+    return names + [name for name in args.transport if name not in names]
+
+
+def transport_options(args):
+    return {'socket': {'address': args.stream_address}}
+
+
+def overload_policy(args):
+    return None if args.laser_overload == 'none' else args.laser_overload
+
+
+def run_gui(args):
+    # PySide imports
+    from PySide import QtGui, QtCore
+
+    # MSL Sim imports
+    from sim.controller import MainWindow
+    from sim.noise import install_noise_models
+    from sim.obstacles import load_obstacles
+
+    app = QtGui.QApplication(sys.argv)
+    main_window = MainWindow(transports(args), transport_options(args))
+    view = main_window.main.graphics_view
+    if args.obstacles:
+        load_obstacles(args.obstacles, view.line_map.obstacles)
+    if args.noise_models:
+        install_noise_models(view.robot, args.seed)
+    view.sim.set_overload('laser', overload_policy(args))
+    if args.map:
+        view.draw_map_from_file(args.map, clean=args.clean_map,
+                simplify=args.simplify)
+        if args.range_cache:
+            view.line_map.precompute(view.robot.laser.range,
+                    theta_bins=args.lut_bins)
+    main_window.show()
+    # Start ROS, etc. once the window is up
+    QtCore.QTimer.singleShot(0, main_window.deferred_init)
+    status = app.exec_()
+    if hasattr(main_window.publisher, 'stop'):
+        main_window.publisher.stop()
+    return status
+
+
+def run_headless(args):
+    # MSL Sim imports
+    import sim.headless
+
+    sim.headless.run(args.map, args.duration, args.vel, args.ang_vel,
+            transports=transports(args),
+            transport_options=transport_options(args),
+            range_cache=args.range_cache,
+            lut_bins=args.lut_bins, obstacles_file=args.obstacles,
+            noise_models=args.noise_models, seed=args.seed,
+            clean_map=args.clean_map, simplify=args.simplify, rtf=args.rtf,
+            laser_overload=overload_policy(args))
+    return 0
+
+
+args = parse_args()
+sys.exit(run_headless(args) if args.headless else run_gui(args))
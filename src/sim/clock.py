@@ -0,0 +1,76 @@
+"""The simulated time of a Simulation, and a governor that paces the updates
+to hold a target real-time factor (sim seconds per wall second) and measures
+the factor actually achieved."""
+# Python imports
+import time
+from collections import deque
+
+# MSL Sim imports
+import sim.defaults as d
+
+
+class SimClock(object):
+    """The simulated time [s]. It is set by whatever runs the simulation (the
+    headless runner sets it to the time each update is due) or, once
+    follow_wall is called, it is the wall time since then (the GUI's timers
+    run in real time)."""
+    def __init__(self, start=0.0):
+        self._time = float(start)
+        self._wall_start = None
+
+    @property
+    def time(self):
+        if self._wall_start is not None:
+            return time.time() - self._wall_start
+        return self._time
+
+    def set(self, sim_time):
+        """Sets the time [s], which then stays there until set again."""
+        self._time = float(sim_time)
+        self._wall_start = None
+
+    def follow_wall(self):
+        """Makes the time run with the wall clock from where it is now."""
+        self._wall_start = time.time() - self.time
+
+
+class RealTimeGovernor(object):
+    """Paces a simulation at target times real time, or as fast as possible
+    if target is 0 or None, and measures the real-time factor achieved over
+    the last window seconds of wall time. A simulation more than max_lag
+    seconds of wall time behind schedule (e.g. after a slow scan) carries on
+    from where it is rather than running fast to catch up."""
+    def __init__(self, target=d.REAL_TIME_FACTOR, window=d.RTF_WINDOW,
+            max_lag=d.RTF_MAX_LAG):
+        self.target = target
+        self.window = window
+        self.max_lag = max_lag
+        self.start()
+
+    def start(self, sim_time=0.0):
+        """Starts pacing from sim_time [s] now."""
+        self.wall_start = time.time()
+        self.sim_start = sim_time
+        self.samples = deque([(self.wall_start, sim_time)]) # (wall, sim)
+
+    def wait(self, sim_time):
+        """Sleeps until sim_time [s] is due, and records the progress."""
+        if self.target:
+            delay = self.wall_start + (sim_time - self.sim_start)/self.target \
+                    - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            elif delay < -self.max_lag:
+                self.wall_start = time.time()
+                self.sim_start = sim_time
+        now = time.time()
+        self.samples.append((now, sim_time))
+        while len(self.samples) > 2 and now - self.samples[1][0] > self.window:
+            self.samples.popleft()
+
+    @property
+    def achieved(self):
+        """Returns the real-time factor over the last window (0 until some
+        wall time has passed)."""
+        (wall_0, sim_0), (wall_1, sim_1) = self.samples[0], self.samples[-1]
+        return (sim_1 - sim_0) / (wall_1 - wall_0) if wall_1 > wall_0 else 0.0
@@ -0,0 +1,87 @@
+"""Collision detection between the robot's rectangular footprint and the
+segments of the map."""
+# Python imports
+from math import cos, sin
+import numpy as np
+
+# MSL Sim imports
+from sim.line_map import as_segments
+
+
+def footprint(pose, length, width):
+    """Returns the (4, 2) corners of a length x width rectangle centred on
+    pose (x, y, heading) and aligned with its heading, counter-clockwise."""
+    x, y, heading = pose
+    c, s = cos(heading), sin(heading)
+    corners = []
+    for u, v in ((1, 1), (-1, 1), (-1, -1), (1, -1)):
+        dx, dy = u*length/2.0, v*width/2.0
+        corners.append((x + c*dx - s*dy, y + s*dx + c*dy))
+    return corners
+
+
+def convex_hull(points):
+    """Returns the convex hull of a list of (x, y) points, counter-clockwise
+    (Andrew's monotone chain)."""
+    points = sorted(set(points))
+    if len(points) < 3:
+        return points
+    def cross(o, a, b):
+        return (a[0] - o[0])*(b[1] - o[1]) - (a[1] - o[1])*(b[0] - o[0])
+    lower, upper = [], []
+    for p in points:
+        while len(lower) >= 2 and cross(lower[-2], lower[-1], p) <= 0:
+            lower.pop()
+        lower.append(p)
+    for p in reversed(points):
+        while len(upper) >= 2 and cross(upper[-2], upper[-1], p) <= 0:
+            upper.pop()
+        upper.append(p)
+    return lower[:-1] + upper[:-1]
+
+
+def segments_touching(segments, polygon):
+    """Returns whether each of the (M, 4) segments touches the convex polygon
+    (given as its vertices), by the separating axis theorem: a segment misses
+    the polygon only if their projections onto the normal of one of the
+    polygon's edges or of the segment do not overlap."""
+    polygon = np.asarray(polygon, dtype=float)
+    edges = np.vstack((polygon[1:], polygon[:1])) - polygon
+    normals = np.column_stack((-edges[:, 1], edges[:, 0]))
+    # Polygon edge normals: (M, H) projections of the segment endpoints
+    shadow = polygon.dot(normals.T) # (V, H)
+    low, high = shadow.min(axis=0), shadow.max(axis=0)
+    first = segments[:, 0:2].dot(normals.T)
+    second = segments[:, 2:4].dot(normals.T)
+    overlap = np.all((np.maximum(first, second) >= low) &
+            (np.minimum(first, second) <= high), axis=1)
+    # Segment normals
+    normal = np.column_stack((segments[:, 1] - segments[:, 3],
+        segments[:, 2] - segments[:, 0]))
+    own = np.einsum('ij,ij->i', segments[:, 0:2], normal)
+    shadow = normal.dot(polygon.T) # (M, V)
+    return overlap & (shadow.min(axis=1) <= own) & (shadow.max(axis=1) >= own)
+
+
+def swept_collision(line_map, start, end, length, width):
+    """Returns a segment of the map (as x_1, y_1, x_2, y_2) touched by a
+    length x width footprint moving from pose start to pose end, or None.
+    The footprint is swept as the convex hull of its start and end, which is
+    exact for straight moves and close for small turns. Only the segments the
+    map's spatial index finds around the sweep are tested. Segments already
+    touching the footprint at start are ignored, so it can move off them."""
+    before = footprint(start, length, width)
+    corners = before + footprint(end, length, width)
+    xs, ys = [p[0] for p in corners], [p[1] for p in corners]
+    if hasattr(line_map, 'segments_in'):
+        candidates = line_map.segments_in(min(xs), min(ys), max(xs), max(ys))
+    else:
+        candidates = as_segments(line_map)
+    if not len(candidates):
+        return None
+    touching = candidates[segments_touching(candidates, convex_hull(corners))]
+    if len(touching):
+        touching = touching[~segments_touching(touching, before)]
+    if not len(touching):
+        return None
+    return tuple(touching[0].tolist())
@@ -3,30 +3,49 @@ import math
 import time
 import random
 import os
+import numpy as np
 
 # PySide imports
 from PySide import QtGui, QtCore
 
-# ROS imports
-import rospy
-import rospkg
-from sensor_msgs.msg import LaserScan
-
 # MSL Sim imports
 import sim.model as mod
 import sim.defaults as d
-from msl_sim.msg import Compass, GPS, Gyro, Encoders, Pose2DStamped
+from sim.clock import RealTimeGovernor
+from sim.core import Simulation
+from sim.grid_map import is_grid_file, load_grid
+from sim.line_map import LineMap, is_tiled_map, load_map
+from sim.map_clean import clean_segments, format_report
+from sim.presets import PresetRegistry
+from sim.publishers import PublisherGroup, create_publisher
+
+# Logo, found relative to this file (or through rospkg if installed elsewhere)
+LOGO_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+        os.pardir, 'img', 'msl_logo.png')
 
 
 class MainWindow(QtGui.QMainWindow):
-    """The main window. This window displays all the widgets."""
-    def __init__(self):
+    """The main window. This window displays all the widgets. The
+    measurements are published on each of the transports (see
+    sim.publishers.create_publisher)."""
+    def __init__(self, transports=('ros',), transport_options=None):
         super(MainWindow, self).__init__()
         self.robot = mod.Robot()
+        self.presets = PresetRegistry()
+        # The ROS node (etc.) is started by deferred_init, once the window is
+        # shown
+        self.publisher = create_publisher(transports, transport_options) or \
+                PublisherGroup([])
         self.loadGUI()
+        self.sim = Simulation(self.robot, self.main.graphics_view.line_map,
+                self.publisher)
         # Place and scale the logo
-        pkg_dir = rospkg.RosPack().get_path('msl_sim')
-        pixmap = QtGui.QPixmap(os.path.join(pkg_dir, 'src', 'img', 'msl_logo.png'))
+        logo_file = LOGO_FILE
+        if not os.path.exists(logo_file):
+            import rospkg
+            logo_file = os.path.join(rospkg.RosPack().get_path('msl_sim'),
+                    'src', 'img', 'msl_logo.png')
+        pixmap = QtGui.QPixmap(logo_file)
         self.main.logo_label.setPixmap(pixmap)
         self.main.logo_label.setAlignment(QtCore.Qt.AlignCenter)
         # Set initial scale of main plot
@@ -38,9 +57,10 @@ class MainWindow(QtGui.QMainWindow):
         # Give the zoomed-out plotting area a copy of the zoomed-in plotting
         # area so it can change it based on its timers
         self.main.graphics_view.zoom = self.main.graphics_view_zoom
-        # Give the plotting area the same robot as the rest of the GUI and start
-        # updating it via timers
+        # Give the plotting area the same robot and simulation as the rest of
+        # the GUI and start updating it via timers
         self.main.graphics_view.robot = self.robot
+        self.main.graphics_view.sim = self.sim
         self.main.graphics_view.initialiseRobot()
         self.settings_to_default()
         # Start a timer that updates the labels
@@ -55,6 +75,12 @@ class MainWindow(QtGui.QMainWindow):
     # --------------------------------------------------------------------------
     # SETUP METHODS
     # --------------------------------------------------------------------------
+    def deferred_init(self):
+        """Finishes the slower parts of the initialization (starting the ROS
+        node and drawing the scale ticks). Called once the window is shown."""
+        self.publisher.start()
+        self.main.graphics_view.draw_scale_ticks()
+
     def connect_signals_to_slots(self):
         # -----
         # ROBOT
@@ -197,10 +223,10 @@ class MainWindow(QtGui.QMainWindow):
         self.settings.setupUi(self.dialog)
         self.connect_signals_to_slots()
         # Add items to pull down menus
-        self.settings.laser_combo.addItems(["Custom", "SICK LMS111",
-            "Hokuyo URG-04LX"])
-        self.settings.robot_combo.addItems(["Custom", "Clearpath Husky A200",
-            "MobileRobots P3AT"])
+        self.settings.laser_combo.addItems(["Custom"] +
+                self.presets.names('lasers'))
+        self.settings.robot_combo.addItems(["Custom"] +
+                self.presets.names('robots'))
 
     # --------------------------------------------------------------------------
     # SLOTS
@@ -217,21 +243,15 @@ class MainWindow(QtGui.QMainWindow):
     def robot_combo_changed(self, value):
         if value == 0: # Custom
             self.toggle_enable_robot_settings(True)
-        elif value == 1: # Clearpath Husky A200
-            self.robot_length_changed(d.HUSKY_LENGTH)
-            self.robot_width_changed(d.HUSKY_WIDTH)
-            self.robot_wheel_rad_changed(d.HUSKY_WHEEL_RAD)
-            self.robot_wheelbase_changed(d.HUSKY_WHEELBASE)
-            self.robot_vel_changed(d.HUSKY_MAX_VEL)
-            self.robot_ang_vel_changed(d.HUSKY_MAX_ANG_VEL)
-            self.toggle_enable_robot_settings(False)
-        elif value == 2: # MobileRobots P3AT
-            self.robot_length_changed(d.P3AT_LENGTH)
-            self.robot_width_changed(d.P3AT_WIDTH)
-            self.robot_wheel_rad_changed(d.P3AT_WHEEL_RAD)
-            self.robot_wheelbase_changed(d.P3AT_WHEELBASE)
-            self.robot_vel_changed(d.P3AT_MAX_VEL)
-            self.robot_ang_vel_changed(d.P3AT_MAX_ANG_VEL)
+        else: # Preset
+            preset = self.presets.get('robots',
+                    self.settings.robot_combo.itemText(value))
+            self.robot_length_changed(preset.params['length'])
+            self.robot_width_changed(preset.params['width'])
+            self.robot_wheel_rad_changed(preset.params['wheel_rad'])
+            self.robot_wheelbase_changed(preset.params['wheelbase'])
+            self.robot_vel_changed(preset.params['max_vel'])
+            self.robot_ang_vel_changed(preset.params['max_ang_vel'])
             self.toggle_enable_robot_settings(False)
 
     def robot_length_changed(self, value):
@@ -243,13 +263,13 @@ class MainWindow(QtGui.QMainWindow):
         self.settings.robot_wheel_rad_slider.setValue(int(100*value))
         self.settings.robot_wheel_rad_box.setValue(value)
         self.robot.wheel_rad = value
-        rospy.set_param('~robot_wheel_radius', value)
+        self.publisher.set_param('~robot_wheel_radius', value)
 
     def robot_wheelbase_changed(self, value):
         self.settings.robot_wheelbase_slider.setValue(int(10*value))
         self.settings.robot_wheelbase_box.setValue(value)
         self.robot.wheelbase = value
-        rospy.set_param('~robot_track', value)
+        self.publisher.set_param('~robot_track', value)
 
     def robot_width_changed(self, value):
         self.settings.robot_width_slider.setValue(int(10*value))
@@ -274,7 +294,7 @@ class MainWindow(QtGui.QMainWindow):
         self.settings.compass_noise_slider.setValue(value)
         self.settings.compass_noise_box.setValue(value)
         self.robot.compass.noise = math.radians(value)
-        rospy.set_param('~compass_noise', math.radians(value))
+        self.publisher.set_param('~compass_noise', math.radians(value))
 
     # --------
     # GPS
@@ -291,7 +311,7 @@ class MainWindow(QtGui.QMainWindow):
         self.settings.gps_noise_slider.blockSignals(False)
         self.settings.gps_noise_box.setValue(value)
         self.robot.gps.noise = value
-        rospy.set_param('~gps_noise', value)
+        self.publisher.set_param('~gps_noise', value)
 
     # --------
     # GYRO
@@ -308,7 +328,7 @@ class MainWindow(QtGui.QMainWindow):
         self.settings.gyro_noise_slider.blockSignals(False)
         self.settings.gyro_noise_box.setValue(value)
         self.robot.gyroscope.noise = math.radians(value)
-        rospy.set_param('~gyro_noise', math.radians(value))
+        self.publisher.set_param('~gyro_noise', math.radians(value))
 
     # --------
     # ODOMETER
@@ -323,7 +343,7 @@ class MainWindow(QtGui.QMainWindow):
         self.settings.odom_noise_slider.setValue(int(10*value))
         self.settings.odom_noise_box.setValue(value)
         self.robot.odometer.noise = value
-        rospy.set_param('~encoder_noise', value)
+        self.publisher.set_param('~encoder_noise', value)
 
     def odom_res_changed(self, value):
         self.settings.odom_res_slider.blockSignals(True)
@@ -331,29 +351,28 @@ class MainWindow(QtGui.QMainWindow):
         self.settings.odom_res_slider.blockSignals(False)
         self.settings.odom_res_box.setValue(value)
         self.robot.odometer.res = value
-        rospy.set_param('~encoder_resolution', value)
+        self.publisher.set_param('~encoder_resolution', value)
 
     # -----
     # LASER
     # -----
     def laser_combo_changed(self, value):
         if value == 0: # Custom
+            self.robot.laser.noise_table = None
+            self.robot.laser.scan_time = d.LASER_SCAN_TIME
             self.toggle_enable_laser_settings(True)
-        elif value == 1: # SICK LMS111
-            self.laser_range_changed(d.SICK_111_RANGE)
-            self.laser_min_bear_changed(d.SICK_111_MIN_ANGLE)
-            self.laser_max_bear_changed(d.SICK_111_MAX_ANGLE)
-            self.laser_res_changed(d.SICK_111_RES)
-            self.laser_freq_changed(d.SICK_111_FREQ)
-            self.laser_noise_changed(d.SICK_111_NOISE)
-            self.toggle_enable_laser_settings(False)
-        elif value == 2: # Hokuyo URG-04LX
-            self.laser_range_changed(d.HOK_04_RANGE)
-            self.laser_min_bear_changed(d.HOK_04_MIN_ANGLE)
-            self.laser_max_bear_changed(d.HOK_04_MAX_ANGLE)
-            self.laser_res_changed(d.HOK_04_RES)
-            self.laser_freq_changed(d.HOK_04_FREQ)
-            self.laser_noise_changed(d.HOK_04_NOISE)
+        else: # Preset
+            preset = self.presets.get('lasers',
+                    self.settings.laser_combo.itemText(value))
+            self.laser_range_changed(preset.params['range'])
+            self.laser_min_bear_changed(preset.params['min_angle'])
+            self.laser_max_bear_changed(preset.params['max_angle'])
+            self.laser_res_changed(preset.params['resolution'])
+            self.laser_freq_changed(preset.params['freq'])
+            self.laser_noise_changed(preset.noise)
+            self.robot.laser.noise_table = preset.noise_table
+            self.robot.laser.scan_time = preset.params.get('scan_time',
+                    d.LASER_SCAN_TIME)
             self.toggle_enable_laser_settings(False)
 
     def laser_freq_changed(self, value):
@@ -384,7 +403,7 @@ class MainWindow(QtGui.QMainWindow):
         self.settings.laser_noise_slider.setValue(int(100*value))
         self.settings.laser_noise_box.setValue(value)
         self.robot.laser.noise = value
-        rospy.set_param('~laser_noise', value)
+        self.publisher.set_param('~laser_noise', value)
 
     def laser_range_changed(self, value):
         self.settings.laser_range_box.setValue(value)
@@ -418,14 +437,14 @@ class MainWindow(QtGui.QMainWindow):
     # ROS
     # -------
     def initialize_parameters(self):
-        rospy.set_param('~robot_wheel_radius', self.robot.wheel_rad)
-        rospy.set_param('~robot_track', self.robot.wheelbase)
-        rospy.set_param('~laser_noise', self.robot.laser.noise)
-        rospy.set_param('~encoder_resolution', self.robot.odometer.res)
-        rospy.set_param('~encoder_noise', self.robot.odometer.noise)
-        rospy.set_param('~gps_noise', self.robot.gps.noise)
-        rospy.set_param('~gyro_noise', self.robot.gyroscope.noise)
-        rospy.set_param('~compass_noise', self.robot.compass.noise)
+        self.publisher.set_param('~robot_wheel_radius', self.robot.wheel_rad)
+        self.publisher.set_param('~robot_track', self.robot.wheelbase)
+        self.publisher.set_param('~laser_noise', self.robot.laser.noise)
+        self.publisher.set_param('~encoder_resolution', self.robot.odometer.res)
+        self.publisher.set_param('~encoder_noise', self.robot.odometer.noise)
+        self.publisher.set_param('~gps_noise', self.robot.gps.noise)
+        self.publisher.set_param('~gyro_noise', self.robot.gyroscope.noise)
+        self.publisher.set_param('~compass_noise', self.robot.compass.noise)
 
     # -----
     # OTHER
@@ -625,14 +644,20 @@ class PlotGraphicsView(QtGui.QGraphicsView):
         self.draw_scale()
         self.poly_item = None
         # Containers
-        self.line_map = [] # line properties 
+        self.line_map = LineMap() # line segments
         self.line_item_map = [] # line graphic items
         self.obstacle_items = [] # obstacle polygon items
+        self.tile_items = {} # path item of each shown tile of a tiled map
+        self.grid_item = None # pixmap item of the occupancy grid
+        self.obstacles_item = None # path item of the moving obstacles
+        self.obstacles_version = None # version of the obstacles drawn
         # Flags
         self.draw_mode = 'freehand' # freehand, line, poly
         self.drawing_line = False # user is currently drawing a line
         self.freehand = False
         self.show_beams = True # laser beams (not just hits) are shown
+        self.scale_ticks_drawn = False
+        self.map_visible = True
         # Timers
         self.plot_timer = QtCore.QTimer()
         self.gps_timer = QtCore.QTimer()
@@ -641,25 +666,34 @@ class PlotGraphicsView(QtGui.QGraphicsView):
         self.odom_timer = QtCore.QTimer()
         self.laser_timer = QtCore.QTimer()
         self.ground_truth_timer = QtCore.QTimer()
-        # ROS
-        rospy.init_node('msl_sim')
-        self.compass_publisher = rospy.Publisher('/msl_sim/compass', Compass, queue_size=10)
-        self.encoders_publisher = rospy.Publisher('/msl_sim/encoders', Encoders, queue_size=10)
-        self.gps_publisher = rospy.Publisher('/msl_sim/gps', GPS, queue_size=10)
-        self.gyro_publisher = rospy.Publisher('/msl_sim/gyro', Gyro, queue_size=10)
-        self.ground_truth_publisher = rospy.Publisher('/msl_sim/ground_truth', Pose2DStamped, queue_size=10)
-        self.laser_publisher = rospy.Publisher('/msl_sim/scan', LaserScan, queue_size=10)
+        self.obstacles_timer = QtCore.QTimer()
+        self.clock_timer = QtCore.QTimer()
+        self.rtf_timer = QtCore.QTimer()
+        # The timers can fall behind, so the sim time the robot has moved
+        # through is measured against the wall time (pacing nothing)
+        self.governor = RealTimeGovernor(0)
+        self.motion_time = 0.0 # [s]
+        self.rtf_label = None
 
     # --------------------------------------------------------------------------
     # SETUP METHODS
     # --------------------------------------------------------------------------
     def draw_scale(self):
+        """Draws the axes. The ticks and their labels are drawn later by
+        draw_scale_ticks, so they do not hold up showing the window."""
         scale_line_horiz = QtGui.QGraphicsLineItem(-100, 0, 100, 0)
         scale_line_horiz.setPen(self.scale_pen)
         self.scene().addItem(scale_line_horiz)
         scale_line_vert = QtGui.QGraphicsLineItem(0, -100, 0, 100)
         scale_line_vert.setPen(self.scale_pen)
         self.scene().addItem(scale_line_vert)
+
+    def draw_scale_ticks(self):
+        """Draws the ticks and labels of the axes (only the first time it is
+        called)."""
+        if self.scale_ticks_drawn:
+            return
+        self.scale_ticks_drawn = True
         font = QtGui.QFont('Monospace', pointSize=12)
         for i in range(-100, 101, 2):
             if i == 0:
@@ -711,39 +745,33 @@ class PlotGraphicsView(QtGui.QGraphicsView):
     # --------------------------------------------------------------------------
     # TIMER METHODS
     # --------------------------------------------------------------------------
-    def compass_update(self):
-        msg = Compass()
-        msg.bearing = self.robot.compass.read(self.robot.heading)
-        msg.header.stamp = rospy.Time.now()
-        self.compass_publisher.publish(msg)
-
-    def gps_update(self):
-        x, y = self.robot.gps.read(self.robot.x, self.robot.y)
-        msg = GPS()
-        msg.x = x
-        msg.y = y
-        msg.header.stamp = rospy.Time.now()
-        self.gps_publisher.publish(msg)
-
-    def ground_truth_update(self):
-        msg = Pose2DStamped()
-        msg.x = self.robot.x
-        msg.y = self.robot.y
-        msg.theta = self.robot.heading
-        msg.header.stamp = rospy.Time.now()
-        self.ground_truth_publisher.publish(msg)
-
-    def gyro_update(self):
-        angular_velocity = self.robot.gyroscope.read(self.robot.ang_vel)
-        msg = Gyro()
-        msg.angular_velocity = angular_velocity
-        msg.header.stamp = rospy.Time.now()
-        self.gyro_publisher.publish(msg)
+    def odometry_update(self):
+        """Moves the robot one odometry period along, and records it."""
+        self.sim.odometry_update()
+        self.motion_time += 1.0/self.sim.frequencies()['odometry']
+        self.governor.wait(self.motion_time)
+
+    def report_real_time_factor(self):
+        """Shows (and publishes) the real-time factor achieved: the sim time
+        the robot has moved through per second of wall time."""
+        factor = self.governor.achieved
+        if self.sim.publisher is not None:
+            self.sim.publisher.publish_real_time_factor(factor)
+        self.rtf_label.setText('Real-time factor %.2f' % factor)
 
     def laser_update(self):
-        ranges = self.robot.scan_laser(self.line_map)
-        self.publish_laser_msg(ranges)
-        self.latest_laser_scan = ranges
+        ranges = self.shedding_update('laser')
+        if ranges is not None:
+            self.latest_laser_scan = ranges
+
+    def shedding_update(self, name):
+        """Runs an update that may shed load (see Simulation.update), and
+        follows any change in its rate."""
+        freq = self.sim.frequencies()[name]
+        result = self.sim.update(name)
+        if self.sim.frequencies()[name] != freq:
+            self.set_timer_frequencies()
+        return result
 
     def move_zoomed_view(self):
         # Adjust the window of the zoomed in view
@@ -754,17 +782,15 @@ class PlotGraphicsView(QtGui.QGraphicsView):
         self.zoom.rotate(heading_change)
         self.previous_pose = self.robot.pose
 
-    def odometry_update(self):
-        encoders = self.robot.update_pose()
-        if encoders is not None:
-            msg = Encoders()
-            msg.right_ticks, msg.left_ticks = encoders
-            msg.header.stamp = rospy.Time.now()
-            self.encoders_publisher.publish(msg)
-
     def plot_update(self):
         """Updates the plot. This method is called automatically by the
         plot_timer."""
+        # Tiles of a tiled map
+        if self.line_map.tiles is not None:
+            self.draw_tiles()
+        # Moving obstacles
+        if self.line_map.obstacles_version != self.obstacles_version:
+            self.draw_obstacles()
         # Laser beams
         if self.robot.scanned:
             self.draw_laser_beams(self.latest_laser_scan)
@@ -784,32 +810,49 @@ class PlotGraphicsView(QtGui.QGraphicsView):
             self.robot.changed = False
 
     def set_timer_frequencies(self):
+        freqs = self.sim.frequencies()
         self.plot_timer.setInterval(1000.0/self.plot_freq)
-        self.odom_timer.setInterval(1000.0/self.robot.odometer.freq)
-        self.laser_timer.setInterval(1000.0/self.robot.laser.freq)
-        self.gps_timer.setInterval(1000.0/self.robot.gps.freq)
-        self.ground_truth_timer.setInterval(100.0)
-        self.gyro_timer.setInterval(1000.0/self.robot.gyroscope.freq)
-        self.compass_timer.setInterval(1000.0/self.robot.compass.freq)
+        self.odom_timer.setInterval(1000.0/freqs['odometry'])
+        self.laser_timer.setInterval(1000.0/freqs['laser'])
+        self.gps_timer.setInterval(1000.0/freqs['gps'])
+        self.ground_truth_timer.setInterval(1000.0/freqs['ground_truth'])
+        self.obstacles_timer.setInterval(1000.0/freqs['obstacles'])
+        self.gyro_timer.setInterval(1000.0/freqs['gyro'])
+        self.compass_timer.setInterval(1000.0/freqs['compass'])
+        self.clock_timer.setInterval(1000.0/freqs['clock'])
+        self.rtf_timer.setInterval(1000.0*d.RTF_REPORT_PERIOD)
 
     def start_timers(self):
         """Starts separate timers to update the plot, odometry, and range data
         from the laser."""
         self.set_timer_frequencies()
+        # The timers run in real time, so the sim time follows the wall clock
+        self.sim.clock.follow_wall()
+        self.motion_time = 0.0
+        self.governor.start(self.motion_time)
+        self.rtf_label = QtGui.QLabel()
+        self.window().statusBar().addPermanentWidget(self.rtf_label)
+        self.clock_timer.timeout.connect(self.sim.clock_update)
         self.plot_timer.timeout.connect(self.plot_update)
         self.odom_timer.timeout.connect(self.odometry_update)
         self.laser_timer.timeout.connect(self.laser_update)
-        self.gps_timer.timeout.connect(self.gps_update)
-        self.ground_truth_timer.timeout.connect(self.ground_truth_update)
-        self.gyro_timer.timeout.connect(self.gyro_update)
-        self.compass_timer.timeout.connect(self.compass_update)
+        self.gps_timer.timeout.connect(lambda: self.shedding_update('gps'))
+        self.ground_truth_timer.timeout.connect(self.sim.ground_truth_update)
+        self.obstacles_timer.timeout.connect(self.sim.obstacles_update)
+        self.gyro_timer.timeout.connect(self.sim.gyro_update)
+        self.compass_timer.timeout.connect(
+                lambda: self.shedding_update('compass'))
         self.plot_timer.start()
         self.odom_timer.start()
         self.laser_timer.start()
         self.gps_timer.start()
         self.ground_truth_timer.start()
+        self.obstacles_timer.start()
         self.gyro_timer.start()
         self.compass_timer.start()
+        self.clock_timer.start()
+        self.rtf_timer.timeout.connect(self.report_real_time_factor)
+        self.rtf_timer.start()
 
     # --------------------------------------------------------------------------
     # DRAWING METHODS
@@ -819,9 +862,15 @@ class PlotGraphicsView(QtGui.QGraphicsView):
             self.scene().removeItem(item)
         for item in self.obstacle_items:
             self.scene().removeItem(item)
+        for item in self.tile_items.values():
+            self.scene().removeItem(item)
+        if self.grid_item is not None:
+            self.scene().removeItem(self.grid_item)
+            self.grid_item = None
         self.line_item_map = []
         self.obstacle_items = []
-        self.line_map = []
+        self.tile_items = {}
+        self.line_map.clear()
 
     def draw_laser_beams(self, ranges):
         """Deletes the previously drawn laser polygon and plots the latest laser
@@ -854,20 +903,104 @@ class PlotGraphicsView(QtGui.QGraphicsView):
         beam_color.setAlpha(40)
         self.poly_item.setBrush(beam_color)
 
-    def draw_map_from_file(self, filename):
-        with open(filename, 'r') as f:
-            for line in f:
-                if line[0] != '#':
-                    line.strip()
-                    coord_list = line.split(' ')
-                    x_1, y_1, x_2, y_2 = [float(num) for num in coord_list]
-                    line_item = QtGui.QGraphicsLineItem(x_1, y_1, x_2, y_2)
-                    line_item.setZValue(10)
-                    self.scene().addItem(line_item)
-                    self.line_item_map.append(line_item)
-                    line = mod.get_line_dict(x_1, y_1, x_2, y_2)
-                    self.line_map.append(line)
+    def draw_map_from_file(self, filename, clean=False, simplify=0.0):
+        """Loads and draws a map file. Segment maps are cleaned first if
+        clean is set (see sim.map_clean.clean_segments), reporting what was
+        removed in the status bar."""
+        if is_grid_file(filename):
+            self.draw_grid(load_grid(filename))
+            return
+        if is_tiled_map(filename):
+            # Tiled map: only the tiles around the robot are loaded and drawn
+            self.line_map.load_tiles(filename)
+            self.line_map.move_to(self.robot.pose, self.robot.laser.range)
+            self.draw_tiles()
+            return
+        segments, shapes = load_map(filename)
+        if clean:
+            segments, report = clean_segments(segments, simplify=simplify)
+            self.window().statusBar().showMessage(format_report(report))
+        for x_1, y_1, x_2, y_2 in segments.tolist():
+            line_item = QtGui.QGraphicsLineItem(x_1, y_1, x_2, y_2)
+            line_item.setZValue(10)
+            self.scene().addItem(line_item)
+            self.line_item_map.append(line_item)
+        self.line_map.add_segments(segments)
+        if len(shapes):
+            # All the polylines and polygons as one path item
+            path = QtGui.QPainterPath()
+            vertices = [shapes.shape(i) for i in range(len(shapes))]
+            for shape, closed in zip(vertices, shapes.closed.tolist()):
+                path.moveTo(*shape[0].tolist())
+                for x, y in shape[1:].tolist():
+                    path.lineTo(x, y)
+                if closed:
+                    path.closeSubpath()
+            item = QtGui.QGraphicsPathItem(path)
+            item.setZValue(10)
+            item.setVisible(self.map_visible)
+            self.scene().addItem(item)
+            self.line_item_map.append(item)
+            self.line_map.add_shapes(vertices, shapes.closed)
     
+    def draw_grid(self, grid):
+        """Draws an occupancy grid as a single pixmap (occupied cells black,
+        unknown cells gray) and adds it to the map, replacing any previous
+        grid."""
+        rgba = np.zeros(grid.shape + (4,), dtype=np.uint8) # B, G, R, A
+        rgba[grid.unknown] = (200, 200, 200, 255)
+        rgba[grid.occupied] = (0, 0, 0, 255)
+        rows, cols = grid.shape
+        image = QtGui.QImage(rgba.tobytes(), cols, rows,
+                QtGui.QImage.Format_ARGB32).copy()
+        if self.grid_item is not None:
+            self.scene().removeItem(self.grid_item)
+        # Row 0 is the bottom of the map, and the view's y axis points up
+        self.grid_item = QtGui.QGraphicsPixmapItem(
+                QtGui.QPixmap.fromImage(image))
+        self.grid_item.setPos(*grid.origin)
+        self.grid_item.setScale(grid.resolution)
+        self.grid_item.setZValue(9)
+        self.grid_item.setVisible(self.map_visible)
+        self.scene().addItem(self.grid_item)
+        self.line_map.set_grid(grid)
+
+    def draw_tiles(self):
+        """Draws the active tiles of a tiled map (one path item per tile) and
+        removes the tiles that are no longer active."""
+        tiles = self.line_map.tiles.active_tiles()
+        for key in list(self.tile_items):
+            if key not in tiles:
+                self.scene().removeItem(self.tile_items.pop(key))
+        for key, segments in tiles.items():
+            if key in self.tile_items:
+                continue
+            path = QtGui.QPainterPath()
+            for x_1, y_1, x_2, y_2 in segments.tolist():
+                path.moveTo(x_1, y_1)
+                path.lineTo(x_2, y_2)
+            item = QtGui.QGraphicsPathItem(path)
+            item.setZValue(10)
+            item.setVisible(self.map_visible)
+            self.scene().addItem(item)
+            self.tile_items[key] = item
+
+    def draw_obstacles(self):
+        """Redraws the moving obstacles (as a single path item)."""
+        obstacles = self.line_map.obstacles
+        if self.obstacles_item is None:
+            self.obstacles_item = QtGui.QGraphicsPathItem()
+            self.obstacles_item.setZValue(10)
+            self.obstacles_item.setPen(QtGui.QPen(QtGui.QColor(0, 120, 0)))
+            self.scene().addItem(self.obstacles_item)
+        path = QtGui.QPainterPath()
+        for x_1, y_1, x_2, y_2 in obstacles.segments.tolist():
+            path.moveTo(x_1, y_1)
+            path.lineTo(x_2, y_2)
+        self.obstacles_item.setPath(path)
+        self.obstacles_item.setVisible(self.map_visible)
+        self.obstacles_version = self.line_map.obstacles_version
+
     def draw_polygon(self, x, y, num_edges, diameter, angle):
         poly = QtGui.QPolygonF()
         vertices = []
@@ -882,33 +1015,22 @@ class PlotGraphicsView(QtGui.QGraphicsView):
         obs_color = QtGui.QColor(220, 220, 220)
         obstacle.setBrush(obs_color)
         self.obstacle_items.append(obstacle)
-        # Add lines making up polygon to line map
-        for ind, vert in enumerate(vertices):
-            x_1, y_1 = vert
-            x_2, y_2 = vertices[ind-1]
-            line = mod.get_line_dict(x_1, y_1, x_2, y_2)
-            self.line_map.append(line)
+        # Add the polygon to the line map
+        self.line_map.add_polygon(vertices)
 
     def toggle_map(self, value):
+        self.map_visible = value
+        if self.obstacles_item is not None:
+            self.obstacles_item.setVisible(value)
+        if self.grid_item is not None:
+            self.grid_item.setVisible(value)
+        for item in self.tile_items.values():
+            item.setVisible(value)
         for item in self.line_item_map:
             item.setVisible(value)
         for item in self.obstacle_items:
             item.setVisible(value)
     # --------------------------------------------------------------------------
-    # ROS METHODS
-    # --------------------------------------------------------------------------
-    def publish_laser_msg(self, ranges):
-        msg = LaserScan()
-        msg.angle_min = self.robot.laser.min_angle
-        msg.angle_max = self.robot.laser.max_angle
-        msg.angle_increment = self.robot.laser.resolution
-        msg.range_min = 0.0
-        msg.range_max = self.robot.laser.range
-        msg.ranges = ranges
-        msg.header.stamp = rospy.Time.now()
-        self.laser_publisher.publish(msg)
-
-    # --------------------------------------------------------------------------
     # UTILITY METHODS
     # --------------------------------------------------------------------------
     def set_scale(self, value):
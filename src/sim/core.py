@@ -0,0 +1,185 @@
+# Python imports
+import time
+
+# MSL Sim imports
+import sim.defaults as d
+import sim.model as mod
+from sim.clock import SimClock
+from sim.line_map import LineMap
+from sim.overload import OverloadPolicy, RESOLUTION, SKIP
+from sim.snapshot import fork, restore_snapshot, take_snapshot
+
+
+class Simulation(object):
+    """The robot and the map it drives in, independent of any GUI. Each
+    *_update method takes one measurement (or moves the robot), hands it to
+    the publisher if there is one, and returns it. The GUI calls them from its
+    timers and the headless runner from its own loop, each at the frequency
+    given by the frequencies method. Whatever calls them also keeps clock at
+    the sim time they happen at, which the publisher stamps messages with.
+
+    Calling them through update instead lets the sensors in overload (a
+    dictionary of OverloadPolicy by update name) shed load when they take
+    longer than their period allows at real_time_factor times real time (0
+    for no limit). The updates in HARD_REAL_TIME never shed load, and are
+    run first when several are due at once."""
+    HARD_REAL_TIME = ('gyro', 'odometry')
+
+    def __init__(self, robot=None, line_map=None, publisher=None, clock=None):
+        self.robot = robot if robot is not None else mod.Robot()
+        self.line_map = line_map if line_map is not None else LineMap()
+        self.clock = clock if clock is not None else SimClock()
+        self.publisher = publisher
+        if publisher is not None:
+            publisher.clock = self.clock
+        self.real_time_factor = 1.0
+        self.overload = {'compass': OverloadPolicy(d.COMPASS_OVERLOAD),
+                'gps': OverloadPolicy(d.GPS_OVERLOAD),
+                'laser': OverloadPolicy(d.LASER_OVERLOAD)}
+
+    def frequencies(self):
+        """Returns a dictionary of how often [Hz] each update should run,
+        keyed by the name of the update method without its '_update', with
+        the rates lowered by overload policies."""
+        freqs = {'clock': d.CLOCK_FREQ,
+                'compass': self.robot.compass.freq,
+                'gps': self.robot.gps.freq,
+                'ground_truth': d.GROUND_TRUTH_FREQ,
+                'gyro': self.robot.gyroscope.freq,
+                'laser': self.robot.laser.freq,
+                'obstacles': d.OBSTACLE_FREQ,
+                'odometry': self.robot.odometer.freq}
+        for name, policy in self.overload.items():
+            freqs[name] /= float(policy.rate_divisor)
+        return freqs
+
+    def snapshot(self):
+        """Returns the state of the simulation as bytes (see
+        sim.snapshot)."""
+        return take_snapshot(self)
+
+    def restore(self, blob):
+        """Restores the state of the simulation from a snapshot."""
+        restore_snapshot(self, blob)
+
+    def fork(self, blob, functions, processes=None):
+        """Calls each of functions with this simulation restored from a
+        snapshot, each in its own child process, and returns what they
+        return (see sim.snapshot.fork)."""
+        return fork(self, blob, functions, processes)
+
+    def set_velocity(self, vel, ang_vel):
+        """Sets the robot's velocities, within its limits."""
+        robot = self.robot
+        robot.vel = min(max(vel, -robot.max_vel), robot.max_vel)
+        robot.ang_vel = min(max(ang_vel, -robot.max_ang_vel),
+                robot.max_ang_vel)
+
+    def set_overload(self, name, policy):
+        """Sets the overload policy ('skip', 'resolution' or 'rate', or None
+        for none) of the update of the given name."""
+        if name in self.HARD_REAL_TIME:
+            raise ValueError('%s updates never shed load' % name)
+        if policy == RESOLUTION and name != 'laser':
+            raise ValueError('Only the laser can lower its resolution')
+        self.__restore(name)
+        if policy is None:
+            self.overload.pop(name, None)
+        else:
+            self.overload[name] = OverloadPolicy(policy)
+
+    def update(self, name):
+        """Calls the update of the given name (e.g. 'laser' for laser_update)
+        and returns what it returns, or None if its overload policy skips
+        it. Updates with a policy are timed, and every change in how much
+        they are degraded is published."""
+        update = getattr(self, name + '_update')
+        policy = self.overload.get(name)
+        if policy is None or not self.real_time_factor:
+            return update()
+        if policy.skip():
+            return None
+        start = time.time()
+        result = update()
+        period = 1.0 / (self.frequencies()[name] * self.real_time_factor)
+        level = policy.record(time.time() - start, period)
+        if level is not None:
+            self.__degrade(name, policy)
+        return result
+
+    def __degrade(self, name, policy):
+        """Applies (and publishes) a new level of degradation."""
+        if policy.policy == RESOLUTION:
+            if policy.base is None:
+                policy.base = self.robot.laser.resolution
+            self.robot.laser.resolution = policy.base * 2**policy.level
+            if policy.level == 0:
+                policy.base = None
+        if self.publisher is not None:
+            self.publisher.publish_degradation(name, policy.policy,
+                    policy.level, policy.duration, policy.allowed)
+
+    def __restore(self, name):
+        """Undoes the degradation of the update of the given name."""
+        policy = self.overload.get(name)
+        if policy is not None and policy.level > 0:
+            policy.level = 0
+            if policy.policy != SKIP:
+                self.__degrade(name, policy)
+
+    def clock_update(self):
+        """Publishes the sim time on /clock."""
+        if self.publisher is not None:
+            self.publisher.publish_clock(self.clock.time)
+        return self.clock.time
+
+    def compass_update(self):
+        bearing = self.robot.compass.read(self.robot.heading)
+        if self.publisher is not None:
+            self.publisher.publish_compass(bearing)
+        return bearing
+
+    def gps_update(self):
+        fix = self.robot.gps.read(self.robot.x, self.robot.y)
+        if fix is not None and self.publisher is not None:
+            self.publisher.publish_gps(*fix)
+        return fix
+
+    def ground_truth_update(self):
+        pose = self.robot.pose
+        if self.publisher is not None:
+            self.publisher.publish_ground_truth(*pose)
+        return pose
+
+    def gyro_update(self):
+        angular_velocity = self.robot.gyroscope.read(self.robot.ang_vel)
+        if self.publisher is not None:
+            self.publisher.publish_gyro(angular_velocity)
+        return angular_velocity
+
+    def laser_update(self):
+        self.line_map.move_to(self.robot.pose, self.robot.laser.range)
+        ranges = self.robot.scan_laser(self.line_map)
+        if self.publisher is not None:
+            self.publisher.publish_scan(self.robot.laser, ranges)
+        return ranges
+
+    def obstacles_update(self):
+        """Moves the map's moving obstacles one period along."""
+        self.line_map.obstacles.step(1.0/d.OBSTACLE_FREQ)
+
+    def odometry_update(self):
+        """Applies any velocity command received by the publisher (see
+        SocketPublisher) and moves the robot one period along."""
+        command = self.publisher.take_command() \
+                if hasattr(self.publisher, 'take_command') else None
+        if command is not None:
+            self.set_velocity(*command)
+        encoders = self.robot.update_pose(line_map=self.line_map)
+        if self.robot.collision is not None and self.publisher is not None:
+            pose, segment = self.robot.collision
+            self.publisher.publish_collision(pose, segment)
+        self.line_map.move_to(self.robot.pose, self.robot.laser.range)
+        if encoders is not None and self.publisher is not None:
+            self.publisher.publish_encoders(*encoders)
+        return encoders
@@ -5,6 +5,7 @@
 # Default custom
 COMPASS_NOISE = 1 # standard deviation [deg]
 COMPASS_FREQUENCY = 10 # [Hz]
+COMPASS_OVERLOAD = 'skip' # 'skip' frames or halve the 'rate' when overrunning
 
 # ------------------------------------------------------------------------------
 # GPS
@@ -13,6 +14,7 @@ COMPASS_FREQUENCY = 10 # [Hz]
 # Default custom
 GPS_NOISE = 0.5 # standard deviation [m]
 GPS_FREQUENCY = 10 # [Hz]
+GPS_OVERLOAD = 'skip' # 'skip' frames or halve the 'rate' when overrunning
 
 # ------------------------------------------------------------------------------
 # GYROSCOPE
@@ -26,29 +28,16 @@ GYRO_FREQUENCY = 30 # [Hz]
 # LASER
 # ------------------------------------------------------------------------------
 
-# Default custom
+# Default custom (presets of real hardware are in the presets directory)
 LASER_MIN_ANGLE = 0 # minimum angle [deg]
 LASER_MAX_ANGLE = 180 # maximum angle [deg]
 LASER_RES = 0.5 # angular resolution [deg]
 LASER_RANGE = 5.0 # range [m]
 LASER_NOISE = 0.02 # standard deviation on range measurement [m]
 LASER_FREQ = 15 # how often the laser is scanned [Hz]
-
-# SICK LMS111
-SICK_111_MIN_ANGLE = -135 # [deg]
-SICK_111_MAX_ANGLE = 135 # [deg]
-SICK_111_RES = 0.25 # [deg]
-SICK_111_RANGE = 20 # [m]
-SICK_111_NOISE = 0.02 # [m]
-SICK_111_FREQ = 5 # [Hz] # Actually 25, smaller to reduce slowdown for now
-
-# Hokuyo URG-04LX
-HOK_04_MIN_ANGLE = -120 # [deg]
-HOK_04_MAX_ANGLE = 120 # [deg]
-HOK_04_RES = 0.36 # [deg]
-HOK_04_RANGE = 4.095 # [m]
-HOK_04_NOISE = 0.02 # [m] (in reality, 1% of measurement, 2 cm is half range)
-HOK_04_FREQ = 10 # [Hz]
+LASER_SCAN_TIME = 0.0 # time taken to sweep the beams of one scan [s]
+LASER_ENGINE = 'rays' # 'rays' (beams against segments) or 'sweep' (visibility)
+LASER_OVERLOAD = 'skip' # 'skip' frames, or halve the 'resolution' or 'rate'
 
 # ------------------------------------------------------------------------------
 # ODOMETER
@@ -63,7 +52,7 @@ ODOM_NOISE = 0.5 # ticks
 # ROBOT
 # ------------------------------------------------------------------------------
 
-# Default custom
+# Default custom (presets of real hardware are in the presets directory)
 ROBOT_INIT_POSE = (0, 0, 0) # (x, y, heading) [m, m, rad]
 ROBOT_WIDTH = 0.5 # [m]
 ROBOT_LENGTH = 0.8 # [m]
@@ -71,22 +60,7 @@ ROBOT_WHEELBASE = 0.5 # [m]
 ROBOT_WHEEL_RAD = 0.2 # [m]
 ROBOT_MAX_VEL = 1.0 # [m/s]
 ROBOT_MAX_ANG_VEL = 30 # [deg/s]
-
-# Clearpath Husky A200
-HUSKY_WIDTH = 0.670 # [m]
-HUSKY_LENGTH = 0.990 # [m]
-HUSKY_WHEELBASE = 0.545 # [m]
-HUSKY_WHEEL_RAD = 0.165 # [m]
-HUSKY_MAX_VEL = 1.0 # [m/s]
-HUSKY_MAX_ANG_VEL = 154 # [deg/s]
-
-# MobileRobots P3AT
-P3AT_WIDTH = 0.497 # [m]
-P3AT_LENGTH = 0.508 # [m]
-P3AT_WHEELBASE = 0.381 # [m]
-P3AT_WHEEL_RAD = 0.111 # [m]
-P3AT_MAX_VEL = 0.7 # [m/s]
-P3AT_MAX_ANG_VEL = 148 # [deg/s]
+ROBOT_MAX_STEP_ANGLE = 5 # largest heading change per integration sub-step [deg]
 
 # ------------------------------------------------------------------------------
 # MISCELLANEOUS
@@ -96,6 +70,45 @@ P3AT_MAX_ANG_VEL = 148 # [deg/s]
 MAP_WIDTH = 25 # [m]
 MAP_HEIGHT = 25 # [m]
 PLOT_FREQ = 10 # how often the plot is refreshed [Hz]
+GROUND_TRUTH_FREQ = 10 # how often the true pose is published [Hz]
+
+# Sim clock
+CLOCK_FREQ = 100 # how often the sim time is published on /clock [Hz]
+REAL_TIME_FACTOR = 1.0 # headless: target sim time per wall time (0: no limit)
+RTF_WINDOW = 2.0 # wall time the achieved real-time factor is measured over [s]
+RTF_MAX_LAG = 0.5 # lag behind schedule after which the governor resets [s]
+RTF_REPORT_PERIOD = 5.0 # how often the achieved factor is reported [s]
+
+# Publishing
+PUBLISH_QUEUE_SIZE = 10 # messages queued per topic for the publishing thread
+PUBLISH_DROP = 'oldest' # dropped from a full queue: 'oldest' or 'newest'
+
+# Shared memory output
+SHM_PREFIX = 'msl_sim' # the ring of each topic is named <prefix>_<topic>
+SHM_SLOTS = 64 # samples kept in each ring
+SHM_SCAN_CAPACITY = 4096 # most ranges in a scan sample
+SHM_POLL = 0.001 # how often readers waiting for a sample check for it [s]
+
+# Socket stream
+STREAM_ADDRESS = '127.0.0.1:11411' # 'host:port', or the path of a Unix socket
+STREAM_QUEUE_SIZE = 100 # frames queued for each client
+
+# Load shedding of overrunning sensor updates
+OVERLOAD_BUDGET = 0.5 # share of its period an update may take
+OVERLOAD_MAX_LEVEL = 3 # most halvings of a resolution or rate
+OVERLOAD_RECOVERY = 10 # quick updates in a row before a halving is undone
+
+# Tiled maps
+TILE_MEMORY_BUDGET = 64 # memory the paged-in tiles may use [MB]
+TILE_MARGIN = 5.0 # extra distance beyond the laser range to page in [m]
+
+# Spatial index and moving obstacles
+INDEX_CELL_SIZE = 2.0 # size of the cells of the spatial index [m]
+OBSTACLE_FREQ = 10 # how often moving obstacles are moved [Hz]
+
+# Range cache
+RANGE_CACHE_RES = 0.05 # cell size of the distance field and lookup table [m]
+RANGE_CACHE_MEMORY = 512 # memory the precomputed tables may use [MB]
 
 # Other
 VELOCITY_INCREMENT = 0.1 # amount the velocity changes per key press [m/s]
@@ -0,0 +1,248 @@
+"""Occupancy grid maps, as saved by the ROS map_server (a PGM image and a
+YAML file describing it), and conversion to and from segment maps."""
+# Python imports
+import argparse
+import os
+from math import ceil
+import numpy as np
+
+# MSL Sim imports
+from sim.line_map import load_map_file, save_map_file
+
+# map_server defaults
+OCCUPIED_THRESH = 0.65
+FREE_THRESH = 0.196
+GRID_RES = 0.05 # resolution of grids made from segment maps [m/cell]
+GRID_PADDING = 1.0 # free border around grids made from segment maps [m]
+UNKNOWN = 205 # PGM value of unknown cells
+CAST_CHUNK = 1 << 22 # most cell crossings tested at once
+
+
+def read_pgm(filename):
+    """Returns the pixels of a binary (P5) or plain (P2) PGM image as an
+    array, top row first."""
+    with open(filename, 'rb') as f:
+        data = f.read()
+    fields = []
+    pos = 0
+    while len(fields) < 4:
+        while data[pos:pos + 1].isspace():
+            pos += 1
+        if data[pos:pos + 1] == b'#':
+            pos = data.index(b'\n', pos)
+            continue
+        end = pos
+        while not data[end:end + 1].isspace():
+            end += 1
+        fields.append(data[pos:end])
+        pos = end
+    magic, width, height, maxval = (fields[0], int(fields[1]), int(fields[2]),
+            int(fields[3]))
+    if magic == b'P5':
+        dtype = np.uint8 if maxval < 256 else np.dtype('>u2')
+        pixels = np.frombuffer(data, dtype, width*height, pos + 1)
+    elif magic == b'P2':
+        pixels = np.array(data[pos:].split()[:width*height], dtype=int)
+    else:
+        raise ValueError('%s is not a PGM image' % filename)
+    return pixels.reshape(height, width), maxval
+
+
+def write_pgm(filename, pixels):
+    """Writes an array of 8 bit pixels, top row first, as a binary PGM."""
+    height, width = pixels.shape
+    with open(filename, 'wb') as f:
+        f.write(('P5\n%d %d\n255\n' % (width, height)).encode('ascii'))
+        f.write(np.asarray(pixels, dtype=np.uint8).tobytes())
+
+
+class OccupancyGrid(object):
+    """A map of square cells. occupied is a boolean array indexed by (row,
+    column), where row 0 is the bottom (smallest y) of the map, unknown marks
+    the cells never observed (treated as free by the laser), and origin is the
+    (x, y) [m] of the bottom left corner of cell (0, 0)."""
+    def __init__(self, occupied, resolution, origin=(0.0, 0.0), unknown=None):
+        self.occupied = np.asarray(occupied, dtype=bool)
+        self.resolution = float(resolution)
+        self.origin = (float(origin[0]), float(origin[1]))
+        self.unknown = (np.zeros_like(self.occupied) if unknown is None
+                else np.asarray(unknown, dtype=bool))
+
+    @property
+    def shape(self):
+        return self.occupied.shape
+
+    def cast(self, origins, angles, max_range):
+        """Casts rays from (N, 2) origins at N angles [rad] through the grid
+        and returns the distance each travels before entering an occupied
+        cell (inf if it does not within max_range).
+
+        All rays are marched at once: the distances at which a ray crosses
+        the vertical and the horizontal cell boundaries are arithmetic
+        sequences, so every crossing up to max_range is computed as one array
+        and the nearest one entering an occupied cell is the range."""
+        origins = np.asarray(origins, dtype=float).reshape(-1, 2)
+        angles = np.asarray(angles, dtype=float).reshape(-1)
+        ranges = np.full(len(angles), np.inf)
+        steps = int(ceil(max_range/self.resolution)) + 1
+        chunk = max(1, CAST_CHUNK // (2*steps))
+        for start in range(0, len(angles), chunk):
+            part = slice(start, start + chunk)
+            ranges[part] = np.minimum(
+                    self.__crossings(origins[part], angles[part], steps, 0),
+                    self.__crossings(origins[part], angles[part], steps, 1))
+        ranges[ranges >= max_range] = np.inf
+        return ranges
+
+    def __crossings(self, origins, angles, steps, axis):
+        """Returns the distance to the first crossing of a boundary
+        perpendicular to axis (0 for x, 1 for y) into an occupied cell."""
+        res = self.resolution
+        direction = np.column_stack((np.cos(angles), np.sin(angles)))
+        # Position in cells
+        cells = (origins - self.origin) / res
+        along = direction[:, axis]
+        sign = np.where(along >= 0, 1, -1)
+        first = np.floor(cells[:, axis]) + (sign > 0) # first boundary crossed
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # Distance [m] to each boundary crossing
+            t = ((first[:, None] + sign[:, None]*np.arange(steps) -
+                cells[:, axis, None]) * res / along[:, None])
+        t[~np.isfinite(t)] = np.inf
+        # Cell entered at each crossing
+        index = [None, None]
+        index[axis] = (first[:, None] + sign[:, None]*np.arange(steps) -
+                (sign[:, None] < 0)).astype(np.int64)
+        other = 1 - axis
+        index[other] = np.floor(cells[:, other, None] +
+                np.where(np.isfinite(t), t, 0)*direction[:, other, None]/res
+                ).astype(np.int64)
+        rows, cols = self.occupied.shape
+        col, row = index
+        inside = (row >= 0) & (row < rows) & (col >= 0) & (col < cols)
+        hit = np.zeros(t.shape, dtype=bool)
+        hit[inside] = self.occupied[row[inside], col[inside]]
+        return np.where(hit, t, np.inf).min(axis=1)
+
+    def to_segments(self):
+        """Returns the (M, 4) segments outlining the occupied cells, with the
+        cell edges along each row or column of boundaries merged into single
+        segments."""
+        occupied = np.pad(self.occupied, 1, 'constant')
+        res = self.resolution
+        ox, oy = self.origin
+        segments = []
+        # Horizontal edges lie between rows, vertical edges between columns
+        for edges, horizontal in ((occupied[1:, :] != occupied[:-1, :], True),
+                (occupied[:, 1:] != occupied[:, :-1], False)):
+            if not horizontal:
+                edges = edges.T
+            # Runs of edges along each boundary line
+            padded = np.pad(edges, ((0, 0), (1, 1)), 'constant').astype(np.int8)
+            change = np.diff(padded, axis=1)
+            line, start = np.nonzero(change == 1)
+            _, stop = np.nonzero(change == -1)
+            # Offsets account for the padding cell
+            across = (line * res) + (oy if horizontal else ox)
+            first = (start - 1) * res + (ox if horizontal else oy)
+            last = (stop - 1) * res + (ox if horizontal else oy)
+            if horizontal:
+                segments.append(np.column_stack((first, across, last, across)))
+            else:
+                segments.append(np.column_stack((across, first, across, last)))
+        return np.vstack(segments)
+
+
+def grid_extent(segments, resolution=GRID_RES, padding=GRID_PADDING):
+    """Returns the origin (x, y) [m] and the shape (rows, columns) of a grid
+    covering segments plus padding [m]."""
+    if len(segments):
+        low = segments.reshape(-1, 2).min(axis=0) - padding
+        high = segments.reshape(-1, 2).max(axis=0) + padding
+    else:
+        low, high = np.full(2, -padding), np.full(2, padding)
+    cols, rows = np.ceil((high - low) / resolution).astype(int)
+    return low, (rows, cols)
+
+
+def grid_from_segments(segments, resolution=GRID_RES, padding=GRID_PADDING):
+    """Returns an OccupancyGrid with the cells each segment passes through
+    occupied, covering the segments plus padding [m]."""
+    segments = np.asarray(segments, dtype=float).reshape(-1, 4)
+    low, (rows, cols) = grid_extent(segments, resolution, padding)
+    occupied = np.zeros((rows, cols), dtype=bool)
+    # Points every half cell along each segment mark a connected run of cells
+    lengths = np.hypot(segments[:, 2] - segments[:, 0],
+            segments[:, 3] - segments[:, 1])
+    counts = np.ceil(lengths / (resolution/2.0)).astype(int) + 1
+    owner = np.repeat(np.arange(len(segments)), counts)
+    fraction = ((np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts,
+        counts)) / np.maximum(np.repeat(counts, counts) - 1, 1).astype(float))
+    start = segments[owner, 0:2]
+    points = start + (segments[owner, 2:4] - start) * fraction[:, None]
+    col, row = np.floor((points - low) / resolution).astype(int).T
+    occupied[row, col] = True
+    return OccupancyGrid(occupied, resolution, low)
+
+
+def load_grid(filename):
+    """Loads an occupancy grid from a map_server YAML file and its image."""
+    import yaml
+    with open(filename) as f:
+        info = yaml.safe_load(f)
+    image = os.path.join(os.path.dirname(os.path.abspath(filename)),
+            info['image'])
+    pixels, maxval = read_pgm(image)
+    # Bottom row first, then the probability each cell is occupied
+    pixels = pixels[::-1].astype(float)
+    occupancy = pixels / maxval if info.get('negate', 0) else \
+            (maxval - pixels) / maxval
+    occupied = occupancy > info.get('occupied_thresh', OCCUPIED_THRESH)
+    free = occupancy < info.get('free_thresh', FREE_THRESH)
+    return OccupancyGrid(occupied, info['resolution'], info['origin'][:2],
+            unknown=~(occupied | free))
+
+
+def save_grid(filename, grid):
+    """Saves an occupancy grid as a map_server YAML file and a PGM image
+    (with the same name) next to it."""
+    image = os.path.splitext(filename)[0] + '.pgm'
+    pixels = np.full(grid.shape, 254, dtype=np.uint8)
+    pixels[grid.unknown] = UNKNOWN
+    pixels[grid.occupied] = 0
+    write_pgm(image, pixels[::-1])
+    with open(filename, 'w') as f:
+        f.write('image: %s\n' % os.path.basename(image))
+        f.write('resolution: %r\n' % grid.resolution)
+        f.write('origin: [%r, %r, 0.0]\n' % grid.origin)
+        f.write('negate: 0\n')
+        f.write('occupied_thresh: %r\n' % OCCUPIED_THRESH)
+        f.write('free_thresh: %r\n' % FREE_THRESH)
+
+
+def is_grid_file(filename):
+    return filename.endswith(('.yaml', '.yml'))
+
+
+def convert_main(argv=None):
+    parser = argparse.ArgumentParser(description='Convert a segment map to '
+            'an occupancy grid, or an occupancy grid to a segment map.')
+    parser.add_argument('source', help='map to convert (.txt, .npy or .yaml)')
+    parser.add_argument('destination', help='map to write (.txt, .npy or '
+            '.yaml, written with a .pgm image)')
+    parser.add_argument('--resolution', type=float, default=GRID_RES,
+            help='size of the grid cells [m]')
+    parser.add_argument('--padding', type=float, default=GRID_PADDING,
+            help='free border around the segments [m]')
+    args = parser.parse_args(argv)
+    if is_grid_file(args.source):
+        grid = load_grid(args.source)
+        segments = None
+    else:
+        segments = load_map_file(args.source)
+        grid = grid_from_segments(segments, args.resolution, args.padding)
+    if is_grid_file(args.destination):
+        save_grid(args.destination, grid)
+    else:
+        save_map_file(args.destination, grid.to_segments()
+                if segments is None else segments)
@@ -0,0 +1,118 @@
+# Python imports
+import heapq
+import time
+
+# MSL Sim imports
+import sim.defaults as d
+from sim.clock import RealTimeGovernor
+from sim.core import Simulation
+from sim.grid_map import is_grid_file, load_grid
+from sim.line_map import LineMap, is_tiled_map, load_map
+from sim.map_clean import clean_segments, format_report
+from sim.noise import install_noise_models
+from sim.obstacles import load_obstacles
+from sim.publishers import create_publisher
+
+
+class HeadlessRunner(object):
+    """Runs a Simulation without the GUI (and without importing PySide). Each
+    update is called at its own frequency (in sim time) from a single event
+    loop, with the sim clock set to the time it is due; frequencies are
+    re-read after every call so changes take effect. The governor paces the
+    loop at rtf times real time (as fast as possible if 0 or None), and the
+    real-time factor achieved is reported every report_period seconds. At a
+    set rtf, sensors that overrun their period shed load (see
+    Simulation.update)."""
+    def __init__(self, sim, rtf=d.REAL_TIME_FACTOR,
+            report_period=d.RTF_REPORT_PERIOD):
+        self.sim = sim
+        self.governor = RealTimeGovernor(rtf)
+        self.report_period = report_period
+
+    def report(self):
+        """Prints (and publishes) the real-time factor achieved, and the
+        publishing statistics if there are any."""
+        factor = self.governor.achieved
+        publisher = self.sim.publisher
+        if publisher is not None:
+            publisher.publish_real_time_factor(factor)
+        print('sim time %.1f s, real-time factor %.2f' % (self.sim.clock.time,
+            factor))
+        summary = publisher.summary() if hasattr(publisher, 'summary') else ''
+        if summary:
+            print('published: ' + summary)
+
+    def run(self, duration=None):
+        """Runs the simulation for duration seconds of sim time (forever if
+        None)."""
+        start = self.sim.clock.time
+        # Hard real-time updates go first when several are due at once
+        priority = dict((name, int(name not in self.sim.HARD_REAL_TIME))
+                for name in self.sim.frequencies())
+        queue = [(start, priority[name], name) for name in sorted(priority)]
+        heapq.heapify(queue)
+        self.sim.real_time_factor = self.governor.target or 0.0
+        self.governor.start(start)
+        next_report = time.time() + self.report_period
+        while queue:
+            due, rank, name = heapq.heappop(queue)
+            if duration is not None and due - start > duration:
+                break
+            self.governor.wait(due)
+            self.sim.clock.set(due)
+            self.sim.update(name)
+            heapq.heappush(queue,
+                    (due + 1.0/self.sim.frequencies()[name], rank, name))
+            if time.time() >= next_report:
+                self.report()
+                next_report = time.time() + self.report_period
+
+
+def run(map_file=None, duration=None, vel=0.0, ang_vel=0.0,
+        transports=('ros',), range_cache=False, lut_bins=0,
+        obstacles_file=None, noise_models=False, seed=None, clean_map=False,
+        simplify=0.0, rtf=d.REAL_TIME_FACTOR, laser_overload=d.LASER_OVERLOAD,
+        transport_options=None):
+    """Runs a headless simulation of the default robot driving with constant
+    velocities in the given map, publishing on each of the transports (see
+    sim.publishers.create_publisher, with transport_options). With
+    range_cache, the ranges of the map are precomputed first (see
+    sim.range_cache). obstacles_file adds moving obstacles (see
+    sim.obstacles.load_obstacles). noise_models gives the sensors the noise
+    models of sim.noise, seeded with seed. clean_map cleans a segment map as
+    it is loaded (see sim.map_clean.clean_segments), simplifying it with a
+    tolerance of simplify [m] if not 0. The simulation runs at rtf times real
+    time, or as fast as possible if rtf is 0, and the laser sheds load by
+    the laser_overload policy (see sim.overload) when it cannot keep up."""
+    publisher = create_publisher(transports, transport_options)
+    if publisher is not None:
+        publisher.start()
+    line_map = LineMap()
+    if map_file and is_grid_file(map_file):
+        line_map.set_grid(load_grid(map_file))
+    elif map_file and is_tiled_map(map_file):
+        line_map.load_tiles(map_file)
+    elif map_file:
+        segments, shapes = load_map(map_file)
+        if clean_map:
+            segments, report = clean_segments(segments, simplify=simplify)
+            print(format_report(report))
+        line_map.add_segments(segments)
+        line_map.add_shapes([shapes.shape(i) for i in range(len(shapes))],
+                shapes.closed)
+    if obstacles_file:
+        load_obstacles(obstacles_file, line_map.obstacles)
+    sim = Simulation(line_map=line_map, publisher=publisher)
+    sim.set_overload('laser', laser_overload)
+    if range_cache:
+        line_map.precompute(sim.robot.laser.range, theta_bins=lut_bins)
+    if noise_models:
+        install_noise_models(sim.robot, seed)
+    sim.robot.vel = vel
+    sim.robot.ang_vel = ang_vel
+    try:
+        HeadlessRunner(sim, rtf).run(duration)
+    finally:
+        if publisher is not None:
+            publisher.stop()
+    return sim
@@ -0,0 +1,432 @@
+# Python imports
+import os
+import struct
+import numpy as np
+
+# MSL Sim imports
+from sim.obstacles import DynamicObstacles
+from sim.raycast import segment_distances
+from sim.shapes import Shapes
+from sim.spatial import SpatialIndex
+
+# Number of rows formatted at once when writing text map files
+WRITE_CHUNK = 100000
+# Size of the .npy header written by MapStreamWriter, which is rewritten with
+# the final number of segments when the map is closed
+NPY_HEADER_SIZE = 128
+
+
+def load_map(filename):
+    """Returns a tuple (segments, shapes) of the (M, 4) array of line segments
+    (x1 y1 x2 y2) and the Shapes (polylines and polygons, see sim.shapes) in
+    a map file. Binary maps (.npy) hold the segment array itself. In text
+    maps, lines beginning with '#' are ignored, as are any columns after the
+    fourth of a segment (e.g. the direction written by
+    random_wall_generator.py), and lines beginning with 'polyline' or
+    'polygon' list the x y coordinates of a shape's vertices."""
+    shapes = Shapes()
+    if filename.endswith('.npy'):
+        return np.load(filename).reshape(-1, 4), shapes
+    try:
+        segments = np.loadtxt(filename, comments='#', usecols=(0, 1, 2, 3),
+                ndmin=2)
+        return segments.reshape(-1, 4), shapes
+    except ValueError:
+        pass # the map has shapes
+    rows, vertices, closed = [], [], []
+    with open(filename) as f:
+        lines = f.read().splitlines()
+    for line in lines:
+        fields = line.split('#', 1)[0].split()
+        if not fields:
+            continue
+        if fields[0] in ('polyline', 'polygon'):
+            vertices.append(np.array(fields[1:], dtype=float))
+            closed.append(fields[0] == 'polygon')
+        else:
+            rows.append([float(v) for v in fields[:4]])
+    shapes.extend(vertices, closed)
+    return np.array(rows, dtype=float).reshape(-1, 4), shapes
+
+
+def load_map_file(filename):
+    """Returns an (M, 4) array of all the line segments in a map file (see
+    load_map), including the edges of its shapes."""
+    segments, shapes = load_map(filename)
+    if len(shapes):
+        segments = np.vstack((segments, shapes.segments()))
+    return segments
+
+
+def save_map_file(filename, segments, comments=(), extra_columns=(),
+        shapes=None):
+    """Writes an (M, 4) array of segments and, optionally, Shapes to a map
+    file: a binary map if the filename ends in .npy (holding the edges of the
+    shapes as segments), otherwise a text map with one 'x1 y1 x2 y2' line per
+    segment and one 'polyline'/'polygon' line per shape (to the nearest cm),
+    preceded by the given comment lines. extra_columns is a list of (values,
+    format) pairs of additional columns for the segments of text maps."""
+    segments = np.asarray(segments, dtype=float).reshape(-1, 4)
+    if filename.endswith('.npy'):
+        if shapes is not None and len(shapes):
+            segments = np.vstack((segments, shapes.segments()))
+        np.save(filename, segments)
+        return
+    columns = [segments] + [np.asarray(values, dtype=float).reshape(-1, 1)
+            for values, _ in extra_columns]
+    table = np.hstack(columns)
+    row_format = ' '.join(['%0.2f'] * 4 + [fmt for _, fmt in extra_columns])
+    with open(filename, 'w') as f:
+        for comment in comments:
+            f.write('# %s\n' % comment)
+        # Format many rows with a single % operation (much faster than a
+        # write per line)
+        for start in range(0, len(table), WRITE_CHUNK):
+            chunk = table[start:start + WRITE_CHUNK]
+            f.write(((row_format + '\n') * len(chunk)) % tuple(chunk.ravel()))
+        for i in range(len(shapes) if shapes is not None else 0):
+            vertices = shapes.shape(i)
+            f.write(('polygon' if shapes.closed[i] else 'polyline') +
+                    ' %0.2f' * vertices.size % tuple(vertices.ravel()) + '\n')
+
+
+def tile_keys(segments, tile_size):
+    """Returns the (N, 2) integer (column, row) of the square tile holding
+    the midpoint of each segment."""
+    middle = (segments[:, 0:2] + segments[:, 2:4]) / 2.0
+    return np.floor(middle / tile_size).astype(np.int64)
+
+
+def write_tile_index(filename, keys, tile_size, max_half_length):
+    """Writes the tile index of a map file given the tile of each of its
+    segments (see MapStreamWriter for the format)."""
+    ids = np.lexsort((keys[:, 1], keys[:, 0]))
+    keys = keys[ids]
+    starts = np.flatnonzero(np.any(np.diff(keys, axis=0) != 0, axis=1)) + 1
+    starts = np.concatenate(([0], starts)) if len(keys) else starts
+    np.savez(tile_index_file(filename), tile_size=tile_size,
+            tiles=keys[starts], offsets=np.append(starts, len(keys)),
+            ids=ids.astype(np.uint32 if len(ids) < 2**32 else np.int64),
+            max_half_length=max_half_length)
+
+
+def build_tile_index(filename, tile_size, chunk_size=WRITE_CHUNK):
+    """Writes a tile index for a binary (.npy) map file, reading the map a
+    chunk at a time."""
+    segments = np.load(filename, mmap_mode='r')
+    keys = []
+    max_half_length = 0.0
+    for start in range(0, len(segments), chunk_size):
+        chunk = np.asarray(segments[start:start + chunk_size])
+        keys.append(tile_keys(chunk, tile_size))
+        max_half_length = max(max_half_length, np.hypot(chunk[:, 2] -
+            chunk[:, 0], chunk[:, 3] - chunk[:, 1]).max() / 2.0)
+    keys = np.vstack(keys) if keys else np.zeros((0, 2), dtype=np.int64)
+    write_tile_index(filename, keys, tile_size, max_half_length)
+
+
+def tile_index_file(filename):
+    """Returns the name of the tile index file that goes with a map file."""
+    return filename.rsplit('.', 1)[0] + '.tiles.npz'
+
+
+def is_tiled_map(filename):
+    """Returns whether a map file is loaded as a tiled map: a binary map with
+    a tile index."""
+    return filename.endswith('.npy') and \
+            os.path.exists(tile_index_file(filename))
+
+
+def load_tile_index(filename):
+    """Returns the tile index of a map file (see MapStreamWriter) as a
+    dictionary, or None if it has none."""
+    try:
+        with np.load(tile_index_file(filename)) as index:
+            return dict((key, index[key]) for key in index.files)
+    except (IOError, OSError):
+        return None
+
+
+class MapStreamWriter(object):
+    """Writes a map file a chunk of segments at a time, so maps too large to
+    hold in memory can be generated. Binary (.npy) maps are written with a
+    placeholder header that is filled in when the writer is closed. If a
+    tile_size is given and the map is binary, each segment is assigned to the
+    square tile holding its midpoint, and a tile index is written alongside
+    the map (see tile_index_file) with these arrays:
+
+    tile_size       -- the edge length of the tiles [m]
+    tiles           -- (T, 2) integer (column, row) of each non-empty tile
+    offsets         -- (T + 1,) the ids of tile i are
+                       ids[offsets[i]:offsets[i+1]]
+    ids             -- (M,) the segment ids (row numbers), grouped by tile
+    max_half_length -- half the length of the longest segment [m], by which
+                       a segment can reach outside its tile
+    """
+    def __init__(self, filename, tile_size=None):
+        self.filename = filename
+        self.binary = filename.endswith('.npy')
+        # Only binary maps can be paged in by tiles
+        self.tile_size = tile_size if self.binary else None
+        self.count = 0
+        self.tile_keys = [] # tiles of the segments of each chunk
+        self.max_half_length = 0.0
+        self.f = open(filename, 'wb' if self.binary else 'w')
+        if self.binary:
+            self.f.write(self.__npy_header())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __npy_header(self):
+        header = ("{'descr': '<f8', 'fortran_order': False, 'shape': (%d, 4), }"
+                % self.count)
+        header = header.ljust(NPY_HEADER_SIZE - 11) + '\n'
+        return (b'\x93NUMPY\x01\x00' + struct.pack('<H', len(header)) +
+                header.encode('latin1'))
+
+    def write(self, segments):
+        """Appends an (N, 4) array of segments to the map."""
+        segments = np.asarray(segments, dtype=float).reshape(-1, 4)
+        if self.binary:
+            self.f.write(segments.astype('<f8').tobytes())
+        else:
+            self.f.write(('%0.2f %0.2f %0.2f %0.2f\n' * len(segments)) %
+                    tuple(segments.ravel()))
+        if self.tile_size is not None and len(segments):
+            self.tile_keys.append(tile_keys(segments, self.tile_size))
+            half_lengths = np.hypot(segments[:, 2] - segments[:, 0],
+                    segments[:, 3] - segments[:, 1]) / 2.0
+            self.max_half_length = max(self.max_half_length,
+                    half_lengths.max())
+        self.count += len(segments)
+
+    def close(self):
+        """Finishes the map file and writes the tile index."""
+        if self.f.closed:
+            return
+        if self.binary:
+            self.f.seek(0)
+            self.f.write(self.__npy_header())
+        self.f.close()
+        if self.tile_size is not None:
+            keys = (np.vstack(self.tile_keys) if self.tile_keys else
+                    np.zeros((0, 2), dtype=np.int64))
+            self.tile_keys = []
+            write_tile_index(self.filename, keys, self.tile_size,
+                    self.max_half_length)
+
+
+class LineMap(object):
+    """A map made of line segments. The segments are stored as an (M, 4) array
+    of x_1, y_1, x_2, y_2 for the vectorized ray casting in sim.raycast, and
+    are also available as line dictionaries (see sim.model.get_line_dict),
+    which is what iterating over the map yields. The version number changes
+    every time the map changes.
+
+    A map can also have an occupancy grid (see sim.grid_map), scanned along
+    with the segments, and a TileStore (see sim.tiles) of segments too many
+    to hold in memory, in which case only the tiles near the robot (see
+    move_to) are part of the map's segments, along with any added ones. The
+    segments of its moving obstacles (see sim.obstacles) are part of them
+    too, as are the edges of its polylines and polygons (see sim.shapes),
+    stored as shared vertices. segments_in finds the segments near a place
+    through spatial indexes (and the shapes' bounding boxes), without going
+    through the others."""
+    def __init__(self, segments=None):
+        self._version = 0
+        self._segments = np.zeros((0, 4))
+        self._lines = None # line dictionaries, built when first needed
+        self._lines_version = None
+        self._combined = None # (version, own, tile and obstacle segments)
+        self._index = None # SpatialIndex of the own segments
+        self.obstacles = DynamicObstacles()
+        self._obstacle_version = 0 # versions of the obstacles replaced
+        self.shapes = Shapes()
+        self.tiles = None
+        self._tile_version = 0 # versions of the tiles closed
+        self.grid = None # an OccupancyGrid (see sim.grid_map) to scan as well
+        self.range_cache = None # precomputed ranges (see sim.range_cache)
+        if segments is not None:
+            self.add_segments(segments)
+
+    def __iter__(self):
+        return iter(self.lines)
+
+    def __len__(self):
+        return len(self._segments) + self.shapes.num_edges
+
+    @property
+    def version(self):
+        return (self._version + self.shapes.version + self.obstacles_version +
+                self.tiles_version)
+
+    @property
+    def obstacles_version(self):
+        """Returns the part of the version counting moving obstacle changes,
+        which (like the version) never goes down."""
+        return self._obstacle_version + self.obstacles.version
+
+    @property
+    def tiles_version(self):
+        """Returns the part of the version counting tile changes, which
+        (like the version) never goes down."""
+        version = self._tile_version
+        if self.tiles is not None:
+            version += self.tiles.version
+        return version
+
+    @property
+    def lines(self):
+        """Returns the segments as a list of line dictionaries."""
+        # imported here as sim.model imports this module
+        from sim.model import get_line_dict
+        if self._lines is None or self._lines_version != self.version:
+            self._lines = [get_line_dict(*seg)
+                    for seg in self.segments.tolist()]
+            self._lines_version = self.version
+        return self._lines
+
+    @property
+    def segments(self):
+        """Returns the (M, 4) array of segments."""
+        if (self.tiles is None and not len(self.obstacles) and
+                not len(self.shapes)):
+            return self._segments
+        if self._combined is None or self._combined[0] != self.version:
+            parts = [self._segments, self.shapes.segments(),
+                    self.obstacles.segments]
+            if self.tiles is not None:
+                parts.insert(1, self.tiles.active_segments())
+            self._combined = (self.version, np.vstack(parts))
+        return self._combined[1]
+
+    def segments_in(self, x_min, y_min, x_max, y_max):
+        """Returns the segments that may be inside a rectangle (a subset of
+        the map's segments, including all those inside it)."""
+        if self._index is None:
+            self._index = SpatialIndex()
+            self._index.build(self._segments)
+        parts = [self._segments[self._index.query(x_min, y_min, x_max,
+            y_max)], self.shapes.segments_in(x_min, y_min, x_max, y_max),
+            self.obstacles.segments_in(x_min, y_min, x_max, y_max)]
+        if self.tiles is not None:
+            # the active tiles are only those around the robots already
+            parts.append(self.tiles.active_segments())
+        return np.vstack(parts)
+
+    def load_tiles(self, filename, **kwargs):
+        """Pages segments from a binary map file and its tile index, replacing
+        any previous tiles. The keyword arguments are passed to TileStore."""
+        from sim.tiles import TileStore
+        self.close_tiles()
+        self.tiles = TileStore(filename, **kwargs)
+
+    def set_grid(self, grid):
+        """Adds an occupancy grid to the map (replacing any previous one), or
+        removes it if grid is None."""
+        self.grid = grid
+        self._version += 1
+
+    def precompute(self, max_range, **kwargs):
+        """Builds (or loads) the precomputed ranges of the map for beams up
+        to max_range [m] long, used by the laser until the map next changes.
+        The keyword arguments are passed to RangeCache."""
+        from sim.range_cache import RangeCache
+        self.range_cache = RangeCache(self, max_range=max_range, **kwargs)
+
+    def close_tiles(self):
+        if self.tiles is not None:
+            self.tiles.close()
+            self._tile_version += self.tiles.version + 1
+            self.tiles = None
+
+    def move_to(self, pose, reach, robot=0):
+        """Lets the map know a robot is at pose (x, y, heading) and needs the
+        segments within reach [m] of it. Only matters for tiled maps."""
+        if self.tiles is not None:
+            self.tiles.move_to(pose, reach, robot)
+
+    def add_segment(self, x_1, y_1, x_2, y_2):
+        """Adds a single segment to the map."""
+        self.add_segments([(x_1, y_1, x_2, y_2)])
+
+    def add_segments(self, segments):
+        """Adds an (N, 4) array (or list of 4-tuples) of segments to the map."""
+        from sim.model import get_line_dict
+        segments = np.asarray(segments, dtype=float).reshape(-1, 4)
+        if self._index is not None:
+            self._index.insert(np.arange(len(self._segments),
+                len(self._segments) + len(segments)), segments)
+        self._segments = np.vstack((self._segments, segments))
+        if self._lines is not None and self._lines_version == self.version:
+            self._lines.extend(get_line_dict(*seg)
+                    for seg in segments.tolist())
+            self._lines_version += 1
+        self._version += 1
+
+    def add_shapes(self, shapes, closed=False):
+        """Adds polylines (or polygons, if closed) to the map, each an (N, 2)
+        array of vertices (see Shapes.extend), and returns their indices in
+        self.shapes."""
+        return self.shapes.extend(shapes, closed)
+
+    def add_polygon(self, vertices):
+        """Adds a closed polygon with (N, 2) vertices to the map."""
+        return self.shapes.add(vertices, closed=True)
+
+    def add_polyline(self, vertices):
+        """Adds a polyline through (N, 2) vertices to the map."""
+        return self.shapes.add(vertices)
+
+    def contains(self, points):
+        """Returns, for each of the (P, 2) points, the index of a polygon of
+        the map it is inside (-1 if none)."""
+        return self.shapes.contains(points)
+
+    def set_obstacles(self, obstacles):
+        """Replaces the moving obstacles (a DynamicObstacles)."""
+        # The version must not go back to one a scan was cached at
+        self._obstacle_version += self.obstacles.version + 1
+        self.obstacles = obstacles
+
+    def clear(self):
+        """Removes all the segments (and tiles, grid and obstacles) from the
+        map."""
+        self.close_tiles()
+        self.grid = None
+        self.range_cache = None
+        self._version += self.shapes.version + 1
+        self._obstacle_version += self.obstacles.version + 1
+        self.obstacles = DynamicObstacles()
+        self.shapes = Shapes()
+        self._segments = np.zeros((0, 4))
+        self._index = None
+        self._lines = None
+
+
+def segments_near(line_map, point, radius):
+    """Returns the segments of a map (anything as_segments takes) within
+    radius of a point, found through the map's spatial index if it has
+    one."""
+    x, y = point[0], point[1]
+    if isinstance(line_map, LineMap):
+        segments = line_map.segments_in(x - radius, y - radius, x + radius,
+                y + radius)
+    else:
+        segments = as_segments(line_map)
+    return segments[segment_distances(segments, (x, y)) <= radius]
+
+
+def as_segments(line_map):
+    """Returns the (M, 4) segment array of a LineMap, an array of segments, or
+    a list of line dictionaries."""
+    if isinstance(line_map, LineMap):
+        return line_map.segments
+    if len(line_map) and isinstance(line_map[0], dict):
+        return np.array([(l['x_1'], l['y_1'], l['x_2'], l['y_2'])
+            for l in line_map], dtype=float)
+    return np.asarray(line_map, dtype=float).reshape(-1, 4)
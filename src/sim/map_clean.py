@@ -0,0 +1,222 @@
+"""Cleaning of segment maps before they are used: duplicate (or reversed)
+segments and zero length ones are removed, and chains of segments joined end
+to end are merged where they are collinear (within a tolerance) and,
+optionally, simplified with the Douglas-Peucker algorithm. Fewer segments
+make every scan cheaper."""
+# Python imports
+import argparse
+import time
+from math import asin, atan2, hypot
+import numpy as np
+
+# MSL Sim imports
+from sim.line_map import LineMap, load_map_file, save_map_file
+
+SNAP = 1e-6 # endpoints closer than this [m] are the same point
+MERGE_TOLERANCE = 0.005 # how far merged segments may move the map [m]
+BENCHMARK_SCANS = 20 # scans timed before and after cleaning
+BENCHMARK_ROUNDS = 3 # alternating rounds of those, the best of which counts
+
+
+def point_segment_distances(points, start, end):
+    """Returns the distance from each of the (N, 2) points to the segment
+    from start to end."""
+    e = np.asarray(end, dtype=float) - start
+    length_sq = e.dot(e)
+    w = points - start
+    t = np.clip(w.dot(e) / length_sq, 0, 1) if length_sq > 0 else \
+            np.zeros(len(points))
+    return np.hypot(w[:, 0] - t*e[0], w[:, 1] - t*e[1])
+
+
+def merge_collinear(points, tolerance=MERGE_TOLERANCE):
+    """Returns the indices of the vertices of a polyline ((N, 2) points) to
+    keep so that each segment between kept vertices passes within tolerance
+    of all the vertices it replaces, merging greedily from the start. Each
+    vertex narrows the cone of directions a segment from the last kept
+    vertex may take (and sets how long it must be), so this takes linear
+    time."""
+    points = np.asarray(points, dtype=float).tolist()
+    keep = [0]
+    anchor_x, anchor_y = points[0]
+    axis = None # direction the cone's bounds are measured from
+    low = high = reach = 0.0
+    for j in range(1, len(points)):
+        x, y = points[j]
+        dx, dy = x - anchor_x, y - anchor_y
+        dist = hypot(dx, dy)
+        if axis is not None:
+            offset = atan2(axis[0]*dy - axis[1]*dx, axis[0]*dx + axis[1]*dy)
+            if dist < reach or not low <= offset <= high:
+                keep.append(j - 1)
+                anchor_x, anchor_y = points[j - 1]
+                dx, dy = x - anchor_x, y - anchor_y
+                dist = hypot(dx, dy)
+                axis = None
+        # Vertices within tolerance of the anchor are close to any segment
+        if dist > tolerance:
+            half_width = asin(tolerance / dist)
+            if axis is None:
+                axis = (dx / dist, dy / dist)
+                low, high, reach = -half_width, half_width, dist
+            else:
+                low = max(low, offset - half_width)
+                high = min(high, offset + half_width)
+                reach = max(reach, dist)
+    if len(points) > 1:
+        keep.append(len(points) - 1)
+    return np.array(keep, dtype=int)
+
+
+def douglas_peucker(points, epsilon):
+    """Returns the indices of the vertices of a polyline ((N, 2) points) kept
+    by the Douglas-Peucker algorithm: the simplified polyline passes within
+    epsilon of every vertex."""
+    keep = np.zeros(len(points), dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        distances = point_segment_distances(points[first + 1:last],
+                points[first], points[last])
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > epsilon:
+            middle = first + 1 + farthest
+            keep[middle] = True
+            stack.append((first, middle))
+            stack.append((middle, last))
+    return np.flatnonzero(keep)
+
+
+def chains(edges, num_vertices):
+    """Splits a graph of (M, 2) vertex index pairs into chains, lists of the
+    vertices of edges joined end to end through vertices shared by exactly
+    two edges. A closed chain starts and ends on the same vertex."""
+    incident = [[] for _ in range(num_vertices)]
+    for i, (a, b) in enumerate(edges.tolist()):
+        incident[a].append(i)
+        incident[b].append(i)
+    used = np.zeros(len(edges), dtype=bool)
+    found = []
+
+    def walk(vertex, edge):
+        chain = [vertex]
+        while True:
+            used[edge] = True
+            a, b = edges[edge]
+            vertex = b if a == vertex else a
+            chain.append(vertex)
+            if len(incident[vertex]) != 2:
+                return chain
+            edge = [e for e in incident[vertex] if e != edge][0]
+            if used[edge]:
+                return chain
+
+    # Chains end at vertices with one or more than two edges; what is left
+    # are closed loops
+    for vertex in range(num_vertices):
+        if len(incident[vertex]) != 2:
+            for edge in incident[vertex]:
+                if not used[edge]:
+                    found.append(walk(vertex, edge))
+    for edge in np.flatnonzero(~used).tolist():
+        if not used[edge]:
+            found.append(walk(int(edges[edge, 0]), edge))
+    return found
+
+
+def clean_segments(segments, tolerance=MERGE_TOLERANCE, simplify=0.0):
+    """Returns a tuple (segments, report) of a cleaned copy of an (M, 4) array
+    of segments and a dictionary of how many segments each step removed:
+    'zero_length', 'duplicates' (identical or reversed), 'merged' (collinear
+    within tolerance [m] with a neighbour) and 'simplified' (by
+    Douglas-Peucker with a tolerance of simplify [m], if not 0), plus the
+    'input' and 'output' counts."""
+    segments = np.asarray(segments, dtype=float).reshape(-1, 4)
+    report = {'input': len(segments)}
+    # Endpoints snapped together, and segments as pairs of vertex indices
+    keys = np.round(segments.reshape(-1, 2) / SNAP).astype(np.int64)
+    _, first, inverse = np.unique(keys, axis=0, return_index=True,
+            return_inverse=True)
+    vertices = segments.reshape(-1, 2)[first]
+    edges = inverse.reshape(-1, 2)
+    nonzero = edges[:, 0] != edges[:, 1]
+    report['zero_length'] = int(np.sum(~nonzero))
+    edges = np.unique(np.sort(edges[nonzero], axis=1), axis=0)
+    report['duplicates'] = int(np.sum(nonzero)) - len(edges)
+    # Chains merged, then simplified
+    pieces = [np.zeros((0, 4))]
+    merged = simplified = 0
+    for chain in chains(edges, len(vertices)):
+        points = vertices[chain]
+        kept = merge_collinear(points, tolerance)
+        merged += len(chain) - len(kept)
+        if simplify > 0:
+            before = len(kept)
+            kept = kept[douglas_peucker(points[kept], simplify)]
+            simplified += before - len(kept)
+        points = points[kept]
+        pieces.append(np.hstack((points[:-1], points[1:])))
+    cleaned = np.vstack(pieces)
+    report['merged'] = merged
+    report['simplified'] = simplified
+    report['output'] = len(cleaned)
+    return cleaned, report
+
+
+def format_report(report):
+    """Returns a one line summary of a clean_segments report."""
+    return ('%(input)d segments: %(zero_length)d zero length, %(duplicates)d '
+            'duplicates, %(merged)d merged and %(simplified)d simplified away, '
+            '%(output)d left' % report)
+
+
+def scan_time(segments, scans=BENCHMARK_SCANS, seed=0):
+    """Returns the mean time [s] taken by the default laser to scan a map of
+    segments from random poses within its bounds (after an untimed scan, to
+    build the map's index and warm up)."""
+    # MSL Sim imports (here, as sim.model imports sim.line_map)
+    from sim.model import Laser
+
+    line_map = LineMap()
+    line_map.add_segments(segments)
+    rng = np.random.RandomState(seed)
+    low = segments.reshape(-1, 2).min(axis=0)
+    high = segments.reshape(-1, 2).max(axis=0)
+    laser = Laser((0, 0, 0))
+    laser.scan(line_map)
+    start = time.time()
+    for _ in range(scans):
+        laser.pose = tuple(rng.uniform(low, high).tolist() +
+                [rng.uniform(-np.pi, np.pi)])
+        laser.scan(line_map)
+    return (time.time() - start) / scans
+
+
+def clean_main(argv=None):
+    parser = argparse.ArgumentParser(description='Clean a segment map: '
+            'remove duplicate and zero length segments and merge collinear '
+            'ones, reporting how many were removed and how much faster the '
+            'laser scans the result.')
+    parser.add_argument('source', help='map to clean (.txt or .npy)')
+    parser.add_argument('destination', help='map to write (.txt or .npy)')
+    parser.add_argument('--tolerance', type=float, default=MERGE_TOLERANCE,
+            help='how far merging collinear segments may move the map [m]')
+    parser.add_argument('--simplify', type=float, default=0.0,
+            help='Douglas-Peucker tolerance [m] (no simplification if 0)')
+    parser.add_argument('--no-benchmark', action='store_true',
+            help='do not time scans of the map before and after')
+    args = parser.parse_args(argv)
+    segments = load_map_file(args.source)
+    cleaned, report = clean_segments(segments, args.tolerance, args.simplify)
+    save_map_file(args.destination, cleaned)
+    print(format_report(report))
+    if not args.no_benchmark and len(cleaned):
+        # Alternated, so neither map is timed only while the process is cold
+        times = [(scan_time(segments), scan_time(cleaned))
+                for _ in range(BENCHMARK_ROUNDS)]
+        before, after = [min(column) for column in zip(*times)]
+        print('scan time: %.2f ms before, %.2f ms after (%.1fx faster)' %
+                (1000*before, 1000*after, before/after))
@@ -0,0 +1,371 @@
+"""Random map generators. Each generator draws all of its random numbers from
+its own seeded generator and builds the whole map as arrays in one pass, so
+the same seed always gives the same map, and large maps are fast to make. The
+maps can be written with sim.line_map.save_map_file."""
+# Python imports
+import argparse
+import math
+from collections import deque
+import numpy as np
+
+# MSL Sim imports
+from sim.line_map import MapStreamWriter, save_map_file
+from sim.shapes import Shapes
+
+# Landmarks
+NUM_LANDMARKS = 100
+MIN_SIZE = 0.3 # [m]
+MAX_SIZE = 2 # [m]
+BOUNDS = (-30, 30, -30, 30) # (min x, max x, min y, max y) [m]
+
+# Walls
+SLOPE_SET = [1, 22, 46, 67, 91, 113, 134, 157] # degrees
+SLOPE_NOISE = 1 # degrees (std. dev)
+OUTLIER_PERCENT = 15
+NUM_SEGMENTS = 200
+MIN_LENGTH = 0.4 # [m]
+MAX_LENGTH = 1.0 # [m]
+START = (-2, 2)
+
+# Tunnels
+TUNNEL_LENGTH = 10000 # total length of the drifts [m]
+DRIFT_WIDTH = 5.0 # [m]
+MIN_DRIFT_LENGTH = 50 # [m]
+MAX_DRIFT_LENGTH = 300 # [m]
+DRIFT_TURN_NOISE = 1 # std. dev. of the change in heading between stations [deg]
+BRANCH_PROBABILITY = 0.01 # chance of a branch leaving each station
+MIN_BRANCH_ANGLE = 45 # smallest angle between a branch and its drift [deg]
+MAX_BRANCH_ANGLE = 90 # largest angle between a branch and its drift [deg]
+WALL_ROUGHNESS = 0.5 # typical distance of a wall from its nominal line [m]
+MAX_WALL_DEVIATION = 60 # largest angle between a wall and its drift [deg]
+TILE_SIZE = 50 # edge length of the tiles of the tile index [m]
+
+
+def landmark_corners(centres, angles, edge_lengths):
+    """Returns an (N, 4, 2) array of the corners of N squares with the given
+    (N, 2) centres, (N,) angles [rad] and (N,) edge lengths."""
+    half = np.asarray(edge_lengths, dtype=float)[:, None] / 2.0
+    offset_x = half * np.array([1, 1, -1, -1])
+    offset_y = half * np.array([1, -1, -1, 1])
+    c = np.cos(angles)[:, None]
+    s = np.sin(angles)[:, None]
+    centres = np.asarray(centres, dtype=float)
+    x = c * offset_x + s * offset_y + centres[:, 0:1]
+    y = -s * offset_x + c * offset_y + centres[:, 1:2]
+    return np.stack((x, y), axis=2)
+
+
+def polygon_segments(vertices):
+    """Returns the (N*V, 4) array of segments joining each of the N closed
+    polygons in an (N, V, 2) array of vertices (each vertex to the next)."""
+    previous = np.roll(vertices, 1, axis=1)
+    return np.concatenate((previous, vertices), axis=2).reshape(-1, 4)
+
+
+def random_landmark_polygons(num_landmarks=NUM_LANDMARKS, min_size=MIN_SIZE,
+        max_size=MAX_SIZE, bounds=BOUNDS, seed=None):
+    """Returns an (N, 4, 2) array of the corners of N randomly placed, sized
+    and rotated square landmarks."""
+    rng = np.random.RandomState(seed)
+    min_x, max_x, min_y, max_y = bounds
+    centres = np.column_stack((rng.uniform(min_x, max_x, num_landmarks),
+        rng.uniform(min_y, max_y, num_landmarks)))
+    edge_lengths = rng.uniform(min_size, max_size, num_landmarks)
+    angles = rng.uniform(0, np.pi/2, num_landmarks)
+    return landmark_corners(centres, angles, edge_lengths)
+
+
+def random_landmarks(num_landmarks=NUM_LANDMARKS, min_size=MIN_SIZE,
+        max_size=MAX_SIZE, bounds=BOUNDS, seed=None):
+    """Returns an (4N, 4) array of the segments of N randomly placed, sized and
+    rotated square landmarks."""
+    return polygon_segments(random_landmark_polygons(num_landmarks, min_size,
+        max_size, bounds, seed))
+
+
+def random_slopes(rng, num_segments, slope_set=SLOPE_SET,
+        slope_noise=SLOPE_NOISE, outlier_percent=OUTLIER_PERCENT):
+    """Returns a tuple (slopes, joint_sets) of arrays of random slopes [deg],
+    each drawn from the slope set plus noise, or (outlier_percent of the
+    time) uniformly at random, and the slope set value each was drawn from
+    (-1 for outliers)."""
+    outliers = rng.randint(1, 101, num_segments) <= outlier_percent
+    joint_sets = rng.choice(np.asarray(slope_set), num_segments)
+    slopes = joint_sets + rng.normal(0, slope_noise, num_segments)
+    slopes[outliers] = rng.randint(0, 180, outliers.sum())
+    joint_sets[outliers] = -1
+    return slopes, joint_sets
+
+
+def chain_segments(start, lengths, directions):
+    """Returns the (N, 4) array of segments of a chain starting at start, with
+    the given (N,) lengths and directions [rad], each starting where the
+    previous one ends."""
+    steps = np.column_stack((lengths * np.cos(directions),
+        lengths * np.sin(directions)))
+    points = np.vstack((start, steps)).cumsum(axis=0)
+    return np.hstack((points[:-1], points[1:]))
+
+
+def random_wall(num_segments=NUM_SEGMENTS, slope_set=SLOPE_SET,
+        slope_noise=SLOPE_NOISE, outlier_percent=OUTLIER_PERCENT,
+        min_length=MIN_LENGTH, max_length=MAX_LENGTH, start=START, seed=None):
+    """Returns a tuple (segments, slopes, joint_sets) describing a random
+    jagged wall of segments, each starting where the previous one ends: the
+    (N, 4) segments, the slope of each [deg] and the slope set value each was
+    drawn from (-1 for outliers). See random_slopes."""
+    rng = np.random.RandomState(seed)
+    lengths = rng.uniform(min_length, max_length, num_segments)
+    slopes, joint_sets = random_slopes(rng, num_segments, slope_set,
+            slope_noise, outlier_percent)
+    segments = chain_segments(start, lengths, np.radians(slopes - 90))
+    return segments, slopes, joint_sets
+
+
+def wall_statistics(segments, slopes, joint_sets):
+    """Returns the comment lines describing a wall made by random_wall: the
+    number of lines and outliers, and the mean and standard deviation of the
+    slopes and lengths of the segments drawn from each slope set value."""
+    lengths = np.hypot(segments[:, 2] - segments[:, 0],
+            segments[:, 3] - segments[:, 1])
+    comments = ['MAP STATISTICS',
+            'num lines: %d' % len(segments),
+            'num outliers: %d' % (joint_sets == -1).sum(),
+            'slope slope_std length length_std']
+    for joint_set in np.unique(joint_sets[joint_sets != -1]):
+        members = joint_sets == joint_set
+        comments.append('%0.2f %0.4f %0.2f %0.4f' % (slopes[members].mean(),
+            slopes[members].std(), lengths[members].mean(),
+            lengths[members].std()))
+    comments.append('LINE COORDINATES')
+    return comments
+
+
+def rough_wall_offsets(rng, headings, lengths, slope_set=SLOPE_SET,
+        slope_noise=SLOPE_NOISE, outlier_percent=OUTLIER_PERCENT,
+        roughness=WALL_ROUGHNESS, max_deviation=MAX_WALL_DEVIATION):
+    """Returns the (N + 1,) lateral offsets [m] (to the left) of a rough wall
+    from its nominal line, along N stretches of a drift with the given
+    headings [rad] and lengths. As in random_wall, each wall segment follows
+    one of the joint orientations of the slope set, plus noise, or is an
+    outlier; of the joints on either side of the drift's heading, the one
+    leading back towards the nominal line is more likely the further away
+    the wall has strayed (see roughness)."""
+    num = len(headings)
+    max_deviation = math.radians(max_deviation)
+    # Angle of each joint orientation from each heading, in [-pi/2, pi/2)
+    joints = np.radians(np.asarray(slope_set, dtype=float))
+    relative = (joints[None, :] - headings[:, None] + np.pi/2) % np.pi - np.pi/2
+    relative[np.abs(relative) > max_deviation] = np.nan
+    with np.errstate(invalid='ignore'):
+        left = np.fmin.reduce(np.where(relative >= 0, relative, np.nan), axis=1)
+        right = np.fmax.reduce(np.where(relative < 0, relative, np.nan), axis=1)
+    # Without a joint on one side, the wall can only turn the other way
+    left = np.where(np.isnan(left), 0.0, left)
+    right = np.where(np.isnan(right), 0.0, right)
+    noise = rng.normal(0, math.radians(slope_noise), num)
+    outliers = rng.randint(1, 101, num) <= outlier_percent
+    outlier_deviations = rng.uniform(-max_deviation, max_deviation, num)
+    choices = rng.uniform(0, 1, num)
+    offsets = np.zeros(num + 1)
+    r = 0.0
+    for i in range(num):
+        if outliers[i]:
+            deviation = outlier_deviations[i]
+        else:
+            # chance of turning back towards the nominal line
+            p_back = 0.5 + 0.5 * math.tanh(abs(r) / roughness)
+            turn_left = (r < 0) == (choices[i] < p_back)
+            deviation = (left[i] if turn_left else right[i]) + noise[i]
+        deviation = max(-max_deviation, min(max_deviation, deviation))
+        r += lengths[i] * math.tan(deviation)
+        offsets[i + 1] = r
+    return offsets
+
+
+def tunnel_network(total_length=TUNNEL_LENGTH, width=DRIFT_WIDTH,
+        min_drift_length=MIN_DRIFT_LENGTH, max_drift_length=MAX_DRIFT_LENGTH,
+        turn_noise=DRIFT_TURN_NOISE, branch_probability=BRANCH_PROBABILITY,
+        min_branch_angle=MIN_BRANCH_ANGLE, max_branch_angle=MAX_BRANCH_ANGLE,
+        min_length=MIN_LENGTH, max_length=MAX_LENGTH, slope_set=SLOPE_SET,
+        slope_noise=SLOPE_NOISE, outlier_percent=OUTLIER_PERCENT,
+        roughness=WALL_ROUGHNESS, max_deviation=MAX_WALL_DEVIATION,
+        start=(0, 0), seed=None):
+    """Generates a branching network of underground drifts (tunnels) with
+    rough walls, yielding the (N, 4) array of wall segments of one drift at a
+    time so the network never has to be held in memory.
+
+    Each drift's centreline is a chain of stations min_length to max_length
+    apart whose heading wanders by turn_noise [deg]. At each station a branch
+    may leave to either side, at min_branch_angle to max_branch_angle [deg];
+    drifts are generated breadth-first until their total length reaches
+    total_length [m], and a drift is cut short where it would run into an
+    earlier one. The walls are width apart, with openings where branches
+    leave, and their roughness follows the slope set model of random_wall
+    (see rough_wall_offsets). Drift ends are closed off."""
+    rng = np.random.RandomState(seed)
+    mean_step = (min_length + max_length) / 2.0
+    half = width / 2.0
+    occupied = set() # coarse cells (width wide) holding earlier drifts
+    # Drifts waiting to be generated: (start point, heading [rad], closed
+    # start (only the first drift's start has no drift behind it))
+    queue = deque([(np.asarray(start, dtype=float), 0.0, True)])
+    generated = 0.0
+    while queue and generated < total_length:
+        origin, heading, closed_start = queue.popleft()
+        length = min(rng.uniform(min_drift_length, max_drift_length),
+                total_length - generated)
+        num = max(1, int(length / mean_step))
+        steps = rng.uniform(min_length, max_length, num)
+        headings = heading + np.cumsum(rng.normal(0, math.radians(turn_noise),
+            num))
+        stations = np.vstack((origin, np.column_stack((steps *
+            np.cos(headings), steps * np.sin(headings))))).cumsum(axis=0)
+        # Stop where the drift runs into an earlier one (ignoring the stations
+        # near its start, which are next to the drift it branches from)
+        cells = [tuple(c) for c in np.floor(stations / width).astype(int)]
+        travelled = np.concatenate(([0], np.cumsum(steps)))
+        for i, (c_x, c_y) in enumerate(cells):
+            if travelled[i] > 3 * width and any((c_x + a, c_y + b) in occupied
+                    for a in (-1, 0, 1) for b in (-1, 0, 1)):
+                num = max(1, i - 2)
+                break
+        stations, steps = stations[:num + 1], steps[:num]
+        headings = headings[:num]
+        occupied.update(cells[:num + 1])
+        generated += steps.sum()
+        # Normals (to the left) at each station
+        station_headings = np.append(headings, headings[-1])
+        normals = np.column_stack((-np.sin(station_headings),
+            np.cos(station_headings)))
+        # Branches, and the wall segments removed to open them
+        openings = {1: np.zeros(num, dtype=bool), -1: np.zeros(num, dtype=bool)}
+        branch_at = np.flatnonzero(rng.uniform(0, 1, num) < branch_probability)
+        if not queue:
+            # Keep the network growing from the last drift waiting
+            branch_at = np.union1d(branch_at, rng.randint(0, num, 2))
+        for i in branch_at:
+            side = 1 if rng.uniform() < 0.5 else -1
+            angle = math.radians(rng.uniform(min_branch_angle,
+                max_branch_angle))
+            reach = int(math.ceil(half / math.sin(angle) / mean_step))
+            if i < reach or i + reach >= num or openings[side][i]:
+                continue
+            openings[side][i - reach:i + reach] = True
+            queue.append((stations[i] + side * half * normals[i],
+                headings[i] + side * angle, False))
+        walls = []
+        ends = []
+        for side in (1, -1):
+            offsets = rough_wall_offsets(rng, headings, steps, slope_set,
+                    slope_noise, outlier_percent, roughness, max_deviation)
+            points = stations + normals * (side * half + offsets)[:, None]
+            segments = np.hstack((points[:-1], points[1:]))
+            walls.append(segments[~openings[side]])
+            ends.append(points[[0, -1]])
+        # Close off the end of the drift (and the start of the first one)
+        walls.append(np.hstack((ends[0][1:], ends[1][1:])))
+        if closed_start:
+            walls.append(np.hstack((ends[0][:1], ends[1][:1])))
+        yield np.vstack(walls)
+
+
+def write_streamed_map(filename, chunks, tile_size=TILE_SIZE):
+    """Writes the chunks of segments yielded by a generator (such as
+    tunnel_network) to a map file as they are generated, along with a tile
+    index if it is a binary map (see sim.line_map.MapStreamWriter). Returns
+    the number of segments written."""
+    with MapStreamWriter(filename, tile_size) as writer:
+        for chunk in chunks:
+            writer.write(chunk)
+    return writer.count
+
+
+# ------------------------------------------------------------------------------
+# COMMAND LINE
+# ------------------------------------------------------------------------------
+
+def landmarks_main(argv=None):
+    parser = argparse.ArgumentParser(
+            description='Generate a map of random square landmarks.')
+    parser.add_argument('filename', help='output map (.txt, or .npy binary)')
+    parser.add_argument('--num-landmarks', type=int, default=NUM_LANDMARKS)
+    parser.add_argument('--min-size', type=float, default=MIN_SIZE)
+    parser.add_argument('--max-size', type=float, default=MAX_SIZE)
+    parser.add_argument('--bounds', type=float, nargs=4, default=BOUNDS,
+            metavar=('MIN_X', 'MAX_X', 'MIN_Y', 'MAX_Y'))
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--polygons', action='store_true',
+            help='write each landmark as a polygon rather than as segments')
+    args = parser.parse_args(argv)
+    polygons = random_landmark_polygons(args.num_landmarks, args.min_size,
+            args.max_size, args.bounds, args.seed)
+    if args.polygons:
+        shapes = Shapes()
+        shapes.extend(polygons, closed=True)
+        save_map_file(args.filename, np.zeros((0, 4)), shapes=shapes)
+    else:
+        save_map_file(args.filename, polygon_segments(polygons))
+
+
+def wall_main(argv=None):
+    parser = argparse.ArgumentParser(
+            description='Generate a map of a random jagged wall.')
+    parser.add_argument('filename', help='output map (.txt, or .npy binary)')
+    parser.add_argument('--num-segments', type=int, default=NUM_SEGMENTS)
+    parser.add_argument('--slope-set', type=float, nargs='+',
+            default=SLOPE_SET)
+    parser.add_argument('--slope-noise', type=float, default=SLOPE_NOISE)
+    parser.add_argument('--outlier-percent', type=float,
+            default=OUTLIER_PERCENT)
+    parser.add_argument('--min-length', type=float, default=MIN_LENGTH)
+    parser.add_argument('--max-length', type=float, default=MAX_LENGTH)
+    parser.add_argument('--start', type=float, nargs=2, default=START)
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args(argv)
+    segments, slopes, joint_sets = random_wall(args.num_segments,
+            args.slope_set, args.slope_noise, args.outlier_percent,
+            args.min_length, args.max_length, args.start, args.seed)
+    save_map_file(args.filename, segments,
+            wall_statistics(segments, slopes, joint_sets),
+            extra_columns=[(slopes, '%0.1f')])
+
+
+def tunnels_main(argv=None):
+    parser = argparse.ArgumentParser(
+            description='Generate a map of a branching network of tunnels.')
+    parser.add_argument('filename', help='output map (.npy binary, or .txt)')
+    parser.add_argument('--length', type=float, default=TUNNEL_LENGTH,
+            help='total length of the tunnels [m]')
+    parser.add_argument('--width', type=float, default=DRIFT_WIDTH)
+    parser.add_argument('--min-drift-length', type=float,
+            default=MIN_DRIFT_LENGTH)
+    parser.add_argument('--max-drift-length', type=float,
+            default=MAX_DRIFT_LENGTH)
+    parser.add_argument('--turn-noise', type=float, default=DRIFT_TURN_NOISE)
+    parser.add_argument('--branch-probability', type=float,
+            default=BRANCH_PROBABILITY)
+    parser.add_argument('--min-branch-angle', type=float,
+            default=MIN_BRANCH_ANGLE)
+    parser.add_argument('--max-branch-angle', type=float,
+            default=MAX_BRANCH_ANGLE)
+    parser.add_argument('--min-length', type=float, default=MIN_LENGTH)
+    parser.add_argument('--max-length', type=float, default=MAX_LENGTH)
+    parser.add_argument('--slope-set', type=float, nargs='+',
+            default=SLOPE_SET)
+    parser.add_argument('--slope-noise', type=float, default=SLOPE_NOISE)
+    parser.add_argument('--outlier-percent', type=float,
+            default=OUTLIER_PERCENT)
+    parser.add_argument('--roughness', type=float, default=WALL_ROUGHNESS)
+    parser.add_argument('--max-deviation', type=float,
+            default=MAX_WALL_DEVIATION)
+    parser.add_argument('--tile-size', type=float, default=TILE_SIZE)
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args(argv)
+    chunks = tunnel_network(args.length, args.width, args.min_drift_length,
+            args.max_drift_length, args.turn_noise, args.branch_probability,
+            args.min_branch_angle, args.max_branch_angle, args.min_length,
+            args.max_length, args.slope_set, args.slope_noise,
+            args.outlier_percent, args.roughness, args.max_deviation,
+            seed=args.seed)
+    write_streamed_map(args.filename, chunks, args.tile_size)
@@ -1,10 +1,28 @@
 # Python imports
 import random
+import numpy as np
 from numpy import linspace
-from math import sin, cos, pi, sqrt, floor, atan2, degrees, radians
+from math import sin, cos, pi, sqrt, floor, ceil, atan2, degrees, radians
 
 # MSL Sim imports
 import sim.defaults as d
+from sim.collision import swept_collision
+from sim.line_map import as_segments, segments_near
+from sim.raycast import (cast_rays, cast_rays_bounded, cast_scans,
+        map_chunks, segment_distances, _intersect, POSE_CHUNK)
+from sim.visibility import sweep_ranges
+
+def arc_step(x, y, heading, distance, angle):
+    """Returns the pose (x, y, heading) reached by driving a distance along a
+    circular arc while turning through an angle, which is exact for constant
+    linear and angular velocities. Works element-wise on arrays. The heading
+    is not wrapped to [-pi, pi]."""
+    # Length of the chord joining the ends of the arc (sinc keeps it finite as
+    # the angle goes to zero, where the arc becomes a straight line)
+    chord = distance * np.sinc(angle / (2*pi))
+    x = x + chord * np.cos(heading + angle/2.0)
+    y = y + chord * np.sin(heading + angle/2.0)
+    return x, y, heading + angle
 
 def circle_intersections(line, circle_centre, circle_rad):
     # Adjust coordinates so circle is at (0,0)
@@ -100,27 +118,63 @@ class Compass(object):
     def __init__(self):
         self.noise = radians(d.COMPASS_NOISE)
         self.freq = d.COMPASS_FREQUENCY
+        self.noise_model = None # a sim.noise model, else white noise only
 
     def read(self, heading):
+        if self.noise_model is not None:
+            return self.noise_model.apply(heading, 1.0/self.freq, self.noise)
         return heading + random.gauss(0, self.noise)
 
+    def read_window(self, headings):
+        """Returns the bearings read at an array of headings, one per tick."""
+        if self.noise_model is not None:
+            return self.noise_model.apply_window(headings, 1.0/self.freq,
+                    self.noise)
+        headings = np.asarray(headings, dtype=float)
+        return headings + np.random.normal(0, self.noise, headings.shape)
+
 class GPS(object):
     def __init__(self):
         self.noise = d.GPS_NOISE
         self.freq = d.GPS_FREQUENCY
+        self.noise_model = None # a sim.noise model, else white noise only
 
     def read(self, x, y):
+        """Returns a fix (x, y), or None if there is none (an outage)."""
+        if self.noise_model is not None:
+            return self.noise_model.apply(x, y, 1.0/self.freq, self.noise)
         return x + random.gauss(0, self.noise), y + random.gauss(0, self.noise)
 
+    def read_window(self, positions):
+        """Returns the fixes for an (T, 2) array of positions, one per tick,
+        with NaN rows where there is no fix."""
+        if self.noise_model is not None:
+            return self.noise_model.apply_window(positions, 1.0/self.freq,
+                    self.noise)
+        positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+        return positions + np.random.normal(0, self.noise, positions.shape)
+
 
 class Gyroscope(object):
     def __init__(self):
         self.noise = radians(d.GYRO_NOISE)
         self.freq = d.GYRO_FREQUENCY
+        self.noise_model = None # a sim.noise model, else white noise only
 
     def read(self, ang_vel):
+        if self.noise_model is not None:
+            return self.noise_model.apply(ang_vel, 1.0/self.freq, self.noise)
         return ang_vel + random.gauss(0, self.noise)
 
+    def read_window(self, ang_vels):
+        """Returns the readings of an array of angular velocities, one per
+        tick."""
+        if self.noise_model is not None:
+            return self.noise_model.apply_window(ang_vels, 1.0/self.freq,
+                    self.noise)
+        ang_vels = np.asarray(ang_vels, dtype=float)
+        return ang_vels + np.random.normal(0, self.noise, ang_vels.shape)
+
 
 class Laser(object):
     def __init__(self, pose):
@@ -130,21 +184,35 @@ class Laser(object):
         self.resolution = d.LASER_RES
         self.range = d.LASER_RANGE
         self.noise = d.LASER_NOISE
+        self.noise_table = None # (ranges, stds) if noise varies with range
+        self.noise_model = None # a sim.noise model, else Gaussian noise only
         self.freq = d.LASER_FREQ
+        self.scan_time = d.LASER_SCAN_TIME
+        self.motion_distortion = False # cast each beam from its firing pose
+        self.velocity = (0.0, 0.0) # (vel, ang_vel) of the robot while scanning
+        self.engine = d.LASER_ENGINE # how scans are cast through segments
+        self.__last_key = None # what the last noiseless scan depended on
+        self.__last_ranges = None # and its ranges
+        self.__last_hits = [] # line hit by each beam of the last scan, if any
 
-    def __get_laser_beams(self):
-        """Given the pose of the robot, returns a list of line dictionaries. 
-        Each dictionary contains information about a single beam in the laser 
-        scan."""
-        x, y, theta = self.pose
-        laser_beams = []
-        for beta in linspace(self.min_angle, self.max_angle, 
-                (self.max_angle - self.min_angle)/self.resolution + 1):
-            beta = beta * pi/180
-            x_2 = x + self.range * cos(theta + beta)
-            y_2 = y + self.range * sin(theta + beta)
-            laser_beams.append(get_line_dict(x, y, x_2, y_2))
-        return laser_beams
+    @property
+    def num_beams(self):
+        """Returns the number of beams in a scan."""
+        return int((self.max_angle - self.min_angle)/float(self.resolution)
+                + 1 + 1e-9)
+
+    def beam_angles(self):
+        """Returns an array of the beam angles [rad] relative to the heading."""
+        return np.radians(linspace(self.min_angle, self.max_angle,
+            self.num_beams))
+
+    def noise_std(self, ranges):
+        """Returns the standard deviation of the noise on range measurements
+        (a scalar or an array of them), from the noise table if there is
+        one."""
+        if self.noise_table is None:
+            return self.noise
+        return np.interp(ranges, *self.noise_table)
 
     def __in_range(self, point):
         """Determines whether or not a point is within the range of the laser."""
@@ -182,11 +250,11 @@ class Laser(object):
             return True
         # Keep lines that intersect edge of laser FOV and are on both lines
         intersect_min = find_intersection(line, min_line)
-        if (validate_intersection(line, intersect_min) and 
+        if (intersect_min and validate_intersection(line, intersect_min) and
                 validate_intersection(min_line, intersect_min)):
             return True
         intersect_max = find_intersection(line, max_line)
-        if (validate_intersection(line, intersect_max) and 
+        if (intersect_max and validate_intersection(line, intersect_max) and
                 validate_intersection(max_line, intersect_max)):
             return True
         # Keep lines that intersect the range circle within the FOV
@@ -209,39 +277,188 @@ class Laser(object):
         y_max = y + self.range * sin(theta + pi/180*self.max_angle)
         min_line = get_line_dict(x, y, x_min, y_min)
         max_line = get_line_dict(x, y, x_max, y_max)
-        # Filter out lines
+        # Filter out lines, starting from those near the laser
         kept_lines = []
-        for line in line_map:
+        nearby = segments_near(line_map, self.pose, self.range)
+        for line in (get_line_dict(*seg) for seg in nearby.tolist()):
             if self.__include_line(line, min_line, max_line):
                 kept_lines.append(line)
         return kept_lines
 
+    def __scan_distorted(self, line_map):
+        """Returns the noiseless ranges (inf where nothing is hit) measured
+        while the robot moves with self.velocity during the sweep. The sweep
+        ends at self.pose, and each beam is cast from the pose the robot had
+        when it was fired, all in one batch."""
+        vel, ang_vel = self.velocity
+        angles = self.beam_angles()
+        # Time each beam was fired, relative to the end of the sweep
+        dt = self.scan_time * (linspace(0, 1, len(angles)) - 1)
+        x, y, heading = arc_step(self.pose[0], self.pose[1], self.pose[2],
+                vel * dt, ang_vel * dt)
+        # Only test lines the laser could reach from anywhere along the sweep
+        reach = self.range + abs(vel) * self.scan_time
+        return self.__cast(line_map, np.column_stack((x, y)), heading + angles,
+                reach)
+
+    def __cast(self, line_map, origins, angles, reach):
+        """Returns the ranges (inf where nothing is hit) of beams cast from
+        (N, 2) origins at angles [rad] through the segments of the map within
+        reach of the laser, and through its occupancy grid if it has one (or
+        from the map's range cache, if it is up to date)."""
+        cache = getattr(line_map, 'range_cache', None)
+        if cache is not None and cache.map_version == line_map.version:
+            return cache.cast(origins, angles, self.range)
+        segments = segments_near(line_map, self.pose, reach)
+        ranges, _ = cast_rays(origins, angles, segments, self.range)
+        grid = getattr(line_map, 'grid', None)
+        if grid is not None:
+            ranges = np.minimum(ranges, grid.cast(origins, angles, self.range))
+        return ranges
+
+    def __cast_sweep(self, line_map, angles):
+        """Returns the ranges (inf where nothing is hit) of beams cast from the
+        laser at angles [rad], sampled from its visibility polygon among the
+        segments within range (see sim.visibility)."""
+        cache = getattr(line_map, 'range_cache', None)
+        if cache is not None and cache.map_version == line_map.version:
+            origins = np.tile(self.pose[:2], (len(angles), 1))
+            return cache.cast(origins, angles, self.range)
+        segments = segments_near(line_map, self.pose, self.range)
+        ranges = sweep_ranges(self.pose[:2], angles, segments, self.range)
+        grid = getattr(line_map, 'grid', None)
+        if grid is not None:
+            origins = np.tile(self.pose[:2], (len(angles), 1))
+            ranges = np.minimum(ranges, grid.cast(origins, angles, self.range))
+        return ranges
+
+    def __cast_poses(self, line_map, poses, angles):
+        """Returns the (N, B) ranges (inf where nothing is hit) of beams at
+        angles [rad] relative to the heading of each of the (N, 3) poses."""
+        cache = getattr(line_map, 'range_cache', None)
+        if cache is not None and cache.map_version == line_map.version:
+            origins = np.repeat(poses[:, :2], len(angles), axis=0)
+            return cache.cast(origins, (poses[:, 2:3] + angles).ravel(),
+                    self.range).reshape(len(poses), len(angles))
+        if hasattr(line_map, 'segments_in'):
+            low = poses[:, :2].min(axis=0) - self.range
+            high = poses[:, :2].max(axis=0) + self.range
+            segments = line_map.segments_in(low[0], low[1], high[0], high[1])
+        else:
+            segments = as_segments(line_map)
+        ranges, _ = cast_scans(poses, angles, segments, self.range)
+        grid = getattr(line_map, 'grid', None)
+        if grid is not None:
+            origins = np.repeat(poses[:, :2], len(angles), axis=0)
+            ranges = np.minimum(ranges, grid.cast(origins, (poses[:, 2:3] +
+                angles).ravel(), self.range).reshape(ranges.shape))
+        return ranges
+
+    def expected_scans(self, line_map, poses, beams=None, workers=None):
+        """Returns an (N, B) array of the ranges this laser would measure
+        without noise (0 where nothing is hit) from each of the (N, 3) poses
+        (x, y, heading) in the map, e.g. for the measurement model of a
+        particle filter. beams selects the beams by index (all by default).
+        The fastest way the map allows is used (its range cache, then the
+        segments and grid), with the poses split across worker threads (one
+        per core by default)."""
+        poses = np.asarray(poses, dtype=float).reshape(-1, 3)
+        angles = self.beam_angles()
+        if beams is not None:
+            angles = angles[beams]
+        if len(poses) == 0:
+            return np.zeros((0, len(angles)))
+        ranges = np.vstack(map_chunks(lambda part: self.__cast_poses(
+            line_map, poses[part], angles), len(poses), POSE_CHUNK, workers))
+        ranges[~np.isfinite(ranges)] = 0
+        return ranges
+
+    def add_noise(self, ranges):
+        """Returns an array of the ranges (any shape, inf or 0 where nothing
+        was hit; e.g. from expected_scans) with noise added, 0 where nothing
+        was hit."""
+        ranges = np.asarray(ranges, dtype=float)
+        ranges = np.where(ranges > 0, ranges, np.inf)
+        if self.noise_model is not None:
+            ranges = self.noise_model.apply(ranges, self.range,
+                    self.noise_std(ranges))
+        else:
+            ranges = ranges + (np.random.normal(0, 1, ranges.shape) *
+                    self.noise_std(ranges))
+        ranges[~np.isfinite(ranges)] = 0
+        return ranges
+
+    def __add_noise(self, ranges):
+        """Returns a list of the ranges with noise added (0 where nothing was
+        hit)."""
+        return self.add_noise(ranges).tolist()
+
+    def __scan_key(self, line_map):
+        """Returns what a noiseless scan depends on, or None if it cannot be
+        told whether the map has changed."""
+        version = getattr(line_map, 'version', None)
+        if version is None:
+            return None
+        return (id(line_map), version, tuple(self.pose), self.min_angle,
+                self.max_angle, self.resolution, self.range, self.engine,
+                self.motion_distortion and self.scan_time > 0 and
+                (self.scan_time, tuple(self.velocity)))
+
     def scan(self, line_map):
         """Given the pose of the robot and a list of line segments (line_map),
-        returns a list of range measurements."""
-        ranges = []
-        laser_beams = self.__get_laser_beams()
+        returns a list of range measurements. If neither the laser, its pose
+        nor the map have changed since the last scan, its noiseless ranges
+        are reused and only the noise is drawn again."""
+        key = self.__scan_key(line_map)
+        if key is None or key != self.__last_key:
+            self.__last_ranges = self.__expected_ranges(line_map)
+            self.__last_key = key
+        return self.__add_noise(self.__last_ranges)
+
+    def __expected_ranges(self, line_map):
+        """Returns the noiseless ranges of a scan (inf where nothing is
+        hit)."""
+        if self.motion_distortion and self.scan_time > 0:
+            return self.__scan_distorted(line_map)
+        if self.engine == 'sweep':
+            return self.__cast_sweep(line_map, self.pose[2] +
+                    self.beam_angles())
+        if (getattr(line_map, 'grid', None) is not None or
+                getattr(line_map, 'range_cache', None) is not None):
+            angles = self.pose[2] + self.beam_angles()
+            origins = np.tile(self.pose[:2], (len(angles), 1))
+            return self.__cast(line_map, origins, angles, self.range)
         position = (self.pose[0], self.pose[1])
-        # Only include lines inside the laser range
+        # Only include lines inside the laser range, nearest first
         kept_lines = self.__reduce_line_map(line_map)
-        for beam in laser_beams:
-            r_min = 999
-            for line in kept_lines:
-                # find the (x, y) coordinates of intersection (if it exists)
-                intersection = find_intersection(beam, line)
-                # if the lines intersect
-                if intersection and validate_intersection(line, intersection):
-                    # if the intersection is on both the line segments
-                    if (validate_intersection(line, intersection) and 
-                            validate_intersection(beam, intersection)):
-                        # get a range measurement
-                        r_temp = dist_between_points(position, intersection)
-                        # keep it if its in the max range and its the 
-                        # smallest seen yet
-                        if r_temp < r_min and r_temp < self.range:
-                            r_min = r_temp + random.gauss(0, self.noise)
-            r_min = r_min if r_min < 999 else 0
-            ranges.append(r_min)
+        segments = np.array([[line['x_1'], line['y_1'], line['x_2'],
+            line['y_2']] for line in kept_lines]).reshape(-1, 4)
+        distances = segment_distances(segments, position)
+        order = np.argsort(distances, kind='mergesort')
+        segments, distances = segments[order], distances[order]
+        keys = [tuple(segment) for segment in segments.tolist()]
+        angles = self.pose[2] + self.beam_angles()
+        # The line each beam hit last time, if still kept, bounds its range
+        # (otherwise the laser's range does): only the lines nearer than
+        # their bound are tested, for all beams at once
+        positions = dict((key, i) for i, key in enumerate(keys))
+        last = np.array([positions.get(key, -1) for key in self.__last_hits]
+                if len(self.__last_hits) == len(angles) else
+                [-1] * len(angles), dtype=int)
+        bounds = np.full(len(angles), float(self.range))
+        known = np.flatnonzero(last >= 0)
+        if len(known):
+            line = segments[last[known]]
+            bounds[known] = np.minimum(self.range, _intersect(position[0],
+                position[1], np.cos(angles[known]), np.sin(angles[known]),
+                line[:, 0], line[:, 1], line[:, 2] - line[:, 0],
+                line[:, 3] - line[:, 1], self.range))
+        ranges, hits = cast_rays_bounded(position, angles, segments,
+                distances, bounds, self.range)
+        hits = np.where((hits < 0) & (bounds < self.range), last, hits)
+        ranges[ranges >= self.range] = np.inf
+        self.__last_hits = [keys[i] if i >= 0 else None for i in
+                hits.tolist()]
         return ranges
 
 
@@ -254,18 +471,21 @@ class Odometer(object):
         self.right_partial_tick = 0.0 # fraction of tick left over from [0-1]
         self.left_partial_tick = 0.0
 
-    def read(self, vel, ang_vel, wheel_rad, wheelbase):
+    def read(self, vel, ang_vel, wheel_rad, wheelbase, dt=None):
         """Returns a tuple (ticks_right, ticks_left) that indicates the number
-        of ticks the odometers have turned in one period."""
+        of ticks the odometers have turned in dt seconds (one period by
+        default)."""
         # return None if not moving
         if vel == 0 and ang_vel == 0:
             return None
+        if dt is None:
+            dt = 1.0/self.freq
         # Get angular velocities of each side
         omega_r = vel + wheelbase/(2*wheel_rad) * ang_vel
         omega_l = vel - wheelbase/(2*wheel_rad) * ang_vel
         # Calculate change of angle in this time step
-        theta_r = omega_r * (1.0/self.freq)
-        theta_l = omega_l * (1.0/self.freq)
+        theta_r = omega_r * dt
+        theta_l = omega_l * dt
         # Calculate (float) number of ticks for this change
         ticks_r = theta_r / (self.res * pi/180) + random.gauss(0, self.noise)
         ticks_l = theta_l / (self.res * pi/180) + random.gauss(0, self.noise)
@@ -292,57 +512,104 @@ class Robot(object):
         self.wheel_rad = d.ROBOT_WHEEL_RAD
         self.max_vel = d.ROBOT_MAX_VEL
         self.max_ang_vel = d.ROBOT_MAX_ANG_VEL * pi/180
+        self.max_step_angle = radians(d.ROBOT_MAX_STEP_ANGLE)
         self.vel = 0.0
         self.ang_vel = 0.0
         self.scanned = False # flag to determine if laser should be redrawn
         self.changed = False # flag to determine if robot should be redrawn
         self.last_scan = None # (pose, ranges) of latest laser scan
         self.last_odom = None # number of ticks of latest odometry measurement
+        self.path = [self.pose] # poses after each sub-step of the last update
+        self.collision = None # (pose, segment) if the last update collided
         self.compass = Compass()
         self.gps = GPS()
         self.gyroscope = Gyroscope()
         self.laser = Laser(self.pose)
         self.odometer = Odometer()
 
-    def __translate(self, distance):
-        """Update the (x, y) position of the robot after moving it forward a set
-        distance."""
-        self.x = self.x + cos(self.heading) * distance
-        self.y = self.y + sin(self.heading) * distance
-
     @property
     def pose(self):
         """Returns a tuple of the pose (x, y, heading) in [m, m, rad]."""
         return (self.x, self.y, self.heading)
 
-    def __rotate(self, angle):
-        """Update the heading of the robot after rotating it a set angle."""
-        self.heading += angle
+    def __drive(self, distance, angle):
+        """Update the pose of the robot after driving it a set distance along
+        an arc while turning a set angle."""
+        x, y, heading = arc_step(self.x, self.y, self.heading, distance, angle)
+        self.x, self.y = float(x), float(y)
         # make sure heading is between -pi and pi
-        self.heading = pi_to_pi(self.heading)
-
-    def update_pose(self):
-        """Update the pose of the robot based on its velocity and odometry
-        update rate."""
+        self.heading = pi_to_pi(float(heading))
+
+    def __stop_before(self, line_map, start, distance, angle, iterations=6):
+        """Moves the robot as far as it can go from start along the given arc
+        without hitting the map (found by bisection, to 1/2**iterations of
+        the arc), and returns the fraction of the arc driven."""
+        safe, unsafe = 0.0, 1.0
+        for _ in range(iterations):
+            middle = (safe + unsafe) / 2.0
+            self.x, self.y, self.heading = start
+            self.__drive(distance * middle, angle * middle)
+            if swept_collision(line_map, start, self.pose, self.length,
+                    self.width) is None:
+                safe = middle
+            else:
+                unsafe = middle
+        self.x, self.y, self.heading = start
+        self.__drive(distance * safe, angle * safe)
+        return safe
+
+    def update_pose(self, dt=None, line_map=None):
+        """Update the pose of the robot by driving it along the arc given by
+        its velocities for dt seconds (one odometry period by default). The
+        arc is integrated exactly, so dt can be long; it is split into
+        sub-steps that turn at most max_step_angle each, and the pose at the
+        end of each sub-step is kept in self.path.
+
+        If a line_map is given, the footprint swept by each sub-step is
+        checked against it, and the robot stops before the first sub-step
+        that would hit a segment; self.collision is then set to the pose and
+        the segment, and the odometry measures only the distance driven."""
+        if dt is None:
+            dt = 1.0/self.odometer.freq
         if abs(self.vel) < 1e-5:
             self.vel = 0
-        else:
-            self.__translate(self.vel * 1.0/self.odometer.freq)
-            self.changed = True
         if abs(self.ang_vel) < 1e-5:
             self.ang_vel = 0
-        else:
-            self.__rotate(self.ang_vel * 1.0/self.odometer.freq)
+        self.path = [self.pose]
+        self.collision = None
+        driven = dt
+        if self.vel != 0 or self.ang_vel != 0:
+            steps = 1
+            if self.max_step_angle > 0:
+                steps = max(1, int(ceil(abs(self.ang_vel) * dt /
+                    self.max_step_angle)))
+            for step in range(steps):
+                start = self.pose
+                self.__drive(self.vel * dt/steps, self.ang_vel * dt/steps)
+                if line_map is not None:
+                    segment = swept_collision(line_map, start, self.pose,
+                            self.length, self.width)
+                    if segment is not None:
+                        fraction = self.__stop_before(line_map, start,
+                                self.vel * dt/steps, self.ang_vel * dt/steps)
+                        self.path.append(self.pose)
+                        self.collision = (self.pose, segment)
+                        driven = dt * (step + fraction)/steps
+                        break
+                self.path.append(self.pose)
             self.changed = True
+        if driven == 0:
+            return None
         # Return odometry measurement
         return self.odometer.read(self.vel, self.ang_vel, self.wheel_rad,
-                self.wheelbase)
+                self.wheelbase, driven)
 
     def scan_laser(self, line_map):
         """Scan the laser and append the resulting ranges and the current pose 
         to the scan history."""
-        # update laser pose to match robot pose
+        # update laser pose and velocity to match robot
         self.laser.pose = self.pose
+        self.laser.velocity = (self.vel, self.ang_vel)
         # scan laser and save it with the robot pose
         self.scanned = True
         return self.laser.scan(line_map)
@@ -0,0 +1,185 @@
+"""Noise models for the sensors in sim.model. A sensor with a noise_model
+hands it its noiseless values (and its own white noise standard deviation)
+and gets back what it measures. Every model works on whole arrays: a single
+reading, all the beams of a scan, or all the readings of a time window at
+once (apply_window), and draws from its own seeded generator. Models with
+state (biases, outages) carry it from one call to the next."""
+# Python imports
+from math import exp, log, radians, sqrt
+import numpy as np
+
+# Laser
+RANGE_FRACTION = 0.01 # range noise std as a fraction of the range
+DROPOUT_PROB = 0.01 # probability a beam returns nothing
+MAX_RANGE_PROB = 0.005 # probability a beam returns the maximum range
+
+# Gyroscope
+GYRO_BIAS_WALK = radians(0.01) # bias random walk [rad/s/sqrt(s)]
+
+# GPS
+MULTIPATH_STD = 1.0 # std of the slowly varying multipath error [m]
+MULTIPATH_TIME = 30.0 # correlation time of the multipath error [s]
+OUTAGE_RATE = 1/300.0 # how often outages start [1/s]
+OUTAGE_DURATION = 10.0 # [s]
+
+# Compass
+HARD_IRON = (0.05, 0.02) # body frame magnetic offset / Earth's field
+
+
+def ar1(a, innovations, initial):
+    """Returns x_k = a*x_(k-1) + e_k along the first axis of innovations,
+    starting from x_0 = initial, without a Python loop per step: within a
+    block x_k = a**k * (x_0 + sum of e_j * a**-j), and blocks are short
+    enough for a**-j not to overflow."""
+    innovations = np.asarray(innovations, dtype=float)
+    out = np.empty_like(innovations)
+    x = np.asarray(initial, dtype=float)
+    block = len(innovations) if a >= 1 else (1 if a <= 0 else
+            max(1, int(300 / -log(a))))
+    for start in range(0, len(innovations), block):
+        e = innovations[start:start + block]
+        if a <= 0:
+            out[start:start + block] = e
+        else:
+            powers = a ** np.arange(1, len(e) + 1, dtype=float)
+            powers = powers.reshape((-1,) + (1,)*(e.ndim - 1))
+            out[start:start + block] = powers * (x + np.cumsum(e / powers,
+                axis=0))
+        x = out[start + len(e) - 1]
+    return out
+
+
+class LaserNoise(object):
+    """Range noise of a laser scanner: Gaussian, with a standard deviation
+    that is the larger of the laser's own and fraction of the range, plus
+    dropouts (no return) and spurious returns at the maximum range, each
+    with a probability per beam."""
+    def __init__(self, fraction=RANGE_FRACTION, dropout=DROPOUT_PROB,
+            max_range_prob=MAX_RANGE_PROB, seed=None):
+        self.fraction = fraction
+        self.dropout = dropout
+        self.max_range_prob = max_range_prob
+        self.rng = np.random.RandomState(seed)
+
+    def apply(self, ranges, max_range, std):
+        """Returns noisy ranges (any shape; inf where nothing is hit, which
+        dropouts add to) given the laser's std (scalar or per range)."""
+        ranges = np.asarray(ranges, dtype=float)
+        with np.errstate(invalid='ignore'):
+            std = np.maximum(std, self.fraction * ranges)
+        noisy = ranges + self.rng.standard_normal(ranges.shape) * \
+                np.where(np.isfinite(std), std, 0)
+        draw = self.rng.random_sample(ranges.shape)
+        noisy[draw < self.dropout] = np.inf
+        noisy[draw > 1 - self.max_range_prob] = max_range
+        return noisy
+
+    def apply_window(self, ranges, max_range, std):
+        """As apply, for (T, B) scans (no state is carried between scans)."""
+        return self.apply(ranges, max_range, std)
+
+
+class GyroNoise(object):
+    """Gyroscope noise: white noise plus a bias that wanders as a random walk
+    of bias_walk [rad/s/sqrt(s)]."""
+    def __init__(self, bias_walk=GYRO_BIAS_WALK, bias=0.0, seed=None):
+        self.bias_walk = bias_walk
+        self.bias = bias
+        self.rng = np.random.RandomState(seed)
+
+    def apply_window(self, ang_vels, dt, std):
+        """Returns the readings of T angular velocities dt [s] apart."""
+        ang_vels = np.asarray(ang_vels, dtype=float)
+        steps = self.rng.standard_normal(ang_vels.shape) * \
+                self.bias_walk * sqrt(dt)
+        bias = self.bias + np.cumsum(steps)
+        self.bias = float(bias[-1]) if len(bias) else self.bias
+        return ang_vels + bias + self.rng.standard_normal(ang_vels.shape) * std
+
+    def apply(self, ang_vel, dt, std):
+        return float(self.apply_window([ang_vel], dt, std)[0])
+
+
+class GpsNoise(object):
+    """GPS noise: white noise plus a multipath error that varies slowly (a
+    first order Gauss-Markov process with correlation time multipath_time
+    [s]), and outages starting at outage_rate [1/s] and lasting
+    outage_duration [s], during which there is no fix."""
+    def __init__(self, multipath_std=MULTIPATH_STD,
+            multipath_time=MULTIPATH_TIME, outage_rate=OUTAGE_RATE,
+            outage_duration=OUTAGE_DURATION, seed=None):
+        self.multipath_std = multipath_std
+        self.multipath_time = multipath_time
+        self.outage_rate = outage_rate
+        self.outage_duration = outage_duration
+        self.rng = np.random.RandomState(seed)
+        self.multipath = self.rng.standard_normal(2) * multipath_std
+        self.outage_left = 0.0 # [s]
+
+    def apply_window(self, positions, dt, std):
+        """Returns the fixes for T (x, y) positions dt [s] apart, as a (T, 2)
+        array with NaN rows during outages."""
+        positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+        count = len(positions)
+        a = exp(-dt / self.multipath_time) if self.multipath_time > 0 else 0.0
+        innovations = self.rng.standard_normal((count, 2)) * \
+                self.multipath_std * sqrt(1 - a*a)
+        multipath = ar1(a, innovations, self.multipath)
+        if count:
+            self.multipath = multipath[-1]
+        fixes = positions + multipath + \
+                self.rng.standard_normal((count, 2)) * std
+        # Outages: one carried over, then any starting in this window
+        index = np.arange(count)
+        ticks = int(np.ceil(self.outage_duration / dt))
+        starts = self.rng.random_sample(count) < 1 - exp(-self.outage_rate*dt)
+        ends = np.maximum.accumulate(np.where(starts, index + ticks, -1)) \
+                if count else index
+        carried = int(np.ceil(self.outage_left / dt - 1e-6))
+        out = (index < carried) | (index < ends)
+        fixes[out] = np.nan
+        if count:
+            self.outage_left = max(0, max(carried, ends[-1]) - count) * dt
+        return fixes
+
+    def apply(self, x, y, dt, std):
+        """Returns a noisy fix (x, y), or None during an outage."""
+        fix = self.apply_window([(x, y)], dt, std)[0]
+        if np.isnan(fix[0]):
+            return None
+        return float(fix[0]), float(fix[1])
+
+
+class CompassNoise(object):
+    """Compass noise: white noise plus the heading error of a hard-iron
+    offset (a magnetic field fixed to the robot, given as (x, y) in the body
+    frame as a fraction of the Earth's field), which depends on the
+    heading."""
+    def __init__(self, hard_iron=HARD_IRON, seed=None):
+        self.hard_iron = hard_iron
+        self.rng = np.random.RandomState(seed)
+
+    def apply_window(self, headings, dt, std):
+        """Returns the bearings [rad] measured at the true headings."""
+        headings = np.asarray(headings, dtype=float)
+        # Earth's field (along the x axis) seen from the body frame, plus
+        # the offset
+        field_x = np.cos(headings) + self.hard_iron[0]
+        field_y = -np.sin(headings) + self.hard_iron[1]
+        error = np.arctan2(-field_y, field_x) - headings
+        error = np.arctan2(np.sin(error), np.cos(error))
+        return headings + error + \
+                self.rng.standard_normal(headings.shape) * std
+
+    def apply(self, heading, dt, std):
+        return float(self.apply_window([heading], dt, std)[0])
+
+
+def install_noise_models(robot, seed=None):
+    """Gives each sensor of a robot (except the odometer) the noise model
+    above with the default parameters, each seeded from seed."""
+    seeds = np.random.RandomState(seed).randint(2**31 - 1, size=4)
+    robot.laser.noise_model = LaserNoise(seed=seeds[0])
+    robot.gyroscope.noise_model = GyroNoise(seed=seeds[1])
+    robot.gps.noise_model = GpsNoise(seed=seeds[2])
+    robot.compass.noise_model = CompassNoise(seed=seeds[3])
@@ -0,0 +1,146 @@
+"""Obstacles (people, vehicles, other equipment) that move along scripted
+trajectories. Each is a set of segments in its own frame, placed each tick at
+its pose interpolated between timed waypoints."""
+# Python imports
+import json
+import numpy as np
+
+# MSL Sim imports
+import sim.defaults as d
+from sim.spatial import SpatialIndex
+
+
+class DynamicObstacles(object):
+    """All the moving obstacles of a map. Every tick (see update) the poses
+    of all of them are interpolated and their segments transformed together,
+    and only their entries in the spatial index are updated. The version
+    number changes every time they move."""
+    def __init__(self, cell_size=d.INDEX_CELL_SIZE):
+        self.local = np.zeros((0, 4)) # segments of all obstacles, own frames
+        self.owner = np.zeros(0, dtype=np.int64) # obstacle of each segment
+        self.segments = np.zeros((0, 4)) # segments in the map frame
+        self.waypoints = [] # (W, 4) time [s], x, y, heading [rad] of each
+        self.loops = []
+        self.index = SpatialIndex(cell_size)
+        self.time = 0.0
+        self.version = 0
+        self.__tables = None # waypoints of all obstacles, for interpolation
+
+    def __len__(self):
+        return len(self.waypoints)
+
+    def add(self, segments, waypoints, loop=True):
+        """Adds an obstacle made of an (M, 4) array of segments in its own
+        frame, moving through (W, 4) waypoints of time [s], x, y and heading
+        [rad] (in increasing time order). Looping obstacles start over after
+        the last waypoint, others stop there. Returns the obstacle's index."""
+        segments = np.asarray(segments, dtype=float).reshape(-1, 4)
+        waypoints = np.asarray(waypoints, dtype=float).reshape(-1, 4)
+        number = len(self.waypoints)
+        self.waypoints.append(waypoints)
+        self.loops.append(bool(loop))
+        self.__tables = None
+        first = len(self.local)
+        self.local = np.vstack((self.local, segments))
+        self.owner = np.append(self.owner, np.full(len(segments), number))
+        placed = self.__transform(segments, self.poses_at(self.time)[number])
+        self.segments = np.vstack((self.segments, placed))
+        self.index.insert(np.arange(first, len(self.local)), placed)
+        self.version += 1
+        return number
+
+    def __build_tables(self):
+        """Concatenates the waypoints of all obstacles, keyed so that a
+        single sorted search finds the waypoints around each one's time."""
+        times = [w[:, 0] - w[0, 0] for w in self.waypoints]
+        durations = np.array([t[-1] for t in times])
+        span = durations.max() + 1.0 # keeps the obstacles' keys apart
+        keys = np.concatenate([t + i*span for i, t in enumerate(times)])
+        counts = np.array([len(w) for w in self.waypoints])
+        self.__tables = (keys, np.vstack(self.waypoints), span,
+                np.array([w[0, 0] for w in self.waypoints]), durations,
+                np.array(self.loops), np.cumsum(counts) - counts, counts)
+
+    def poses_at(self, t):
+        """Returns the (N, 3) poses of all obstacles at time t [s]."""
+        if not self.waypoints:
+            return np.zeros((0, 3))
+        if self.__tables is None:
+            self.__build_tables()
+        keys, waypoints, span, starts, durations, loops, firsts, counts = \
+                self.__tables
+        elapsed = np.maximum(t - starts, 0)
+        elapsed = np.where(loops & (durations > 0),
+                np.mod(elapsed, np.where(durations > 0, durations, 1)),
+                np.minimum(elapsed, durations))
+        # Index of the waypoint after each obstacle's time
+        after = np.searchsorted(keys, elapsed + np.arange(len(starts))*span,
+                side='right')
+        after = np.clip(after, firsts + 1, firsts + counts - 1)
+        single = counts == 1
+        after[single] = firsts[single]
+        before = np.where(single, firsts, after - 1)
+        span_t = waypoints[after, 0] - waypoints[before, 0]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            fraction = np.clip(np.where(span_t > 0, (elapsed + starts -
+                waypoints[before, 0]) / span_t, 0), 0, 1)
+        start, end = waypoints[before, 1:], waypoints[after, 1:]
+        # Turn the short way round between headings
+        turn = np.mod(end[:, 2] - start[:, 2] + np.pi, 2*np.pi) - np.pi
+        return np.column_stack((start[:, :2] + (end[:, :2] - start[:, :2]) *
+            fraction[:, None], start[:, 2] + turn*fraction))
+
+    @staticmethod
+    def __transform(segments, poses):
+        """Returns segments (in their own frames) placed at poses, given one
+        pose per segment (or one for all)."""
+        poses = np.asarray(poses, dtype=float).reshape(-1, 3)
+        c, s = np.cos(poses[:, 2:3]), np.sin(poses[:, 2:3])
+        x, y = segments[:, 0::2], segments[:, 1::2]
+        placed = np.empty_like(segments)
+        placed[:, 0::2] = poses[:, 0:1] + c*x - s*y
+        placed[:, 1::2] = poses[:, 1:2] + s*x + c*y
+        return placed
+
+    def update(self, t):
+        """Moves all obstacles to where they are at time t [s]."""
+        self.time = t
+        if not len(self.local):
+            return
+        placed = self.__transform(self.local, self.poses_at(t)[self.owner])
+        moved = np.flatnonzero(np.any(placed != self.segments, axis=1))
+        self.segments = placed
+        if len(moved):
+            self.index.update(moved, placed[moved])
+            self.version += 1
+
+    def step(self, dt):
+        """Moves all obstacles dt [s] further along their trajectories."""
+        self.update(self.time + dt)
+
+    def segments_in(self, x_min, y_min, x_max, y_max):
+        """Returns the segments that may be inside the rectangle."""
+        return self.segments[self.index.query(x_min, y_min, x_max, y_max)]
+
+
+def load_obstacles(filename, obstacles=None):
+    """Adds the obstacles described in a YAML or JSON file to obstacles (new
+    ones if not given) and returns them. The file holds a list of obstacles,
+    each with a 'shape' (the [x, y] [m] vertices of a polygon in its own
+    frame), 'waypoints' ([time [s], x [m], y [m], heading [deg]] each) and,
+    optionally, 'loop' (true by default)."""
+    with open(filename) as f:
+        if filename.endswith('.json'):
+            params = json.load(f)
+        else:
+            import yaml
+            params = yaml.safe_load(f)
+    if obstacles is None:
+        obstacles = DynamicObstacles()
+    for obstacle in params['obstacles']:
+        vertices = np.asarray(obstacle['shape'], dtype=float)
+        segments = np.hstack((vertices, np.roll(vertices, -1, axis=0)))
+        waypoints = np.array(obstacle['waypoints'], dtype=float).reshape(-1, 4)
+        waypoints[:, 3] = np.radians(waypoints[:, 3])
+        obstacles.add(segments, waypoints, obstacle.get('loop', True))
+    return obstacles
@@ -0,0 +1,81 @@
+"""Load shedding for sensor updates that overrun their period. Each update
+with an OverloadPolicy is timed against the wall time its period allows, and
+when it takes too long the policy degrades it: by skipping frames, by
+coarsening the laser's resolution or by lowering the sensor's rate."""
+# Python imports
+import math
+
+# MSL Sim imports
+import sim.defaults as d
+
+SKIP = 'skip'
+RESOLUTION = 'resolution'
+RATE = 'rate'
+POLICIES = (SKIP, RESOLUTION, RATE)
+
+
+class OverloadPolicy(object):
+    """How a sensor's update sheds load when it takes longer than budget
+    times its period (of wall time):
+    - 'skip' skips as many of the following frames as it takes for the
+      updates to stay within budget on average;
+    - 'resolution' doubles the angle between the laser's beams;
+    - 'rate' halves the rate of the sensor.
+    Resolution and rate are degraded by at most max_level halvings, and are
+    restored a halving at a time once recovery updates in a row have taken
+    less than a quarter of the budget (so that they stay within half of it
+    once restored). level is how degraded the sensor is now: the number of
+    frames left to skip, or of halvings."""
+    def __init__(self, policy=SKIP, budget=d.OVERLOAD_BUDGET,
+            max_level=d.OVERLOAD_MAX_LEVEL, recovery=d.OVERLOAD_RECOVERY):
+        if policy not in POLICIES:
+            raise ValueError('Unknown overload policy %r (expected one of %s)'
+                    % (policy, ', '.join(POLICIES)))
+        self.policy = policy
+        self.budget = budget
+        self.max_level = max_level
+        self.recovery = recovery
+        self.level = 0
+        self.calm = 0 # updates in a row well within budget
+        self.overruns = 0
+        self.duration = 0.0 # wall time taken by the last update [s]
+        self.allowed = 0.0 # wall time it was allowed [s]
+        self.base = None # laser resolution before it was degraded [deg]
+
+    @property
+    def rate_divisor(self):
+        """Returns what the sensor's frequency is divided by."""
+        return 2**self.level if self.policy == RATE else 1
+
+    def skip(self):
+        """Returns whether to skip the frame that is due now."""
+        if self.policy == SKIP and self.level > 0:
+            self.level -= 1
+            return True
+        return False
+
+    def record(self, duration, period):
+        """Records an update that took duration [s] of wall time against a
+        period [s] of wall time. Returns the new level if it changed because
+        the update overran or recovered, and None otherwise."""
+        self.duration = duration
+        self.allowed = self.budget * period
+        if duration > self.allowed:
+            self.overruns += 1
+            self.calm = 0
+            if self.policy == SKIP:
+                self.level = int(math.ceil(duration / self.allowed)) - 1
+                return self.level
+            if self.level < self.max_level:
+                self.level += 1
+                return self.level
+            return None
+        if self.level > 0 and duration < self.allowed/4.0:
+            self.calm += 1
+            if self.calm >= self.recovery:
+                self.calm = 0
+                self.level -= 1
+                return self.level
+        else:
+            self.calm = 0
+        return None
@@ -0,0 +1,138 @@
+# Python imports
+import hashlib
+import json
+import os
+import numpy as np
+
+# Directory holding the preset files, in one sub-directory per kind of preset
+PRESET_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+        os.pardir, os.pardir, 'presets')
+# Directory where the derived data of each preset file is cached
+CACHE_DIR = os.path.join(os.environ.get('ROS_HOME',
+    os.path.join(os.path.expanduser('~'), '.ros')), 'msl_sim', 'presets')
+# Incremented whenever the derived data changes, invalidating old caches
+CACHE_VERSION = 2
+NOISE_TABLE_STEP = 0.01 # spacing of the laser noise table [m]
+
+
+def laser_tables(params):
+    """Returns the derived data of a laser preset: a table (ranges [m],
+    standard deviations [m]) of the range noise. The noise is either a
+    constant or a list of [range, std] points to interpolate, and is raised to
+    noise_fraction of the range where that is larger."""
+    ranges = np.arange(0, params['range'] + NOISE_TABLE_STEP, NOISE_TABLE_STEP)
+    noise = np.asarray(params['noise'], dtype=float)
+    if noise.ndim == 0:
+        stds = np.full(len(ranges), float(noise))
+    else:
+        stds = np.interp(ranges, noise[:, 0], noise[:, 1])
+    stds = np.maximum(stds, params.get('noise_fraction', 0.0) * ranges)
+    return {'noise_ranges': ranges, 'noise_stds': stds}
+
+
+def robot_tables(params):
+    """Returns the derived data of a robot preset, of which there is none:
+    its values are used as they are."""
+    return {}
+
+
+class Preset(object):
+    """A sensor or robot model loaded from a preset file. params holds the
+    values from the file (in the units used by the settings dialog) and
+    tables holds the arrays derived from them."""
+    def __init__(self, kind, params, tables):
+        self.kind = kind
+        self.name = params['name']
+        self.params = params
+        self.tables = tables
+
+    @property
+    def noise_table(self):
+        """Returns the (ranges, stds) range noise table of a laser preset."""
+        return self.tables['noise_ranges'], self.tables['noise_stds']
+
+    @property
+    def noise(self):
+        """Returns the range noise of a laser preset at half its range [m]."""
+        return float(np.interp(self.params['range']/2.0, *self.noise_table))
+
+
+class PresetRegistry(object):
+    """Loads the presets of each kind (e.g. 'lasers', 'robots') from the YAML
+    or JSON files in the corresponding sub-directory of preset_dir. The data
+    derived from each file is computed once and cached in cache_dir under the
+    hash of the file, so later loads skip both parsing and computing."""
+    table_functions = {'lasers': laser_tables, 'robots': robot_tables}
+
+    def __init__(self, preset_dir=PRESET_DIR, cache_dir=CACHE_DIR):
+        self.preset_dir = preset_dir
+        self.cache_dir = cache_dir
+        self.presets = {} # kind -> list of presets, loaded when first needed
+
+    def __load_file(self, kind, filename):
+        """Returns the preset in a file, from the cache if possible."""
+        with open(filename, 'rb') as f:
+            contents = f.read()
+        key = hashlib.sha1(contents).hexdigest()
+        cache_file = os.path.join(self.cache_dir,
+                '%s-%d.npz' % (key, CACHE_VERSION))
+        try:
+            with np.load(cache_file) as cached:
+                tables = dict((k, cached[k]) for k in cached.files
+                        if k != 'params')
+                params = json.loads(str(cached['params']))
+            return Preset(kind, params, tables)
+        except (IOError, OSError, KeyError, ValueError):
+            pass
+        if filename.endswith('.json'):
+            params = json.loads(contents.decode('utf-8'))
+        else:
+            import yaml
+            params = yaml.safe_load(contents)
+        tables = self.table_functions[kind](params)
+        self.__save_cache(cache_file, params, tables)
+        return Preset(kind, params, tables)
+
+    def __save_cache(self, cache_file, params, tables):
+        """Writes the cache file of a preset. Failing to write it is harmless,
+        so errors are ignored."""
+        temp_file = '%s.%d.tmp' % (cache_file, os.getpid())
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            with open(temp_file, 'wb') as f:
+                np.savez(f, params=json.dumps(params), **tables)
+            os.rename(temp_file, cache_file)
+        except (IOError, OSError):
+            pass
+
+    def load(self, kind):
+        """Loads (or reloads) the presets of a kind, ordered by their 'order'
+        value and then their name."""
+        directory = os.path.join(self.preset_dir, kind)
+        presets = []
+        if os.path.isdir(directory):
+            for filename in sorted(os.listdir(directory)):
+                if filename.endswith(('.yaml', '.yml', '.json')):
+                    presets.append(self.__load_file(kind,
+                        os.path.join(directory, filename)))
+        presets.sort(key=lambda p: (p.params.get('order', 0), p.name))
+        self.presets[kind] = presets
+        return presets
+
+    def get_all(self, kind):
+        """Returns the list of presets of a kind."""
+        if kind not in self.presets:
+            self.load(kind)
+        return self.presets[kind]
+
+    def names(self, kind):
+        """Returns the names of the presets of a kind."""
+        return [preset.name for preset in self.get_all(kind)]
+
+    def get(self, kind, name):
+        """Returns the preset of a kind with the given name."""
+        for preset in self.get_all(kind):
+            if preset.name == name:
+                return preset
+        raise KeyError('No %s preset named %r' % (kind, name))
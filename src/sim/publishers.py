@@ -0,0 +1,365 @@
+# Python imports
+import copy
+import threading
+import time
+from collections import deque
+
+# MSL Sim imports
+import sim.defaults as d
+from sim.clock import SimClock
+
+DROP_OLDEST = 'oldest'
+DROP_NEWEST = 'newest'
+
+
+class RosPublisher(object):
+    """Publishes the simulated measurements on the /msl_sim ROS topics. rospy
+    and the message modules are only imported, and the node only initialized,
+    when start is called, so the simulator can show its window (or start
+    simulating) first. Measurements published before then are dropped, and
+    parameters set before then are sent once started. Messages are stamped
+    with the time of clock (a SimClock, which the Simulation sets), or with
+    the wall time if it is None."""
+    def __init__(self, node_name='msl_sim', clock=None):
+        self.node_name = node_name
+        self.clock = clock
+        self.started = False
+        self.params = {} # parameters waiting to be set
+
+    def start(self):
+        """Imports rospy, initializes the node and creates the publishers."""
+        if self.started:
+            return
+        # ROS imports
+        import rospy
+        from rosgraph_msgs.msg import Clock
+        from sensor_msgs.msg import LaserScan
+        from std_msgs.msg import Float64
+        from msl_sim.msg import (Collision, Compass, Degradation, GPS, Gyro,
+                Encoders, Pose2DStamped)
+        self.rospy = rospy
+        self.msg_types = {'clock': Clock, 'collision': Collision,
+                'compass': Compass, 'degradation': Degradation,
+                'encoders': Encoders, 'gps': GPS,
+                'gyro': Gyro, 'ground_truth': Pose2DStamped,
+                'real_time_factor': Float64, 'scan': LaserScan}
+        rospy.init_node(self.node_name)
+        self.publishers = dict((topic, rospy.Publisher('/clock'
+            if topic == 'clock' else '/msl_sim/' + topic, msg_type,
+            queue_size=10)) for topic, msg_type in self.msg_types.items())
+        for name, value in self.params.items():
+            rospy.set_param(name, value)
+        self.params = {}
+        self.started = True
+
+    def set_param(self, name, value):
+        """Sets a ROS parameter, or stores it until the node is started."""
+        if self.started:
+            self.rospy.set_param(name, value)
+        else:
+            self.params[name] = value
+
+    def stamp(self):
+        """Returns the time messages are stamped with now."""
+        if self.clock is None:
+            return self.rospy.Time.now()
+        return self.rospy.Time.from_sec(self.clock.time)
+
+    def __publish(self, topic, **fields):
+        """Stamps (if it has a header) and publishes a message with the given
+        fields on a topic."""
+        if not self.started:
+            return
+        msg = self.msg_types[topic]()
+        for name, value in fields.items():
+            setattr(msg, name, value)
+        if hasattr(msg, 'header'):
+            msg.header.stamp = self.stamp()
+        self.publishers[topic].publish(msg)
+
+    def publish_clock(self, sim_time):
+        if self.started:
+            self.__publish('clock', clock=self.rospy.Time.from_sec(sim_time))
+
+    def publish_collision(self, pose, segment):
+        x, y, theta = pose
+        self.__publish('collision', x=x, y=y, theta=theta, segment=segment)
+
+    def publish_compass(self, bearing):
+        self.__publish('compass', bearing=bearing)
+
+    def publish_degradation(self, sensor, policy, level, duration, allowed):
+        self.__publish('degradation', sensor=sensor, policy=policy,
+                level=level, duration=duration, allowed=allowed)
+
+    def publish_encoders(self, right_ticks, left_ticks):
+        self.__publish('encoders', right_ticks=right_ticks,
+                left_ticks=left_ticks)
+
+    def publish_gps(self, x, y):
+        self.__publish('gps', x=x, y=y)
+
+    def publish_ground_truth(self, x, y, theta):
+        self.__publish('ground_truth', x=x, y=y, theta=theta)
+
+    def publish_gyro(self, angular_velocity):
+        self.__publish('gyro', angular_velocity=angular_velocity)
+
+    def publish_real_time_factor(self, factor):
+        self.__publish('real_time_factor', data=factor)
+
+    def publish_scan(self, laser, ranges):
+        self.__publish('scan', angle_min=laser.min_angle,
+                angle_max=laser.max_angle, angle_increment=laser.resolution,
+                range_min=0.0, range_max=laser.range,
+                scan_time=1.0/laser.freq,
+                time_increment=laser.scan_time/max(1, laser.num_beams - 1),
+                ranges=ranges)
+
+
+class AsyncPublisher(object):
+    """Hands the measurements given to its publish_* methods over to a
+    publisher (e.g. a RosPublisher) running on its own I/O thread, so that
+    building, serializing and sending messages never holds up the
+    simulation. Each topic has a queue of queue_size messages; when it is
+    full, drop says which message is dropped: the oldest one queued (the
+    default, so subscribers get the latest data) or the newest one. Messages
+    are stamped with the time of clock when they are queued, and stats holds,
+    per topic, the messages published and dropped and the latency [s] from
+    queueing to publishing."""
+    def __init__(self, publisher, queue_size=d.PUBLISH_QUEUE_SIZE,
+            drop=d.PUBLISH_DROP):
+        if drop not in (DROP_OLDEST, DROP_NEWEST):
+            raise ValueError('Unknown drop policy %r' % drop)
+        self.publisher = publisher
+        self.queue_size = queue_size
+        self.drop = drop
+        self.clock = None
+        # The publisher stamps each message with the time it was queued
+        self.stamp_clock = SimClock()
+        publisher.clock = self.stamp_clock
+        self.queues = {} # topic -> deque of (stamp, wall time, method, args)
+        self.stats = {}
+        self.condition = threading.Condition()
+        self.worker = None
+
+    @property
+    def started(self):
+        return self.publisher.started
+
+    def start(self):
+        """Starts the publisher (on this thread, as rospy must be initialized
+        on the main thread) and then the I/O thread."""
+        self.publisher.start()
+        if self.worker is None:
+            self.running = True
+            self.worker = threading.Thread(target=self.__publish_loop)
+            self.worker.daemon = True
+            self.worker.start()
+
+    def stop(self):
+        """Stops the I/O thread once it has published what is queued."""
+        if self.worker is not None:
+            with self.condition:
+                self.running = False
+                self.condition.notify()
+            self.worker.join()
+            self.worker = None
+
+    def set_param(self, name, value):
+        self.publisher.set_param(name, value)
+
+    def topic_stats(self, topic):
+        """Returns the statistics of a topic, creating them if needed."""
+        if topic not in self.stats:
+            self.stats[topic] = {'published': 0, 'dropped': 0,
+                    'total_latency': 0.0, 'max_latency': 0.0}
+        return self.stats[topic]
+
+    def summary(self):
+        """Returns one line of the messages published and dropped and the
+        mean and largest latency of each topic."""
+        parts = []
+        for topic in sorted(self.stats):
+            stats = self.stats[topic]
+            mean = stats['total_latency'] / max(stats['published'], 1)
+            parts.append('%s: %d sent, %d dropped, %.1f ms mean and %.1f ms '
+                    'max latency' % (topic, stats['published'],
+                        stats['dropped'], 1000*mean,
+                        1000*stats['max_latency']))
+        return '; '.join(parts)
+
+    def __queue(self, topic, method, *args):
+        """Queues a call of a method of the publisher, dropping a message if
+        the topic's queue is full. Never blocks for longer than it takes the
+        I/O thread to take a message off a queue."""
+        if not self.started:
+            return
+        stamp = self.clock.time if self.clock is not None else time.time()
+        with self.condition:
+            queue = self.queues.get(topic)
+            if queue is None:
+                queue = self.queues[topic] = deque()
+            stats = self.topic_stats(topic)
+            if len(queue) >= self.queue_size:
+                stats['dropped'] += 1
+                if self.drop == DROP_NEWEST:
+                    return
+                queue.popleft()
+            queue.append((stamp, time.time(), method, args))
+            self.condition.notify()
+
+    def __publish_loop(self):
+        while True:
+            with self.condition:
+                while self.running and not any(self.queues.values()):
+                    self.condition.wait()
+                waiting = [(queue[0][1], topic) for topic, queue in
+                        self.queues.items() if queue]
+                if not waiting:
+                    return
+                # The message queued first, whatever its topic
+                topic = min(waiting)[1]
+                stamp, queued, method, args = self.queues[topic].popleft()
+            self.stamp_clock.set(stamp)
+            getattr(self.publisher, method)(*args)
+            latency = time.time() - queued
+            with self.condition:
+                stats = self.stats[topic]
+                stats['published'] += 1
+                stats['total_latency'] += latency
+                stats['max_latency'] = max(stats['max_latency'], latency)
+
+    def publish_clock(self, sim_time):
+        self.__queue('clock', 'publish_clock', sim_time)
+
+    def publish_collision(self, pose, segment):
+        self.__queue('collision', 'publish_collision', pose, segment)
+
+    def publish_compass(self, bearing):
+        self.__queue('compass', 'publish_compass', bearing)
+
+    def publish_degradation(self, sensor, policy, level, duration, allowed):
+        self.__queue('degradation', 'publish_degradation', sensor, policy,
+                level, duration, allowed)
+
+    def publish_encoders(self, right_ticks, left_ticks):
+        self.__queue('encoders', 'publish_encoders', right_ticks, left_ticks)
+
+    def publish_gps(self, x, y):
+        self.__queue('gps', 'publish_gps', x, y)
+
+    def publish_ground_truth(self, x, y, theta):
+        self.__queue('ground_truth', 'publish_ground_truth', x, y, theta)
+
+    def publish_gyro(self, angular_velocity):
+        self.__queue('gyro', 'publish_gyro', angular_velocity)
+
+    def publish_real_time_factor(self, factor):
+        self.__queue('real_time_factor', 'publish_real_time_factor', factor)
+
+    def publish_scan(self, laser, ranges):
+        # The scan is published with the laser's settings when it was taken
+        self.__queue('scan', 'publish_scan', copy.copy(laser), ranges)
+
+
+class PublisherGroup(object):
+    """Passes the measurements on to each of several publishers (e.g. an
+    AsyncPublisher for ROS and a SharedMemoryPublisher)."""
+    def __init__(self, publishers):
+        self.publishers = list(publishers)
+        self.__clock = None
+
+    @property
+    def clock(self):
+        return self.__clock
+
+    @clock.setter
+    def clock(self, clock):
+        self.__clock = clock
+        for publisher in self.publishers:
+            publisher.clock = clock
+
+    @property
+    def started(self):
+        return any(publisher.started for publisher in self.publishers)
+
+    def start(self):
+        for publisher in self.publishers:
+            publisher.start()
+
+    def stop(self):
+        for publisher in self.publishers:
+            if hasattr(publisher, 'stop'):
+                publisher.stop()
+
+    def set_param(self, name, value):
+        for publisher in self.publishers:
+            publisher.set_param(name, value)
+
+    def take_command(self):
+        """Returns the latest velocity command of the publishers that take
+        commands (see SocketPublisher), or None if there is none."""
+        command = None
+        for publisher in self.publishers:
+            if hasattr(publisher, 'take_command'):
+                command = publisher.take_command() or command
+        return command
+
+    def summary(self):
+        """Returns the summaries of the publishers that have one."""
+        return '; '.join(publisher.summary() for publisher in self.publishers
+                if hasattr(publisher, 'summary') and publisher.summary())
+
+    def __getattr__(self, name):
+        if not name.startswith('publish_'):
+            raise AttributeError(name)
+        methods = [getattr(publisher, name) for publisher in self.publishers]
+
+        def publish(*args):
+            for method in methods:
+                method(*args)
+        return publish
+
+
+def _ros_transport():
+    return AsyncPublisher(RosPublisher())
+
+
+def _shm_transport():
+    # MSL Sim imports (here, as they need Python 3)
+    from sim.shm import SharedMemoryPublisher
+    return SharedMemoryPublisher()
+
+
+def _socket_transport(address=d.STREAM_ADDRESS):
+    from sim.stream import SocketPublisher
+    return SocketPublisher(address)
+
+
+# Factories of the publishers of each transport, taking its options
+TRANSPORTS = {'ros': _ros_transport, 'shm': _shm_transport,
+        'socket': _socket_transport}
+
+
+def register_transport(name, factory):
+    """Makes a transport available by name, created by calling factory with
+    the transport's options."""
+    TRANSPORTS[name] = factory
+
+
+def create_publisher(transports, options=None):
+    """Returns a publisher of the measurements on each of the named
+    transports (None if none), with the options (a dictionary of keyword
+    arguments by transport name) of each."""
+    options = options or {}
+    publishers = []
+    for name in transports:
+        if name not in TRANSPORTS:
+            raise ValueError('Unknown transport %r (expected one of %s)' % (
+                name, ', '.join(sorted(TRANSPORTS))))
+        publishers.append(TRANSPORTS[name](**options.get(name, {})))
+    if not publishers:
+        return None
+    return publishers[0] if len(publishers) == 1 else \
+            PublisherGroup(publishers)
@@ -0,0 +1,216 @@
+"""Precomputed ranges for static maps. A RangeCache rasterizes a map and
+computes the distance from every cell to the nearest occupied one, so beams
+can be cast by sphere tracing (stepping by the distance to the nearest
+obstacle), and optionally a table of the range from every cell in each of a
+number of directions, so beams are cast by looking the range up. Both are
+saved under the hash of the map, and loaded from there next time."""
+# Python imports
+import hashlib
+import os
+from math import ceil, pi
+import numpy as np
+
+# MSL Sim imports
+import sim.defaults as d
+from sim.grid_map import OccupancyGrid, grid_extent, grid_from_segments
+
+# Directory where the precomputed tables are saved
+CACHE_DIR = os.path.join(os.environ.get('ROS_HOME',
+    os.path.join(os.path.expanduser('~'), '.ros')), 'msl_sim', 'ranges')
+# Incremented whenever the tables change, invalidating old ones
+CACHE_VERSION = 2
+LUT_CHUNK = 1 << 16 # cells cast from at once while building a lookup table
+EXACT_CELLS = 4 # cells traversed exactly at a time by beams near obstacles
+
+
+def map_hash(line_map):
+    """Returns a hash of the segments and occupancy grid of a map."""
+    sha = hashlib.sha1(np.ascontiguousarray(line_map.segments,
+        dtype=float).tobytes())
+    grid = getattr(line_map, 'grid', None)
+    if grid is not None:
+        sha.update(np.packbits(grid.occupied).tobytes())
+        sha.update(repr((grid.shape, grid.resolution, grid.origin)).encode())
+    return sha.hexdigest()
+
+
+def distance_transform(occupied, max_distance):
+    """Returns the Euclidean distance [cells] from the centre of each cell to
+    the centre of the nearest occupied cell, up to max_distance [cells].
+
+    The distance along each column is found with two cumulative passes, then
+    combined along the rows one column offset at a time, which stops as soon
+    as no distance can get shorter."""
+    rows, cols = occupied.shape
+    far = rows + cols + max_distance
+    index = np.arange(rows)[:, None]
+    before = np.maximum.accumulate(np.where(occupied, index, -far), axis=0)
+    after = np.minimum.accumulate(np.where(occupied, index, 2*far)[::-1],
+            axis=0)[::-1]
+    square = np.minimum(index - before, after - index).astype(float)**2
+    result = square.copy()
+    for offset in range(1, min(cols, int(ceil(max_distance)) + 1)):
+        if offset*offset >= result.max():
+            break
+        shift = offset*offset
+        np.minimum(result[:, offset:], square[:, :-offset] + shift,
+                out=result[:, offset:])
+        np.minimum(result[:, :-offset], square[:, offset:] + shift,
+                out=result[:, :-offset])
+    return np.minimum(np.sqrt(result), max_distance).astype(np.float32)
+
+
+class RangeCache(object):
+    """Precomputed ranges of a map, at resolution [m], for beams up to
+    max_range [m] long. With theta_bins > 0, a lookup table of the range in
+    that many directions from each cell is built as well, if it fits in the
+    memory cap [MB] (see uses_table). map_version is the version of the map
+    when the cache was built; the cache is stale once they differ."""
+    def __init__(self, line_map, resolution=d.RANGE_CACHE_RES,
+            max_range=d.LASER_RANGE, theta_bins=0,
+            memory_cap=d.RANGE_CACHE_MEMORY, cache_dir=CACHE_DIR):
+        self.resolution = float(resolution)
+        self.max_range = float(max_range)
+        self.theta_bins = theta_bins
+        self.cache_dir = cache_dir
+        self.map_version = line_map.version
+        segments = line_map.segments
+        grid = getattr(line_map, 'grid', None)
+        if grid is not None:
+            segments = np.vstack((segments, grid.to_segments()))
+        self.origin, shape = grid_extent(segments, self.resolution)
+        cells = shape[0] * shape[1]
+        budget = memory_cap * 2**20
+        if cells * 4 > budget:
+            raise ValueError('A %g m distance field of this map needs %d MB, '
+                    'more than the %d MB cap' % (resolution, cells*4 >> 20,
+                        memory_cap))
+        key = '%s-%g' % (map_hash(line_map), self.resolution)
+        max_distance = self.max_range / self.resolution + 1
+        self.field = self.__load(key + '-field-%g' % self.max_range, lambda:
+                distance_transform(grid_from_segments(segments,
+                    self.resolution).occupied, max_distance))
+        # The occupied cells, traversed exactly by beams near them
+        self.grid = OccupancyGrid(np.asarray(self.field) == 0,
+                self.resolution, self.origin)
+        self.table = None
+        if theta_bins and cells * 4 * (theta_bins + 1) <= budget:
+            self.table = self.__load(key + '-table-%g-%d' % (self.max_range,
+                theta_bins), self.__build_table)
+
+    @property
+    def uses_table(self):
+        return self.table is not None
+
+    def __load(self, name, build):
+        """Returns a table memory-mapped from the cache directory, building
+        and saving it first if it is not there. Failing to save is harmless,
+        so errors are ignored."""
+        filename = os.path.join(self.cache_dir, '%s-%d.npy' % (name,
+            CACHE_VERSION))
+        try:
+            return np.load(filename, mmap_mode='r')
+        except (IOError, OSError, ValueError):
+            pass
+        table = build()
+        temp_file = '%s.%d.tmp' % (filename, os.getpid())
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            with open(temp_file, 'wb') as f:
+                np.save(f, table)
+            os.rename(temp_file, filename)
+        except (IOError, OSError):
+            pass
+        return table
+
+    def __build_table(self):
+        """Returns the (theta_bins, rows, columns) ranges [m] (inf where
+        nothing is hit) of beams cast from the centre of each cell."""
+        rows, cols = self.field.shape
+        row, col = np.mgrid[0:rows, 0:cols].reshape(2, -1)
+        centres = self.origin + (np.column_stack((col, row)) + 0.5) * \
+                self.resolution
+        table = np.empty((self.theta_bins, rows*cols), dtype=np.float32)
+        for k in range(self.theta_bins):
+            angle = 2*pi * k / self.theta_bins
+            for start in range(0, rows*cols, LUT_CHUNK):
+                part = slice(start, start + LUT_CHUNK)
+                table[k, part] = self.march(centres[part],
+                        np.full(len(centres[part]), angle), self.max_range)
+        return table.reshape(self.theta_bins, rows, cols)
+
+    def __cells(self, points):
+        """Returns the (row, column) of the cell holding each point, and
+        whether it is inside the tables."""
+        col, row = np.floor((points - self.origin) /
+                self.resolution).astype(np.int64).T
+        rows, cols = self.field.shape
+        inside = (row >= 0) & (row < rows) & (col >= 0) & (col < cols)
+        return np.where(inside, row, 0), np.where(inside, col, 0), inside
+
+    def march(self, origins, angles, max_range):
+        """Returns the ranges (inf where nothing is hit) of beams cast from
+        (N, 2) origins at angles [rad] by sphere tracing the distance field.
+        Within a cell of an obstacle, where a step could cut the corner of an
+        occupied cell, beams are traversed cell by cell instead (see
+        OccupancyGrid.cast), so they stop at the first occupied cell they
+        enter."""
+        res = self.resolution
+        window = EXACT_CELLS * res
+        direction = np.column_stack((np.cos(angles), np.sin(angles)))
+        low = np.asarray(self.origin)
+        high = low + np.array(self.field.shape[::-1]) * res
+        t = np.zeros(len(origins))
+        ranges = np.full(len(origins), np.inf)
+        active = np.arange(len(origins))
+        while len(active):
+            points = origins[active] + t[active, None] * direction[active]
+            row, col, inside = self.__cells(points)
+            distance = self.field[row, col] * res
+            hit = inside & (distance == 0) & (t[active] > 0)
+            ranges[active[hit]] = t[active[hit]]
+            # Outside the tables, the distance to them is safe to step
+            outside = np.hypot(*np.maximum(np.maximum(low - points,
+                points - high), 0).T)
+            distance = np.where(inside, distance - np.sqrt(2)*res, outside)
+            near = ~hit & (distance < res)
+            if np.any(near):
+                exact = self.grid.cast(points[near], angles[active[near]],
+                        window)
+                found = np.isfinite(exact)
+                ranges[active[near][found]] = t[active[near][found]] + \
+                        exact[found]
+                hit[np.flatnonzero(near)[found]] = True
+                distance[near] = window
+            t[active] += distance
+            active = active[~hit & (t[active] < max_range)]
+        ranges[ranges >= max_range] = np.inf
+        return ranges
+
+    def cast(self, origins, angles, max_range):
+        """Returns the ranges (inf where nothing is hit) of beams cast from
+        (N, 2) origins at angles [rad]. With a lookup table, the ranges are
+        interpolated between the two nearest directions from the cell holding
+        each origin; otherwise (or beyond the tables) they are marched."""
+        origins = np.asarray(origins, dtype=float).reshape(-1, 2)
+        angles = np.asarray(angles, dtype=float).reshape(-1)
+        if self.table is None or max_range > self.max_range:
+            return self.march(origins, angles, max_range)
+        row, col, inside = self.__cells(origins)
+        bins = self.theta_bins
+        position = np.mod(angles, 2*pi) * bins / (2*pi)
+        lower = np.floor(position).astype(np.int64)
+        weight = (position - lower).astype(np.float32)
+        first = self.table[lower % bins, row, col]
+        second = self.table[(lower + 1) % bins, row, col]
+        # Blend only where both directions hit; otherwise take the nearest
+        with np.errstate(invalid='ignore'):
+            ranges = np.where(np.isfinite(first) & np.isfinite(second),
+                    first + (second - first) * weight,
+                    np.where(weight < 0.5, first, second)).astype(float)
+        if not inside.all():
+            ranges[~inside] = self.march(origins[~inside], angles[~inside],
+                    max_range)
+        ranges[ranges >= max_range] = np.inf
+        return ranges
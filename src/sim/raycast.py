@@ -0,0 +1,163 @@
+# Python imports
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import numpy as np
+
+# Maximum number of ray/segment pairs evaluated at once (bounds memory use)
+CHUNK_SIZE = 1 << 18
+POSE_CHUNK = 64 # poses handed to a worker thread at a time
+
+_pools = {} # worker thread pools, by number of workers
+
+
+def map_chunks(function, count, chunk, workers=None):
+    """Calls function with slices splitting range(count) into chunks, on
+    worker threads (one per core by default), and returns the results in
+    order. NumPy releases the GIL in its array operations, so the chunks run
+    in parallel."""
+    slices = [slice(start, start + chunk) for start in range(0, count, chunk)]
+    workers = workers or multiprocessing.cpu_count()
+    if workers == 1 or len(slices) <= 1:
+        return [function(part) for part in slices]
+    if workers not in _pools:
+        _pools[workers] = ThreadPool(workers)
+    return _pools[workers].map(function, slices)
+
+
+def segment_distances(segments, point):
+    """Returns the minimum distance between a point and each segment of an
+    (M, 4) array of segments."""
+    x, y = point
+    p_x, p_y = segments[:, 0], segments[:, 1]
+    e_x = segments[:, 2] - p_x
+    e_y = segments[:, 3] - p_y
+    length_sq = e_x**2 + e_y**2
+    # Parameter of the closest point along each segment, clipped to [0, 1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = ((x - p_x) * e_x + (y - p_y) * e_y) / length_sq
+    t = np.clip(np.where(length_sq > 0, t, 0.0), 0.0, 1.0)
+    return np.hypot(p_x + t * e_x - x, p_y + t * e_y - y)
+
+
+def _intersect(o_x, o_y, d_x, d_y, p_x, p_y, e_x, e_y, max_range):
+    """Returns the distance along each ray (origin o, unit direction d) to each
+    segment (start p, direction e) it hits within max_range, and inf
+    otherwise. The inputs must broadcast to the same shape."""
+    eps = 1e-9 # floating point tie breaker (rays through endpoints)
+    w_x = p_x - o_x
+    w_y = p_y - o_y
+    with np.errstate(divide='ignore', invalid='ignore'):
+        denom = d_x * e_y - d_y * e_x
+        t = (w_x * e_y - w_y * e_x) / denom
+        u = (w_x * d_y - w_y * d_x) / denom
+        hit = (t >= 0) & (t < max_range) & (u >= -eps) & (u <= 1 + eps)
+    return np.where(hit, t, np.inf)
+
+
+def cast_rays(origins, angles, segments, max_range):
+    """Casts rays from origins (an (N, 2) array, or a single point) in the
+    directions given by angles [rad] against an (M, 4) array of segments.
+    Returns a tuple (ranges, hits) of the distance to the nearest segment
+    along each ray (inf if there is none within max_range) and the index of
+    that segment (-1 if there is none)."""
+    angles = np.asarray(angles, dtype=float).ravel()
+    origins = np.broadcast_to(np.asarray(origins, dtype=float),
+            (len(angles), 2))
+    ranges = np.full(len(angles), np.inf)
+    hits = np.full(len(angles), -1, dtype=int)
+    if len(segments) == 0 or len(angles) == 0:
+        return ranges, hits
+    p_x, p_y = segments[:, 0], segments[:, 1]
+    e_x = segments[:, 2] - p_x
+    e_y = segments[:, 3] - p_y
+    step = max(1, CHUNK_SIZE // len(segments))
+    for start in range(0, len(angles), step):
+        stop = start + step
+        o = origins[start:stop]
+        a = angles[start:stop, None]
+        t = _intersect(o[:, 0:1], o[:, 1:2], np.cos(a), np.sin(a),
+                p_x, p_y, e_x, e_y, max_range)
+        nearest = np.argmin(t, axis=1)
+        r = t[np.arange(len(t)), nearest]
+        ranges[start:stop] = r
+        hits[start:stop] = np.where(np.isfinite(r), nearest, -1)
+    return ranges, hits
+
+
+def cast_rays_bounded(origin, angles, segments, distances, bounds,
+        max_range):
+    """Casts rays from a single origin at angles [rad] against an (M, 4)
+    array of segments sorted by their distances from origin, given an upper
+    bound on the range of each ray (the range to a segment it is known to
+    hit, say): each ray is only tested against the segments nearer than its
+    bound. Returns a tuple (ranges, hits) as cast_rays, where the range is
+    the bound, and the hit -1, if no nearer segment is hit."""
+    angles = np.asarray(angles, dtype=float).ravel()
+    ranges = np.array(bounds, dtype=float).ravel()
+    hits = np.full(len(angles), -1, dtype=int)
+    counts = np.searchsorted(distances, ranges)
+    ends = np.cumsum(counts)
+    # Rays split into chunks of about CHUNK_SIZE ray/segment pairs
+    splits = np.searchsorted(ends, np.arange(CHUNK_SIZE, ends[-1] if
+        len(ends) else 0, CHUNK_SIZE))
+    for rays in np.split(np.arange(len(angles)), np.unique(splits)):
+        number = counts[rays]
+        ray = np.repeat(rays, number)
+        segment = np.arange(number.sum()) - np.repeat(np.cumsum(number) -
+                number, number)
+        if not len(ray):
+            continue
+        p = segments[segment]
+        t = _intersect(origin[0], origin[1], np.cos(angles[ray]),
+                np.sin(angles[ray]), p[:, 0], p[:, 1], p[:, 2] - p[:, 0],
+                p[:, 3] - p[:, 1], max_range)
+        nearest = ranges.copy()
+        np.minimum.at(nearest, ray, t)
+        found = (t == nearest[ray]) & (t < ranges[ray])
+        hits[ray[found]] = segment[found]
+        ranges = nearest
+    return ranges, hits
+
+
+def cast_scans(poses, beam_angles, segments, max_range):
+    """Casts a full scan from each of the (K, 3) poses (x, y, heading) with the
+    beam angles [rad] given relative to the heading. Only the segments within
+    max_range of a pose are tested for that pose; these are gathered into a
+    padded (K, M_near) block so all the scans are computed together. Returns a
+    tuple (ranges, hits) of (K, B) arrays, as in cast_rays."""
+    poses = np.asarray(poses, dtype=float).reshape(-1, 3)
+    beam_angles = np.asarray(beam_angles, dtype=float).ravel()
+    num_poses, num_beams = len(poses), len(beam_angles)
+    ranges = np.full((num_poses, num_beams), np.inf)
+    hits = np.full((num_poses, num_beams), -1, dtype=int)
+    if len(segments) == 0 or num_poses == 0 or num_beams == 0:
+        return ranges, hits
+    # Segments near each pose
+    near = np.empty((num_poses, len(segments)), dtype=bool)
+    for k, pose in enumerate(poses):
+        near[k] = segment_distances(segments, pose[:2]) <= max_range
+    counts = near.sum(axis=1)
+    width = counts.max()
+    if width == 0:
+        return ranges, hits
+    # Indices of the near segments first, padded with (ignored) far ones
+    order = np.argsort(~near, axis=1, kind='mergesort')[:, :width]
+    padded = segments[order]
+    padded[np.arange(width)[None, :] >= counts[:, None]] = np.nan
+    p_x, p_y = padded[:, None, :, 0], padded[:, None, :, 1]
+    e_x = padded[:, None, :, 2] - p_x
+    e_y = padded[:, None, :, 3] - p_y
+    step = max(1, CHUNK_SIZE // (num_beams * width))
+    for start in range(0, num_poses, step):
+        stop = start + step
+        pose = poses[start:stop, None, None, :]
+        a = pose[..., 2] + beam_angles[None, :, None]
+        t = _intersect(pose[..., 0], pose[..., 1], np.cos(a), np.sin(a),
+                p_x[start:stop], p_y[start:stop], e_x[start:stop],
+                e_y[start:stop], max_range)
+        nearest = np.argmin(t, axis=2)
+        r = np.take_along_axis(t, nearest[..., None], axis=2)[..., 0]
+        ranges[start:stop] = r
+        hits[start:stop] = np.where(np.isfinite(r),
+                np.take_along_axis(order[start:stop], nearest, axis=1), -1)
+    return ranges, hits
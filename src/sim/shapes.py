@@ -0,0 +1,179 @@
+"""Polylines and closed polygons stored as shared vertices rather than
+independent segments. All the shapes of a map live in one vertex buffer, one
+after the other (a closed polygon followed by its first vertex again), so
+that each pair of consecutive rows is an edge: the segments are a strided
+view of the buffer, and no endpoint is stored twice."""
+# Python imports
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+# MSL Sim imports
+from sim.spatial import SpatialIndex
+
+
+class Shapes(object):
+    """The polylines and polygons of a map. Shape i has the vertices
+    first[i] to first[i + 1] - 1 of the buffer, so its edges are the rows
+    first[i] to first[i + 1] - 2 of edges (the rows joining one shape to the
+    next are not edges of either). bounds[i] is its bounding box (x_min,
+    y_min, x_max, y_max), in single precision rounded outwards."""
+    def __init__(self):
+        self.vertices = np.zeros((0, 2)) # the buffer
+        self.first = np.zeros(1, dtype=np.int64)
+        self.closed = np.zeros(0, dtype=bool)
+        self.bounds = np.zeros((0, 4), dtype=np.float32)
+        self.version = 0
+        self._index = None # SpatialIndex of the bounding boxes
+
+    def __len__(self):
+        return len(self.closed)
+
+    @property
+    def count(self):
+        """Returns the number of edges of each shape."""
+        return np.maximum(np.diff(self.first) - 1, 0)
+
+    @property
+    def num_edges(self):
+        return int(self.count.sum())
+
+    @property
+    def nbytes(self):
+        """Returns the memory used by the shapes [bytes]."""
+        return sum(a.nbytes for a in (self.vertices, self.first, self.closed,
+            self.bounds))
+
+    @property
+    def edges(self):
+        """Returns the (len(vertices) - 1, 4) view of the vertex buffer whose
+        row k is the segment from vertex k to vertex k + 1."""
+        rows = max(len(self.vertices) - 1, 0)
+        return as_strided(self.vertices, shape=(rows, 4),
+                strides=(self.vertices.strides[0], self.vertices.strides[1]),
+                writeable=False)
+
+    def add(self, vertices, closed=False):
+        """Adds a polyline through (N, 2) vertices, or a polygon if closed,
+        and returns its index."""
+        return int(self.extend([vertices], closed)[0])
+
+    def extend(self, shapes, closed=False):
+        """Adds many shapes, each an (N, 2) array of vertices, closed or not
+        (a sequence of flags, or one for all), and returns their indices. An
+        (S, N, 2) array adds S shapes of N vertices at once."""
+        shapes = [np.asarray(v, dtype=float).reshape(-1, 2) for v in shapes]
+        closed = np.broadcast_to(np.asarray(closed, dtype=bool),
+                (len(shapes),)) & np.array([len(v) > 2 for v in shapes],
+                dtype=bool)
+        rings = [np.vstack((v, v[:1])) if c else v
+                for v, c in zip(shapes, closed)]
+        sizes = np.array([len(r) for r in rings], dtype=np.int64)
+        indices = np.arange(len(self), len(self) + len(shapes))
+        self.vertices = np.vstack([self.vertices] + rings)
+        self.first = np.append(self.first, self.first[-1] + np.cumsum(sizes))
+        self.closed = np.append(self.closed, closed)
+        low = np.array([r.min(axis=0) if len(r) else (np.inf, np.inf)
+            for r in rings]).reshape(-1, 2)
+        high = np.array([r.max(axis=0) if len(r) else (-np.inf, -np.inf)
+            for r in rings]).reshape(-1, 2)
+        bounds = np.hstack((np.nextafter(low.astype(np.float32), -np.inf),
+            np.nextafter(high.astype(np.float32), np.inf)))
+        self.bounds = np.vstack((self.bounds, bounds))
+        self._index = None
+        self.version += 1
+        return indices
+
+    def shape(self, i):
+        """Returns the (N, 2) vertices of shape i (a polygon's first vertex
+        is not repeated)."""
+        return self.vertices[self.first[i]:self.first[i + 1] -
+                int(self.closed[i])]
+
+    def shape_edges(self, i):
+        """Returns the (N, 4) segments of shape i, a view of the buffer."""
+        return self.edges[self.first[i]:max(self.first[i + 1] - 1,
+            self.first[i])]
+
+    def rows(self, shapes=None):
+        """Returns the rows of edges that are the edges of the given shapes
+        (all of them by default)."""
+        if shapes is None:
+            shapes = np.arange(len(self))
+        count = self.count[shapes]
+        return np.repeat(self.first[shapes], count) + np.arange(count.sum()) \
+                - np.repeat(np.cumsum(count) - count, count)
+
+    def segments(self):
+        """Returns an (E, 4) array (a copy) of the edges of all shapes."""
+        return self.edges[self.rows()]
+
+    @property
+    def index(self):
+        if self._index is None:
+            extents = self.bounds[:, 2:4] - self.bounds[:, 0:2]
+            self._index = SpatialIndex(max(2*float(np.median(extents)), 1e-3)
+                    if len(self) else 1.0)
+            self._index.build(self.bounds.astype(float))
+        return self._index
+
+    def shapes_in(self, x_min, y_min, x_max, y_max):
+        """Returns the indices of the shapes whose bounding boxes overlap the
+        rectangle."""
+        found = self.index.query(x_min, y_min, x_max, y_max)
+        b = self.bounds[found]
+        return found[(b[:, 0] <= x_max) & (b[:, 2] >= x_min) &
+                (b[:, 1] <= y_max) & (b[:, 3] >= y_min)]
+
+    def segments_in(self, x_min, y_min, x_max, y_max):
+        """Returns the edges of the shapes whose bounding boxes overlap the
+        rectangle."""
+        return self.edges[self.rows(self.shapes_in(x_min, y_min, x_max,
+            y_max))]
+
+    def __candidates(self, points):
+        """Returns (point, shape) index arrays of the closed polygons whose
+        bounding box holds each of the points."""
+        cells = np.floor(points / self.index.cell_size).astype(np.int64)
+        keys, inverse = np.unique(cells, axis=0, return_inverse=True)
+        inverse = inverse.ravel()
+        order = np.argsort(inverse, kind='mergesort')
+        starts = np.searchsorted(inverse[order], np.arange(len(keys) + 1))
+        point_parts, shape_parts = [], []
+        for k, key in enumerate(keys.tolist()):
+            shapes = self.index.static.get(tuple(key))
+            if shapes is None:
+                continue
+            shapes = shapes[self.closed[shapes]]
+            members = order[starts[k]:starts[k + 1]]
+            point_parts.append(np.repeat(members, len(shapes)))
+            shape_parts.append(np.tile(shapes, len(members)))
+        if not point_parts:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        point, shape = np.concatenate(point_parts), np.concatenate(shape_parts)
+        b, p = self.bounds[shape], points[point]
+        keep = (p[:, 0] >= b[:, 0]) & (p[:, 0] <= b[:, 2]) & \
+                (p[:, 1] >= b[:, 1]) & (p[:, 1] <= b[:, 3])
+        return point[keep], shape[keep]
+
+    def contains(self, points):
+        """Returns, for each of the (P, 2) points, the index of a polygon it
+        is inside (-1 if none), by counting the crossings of a ray from the
+        point with the edges of the polygons whose bounding box holds it."""
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        inside = np.full(len(points), -1, dtype=np.int64)
+        if not np.any(self.closed) or not len(points):
+            return inside
+        point, polygon = self.__candidates(points)
+        # One entry per (point, edge of the candidate polygon)
+        pair = np.repeat(np.arange(len(point)), self.count[polygon])
+        e = self.edges[self.rows(polygon)]
+        x, y = points[point[pair], 0], points[point[pair], 1]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            straddles = (e[:, 1] > y) != (e[:, 3] > y)
+            cross_x = e[:, 0] + (y - e[:, 1]) * (e[:, 2] - e[:, 0]) / \
+                    (e[:, 3] - e[:, 1])
+        crossings = np.bincount(pair, weights=straddles & (x < cross_x),
+                minlength=len(point))
+        hit = crossings % 2 == 1
+        inside[point[hit]] = polygon[hit]
+        return inside
@@ -0,0 +1,251 @@
+"""Measurements written to rings of slots in shared memory, which consumers on
+the same host read as NumPy arrays without copying them and without the
+writer doing more work for more readers. Each topic has its own ring, a
+shared memory block named <prefix>_<topic> holding a header and a fixed
+number of slots:
+
+    header: magic, slots, capacity, head (sequence number of the latest sample)
+    slot:   seq, stamp [s], count, info[4], data[capacity]
+
+Sample n (counting from 0) goes to slot n % slots. Its seq is set to -1
+while it is written and to n once it is complete, so a reader can tell
+whether a slot still holds the sample it read (see RingReader.valid). Needs
+Python 3.8 or later (multiprocessing.shared_memory)."""
+# Python imports
+import time
+import numpy as np
+try:
+    from multiprocessing import shared_memory
+except ImportError: # Python < 3.8
+    shared_memory = None
+
+# MSL Sim imports
+import sim.defaults as d
+
+MAGIC = 0x524c534d # 'MSLR'
+HEADER = np.dtype([('magic', np.int64), ('slots', np.int64),
+    ('capacity', np.int64), ('head', np.int64)])
+HEADER_BYTES = 64 # the slots start on a cache line
+INFO_SIZE = 4
+
+_written = set() # names of the rings created by this process
+
+# Values per sample of each topic (the scan's ranges are cut to capacity)
+TOPIC_SIZES = {'collision': 7, 'compass': 1, 'encoders': 2, 'gps': 2,
+        'ground_truth': 3, 'gyro': 1, 'scan': None}
+
+
+def slot_dtype(capacity):
+    return np.dtype([('seq', np.int64), ('stamp', np.float64),
+        ('count', np.int64), ('info', np.float64, (INFO_SIZE,)),
+        ('data', np.float64, (capacity,))])
+
+
+def ring_name(topic, prefix=d.SHM_PREFIX):
+    return '%s_%s' % (prefix, topic)
+
+
+class Ring(object):
+    """The header and slots of a ring, as arrays over a shared memory
+    block."""
+    def __init__(self, block, slots, capacity):
+        self.block = block
+        self.header = np.ndarray((), HEADER, buffer=block.buf)
+        self.slots = np.ndarray((slots,), slot_dtype(capacity),
+                buffer=block.buf, offset=HEADER_BYTES)
+        self.capacity = capacity
+
+    def close(self):
+        """Unmaps the ring. Views returned by it must have been released."""
+        self.header = self.slots = None
+        self.block.close()
+
+
+class RingWriter(Ring):
+    """Creates a ring of slots samples of up to capacity values each (any
+    older ring of the same name is replaced) and writes samples to it."""
+    def __init__(self, name, slots=d.SHM_SLOTS, capacity=1):
+        size = HEADER_BYTES + slots*slot_dtype(capacity).itemsize
+        try:
+            block = shared_memory.SharedMemory(name, create=True, size=size)
+        except FileExistsError:
+            # Left behind by a simulator that did not exit cleanly
+            old = shared_memory.SharedMemory(name)
+            old.close()
+            old.unlink()
+            block = shared_memory.SharedMemory(name, create=True, size=size)
+        _written.add(name)
+        Ring.__init__(self, block, slots, capacity)
+        self.slots['seq'] = -1
+        self.header['slots'] = slots
+        self.header['capacity'] = capacity
+        self.header['head'] = -1
+        self.header['magic'] = MAGIC
+        self.seq = -1
+
+    def write(self, stamp, values, info=()):
+        """Writes a sample of values (at most capacity of them) and info (at
+        most INFO_SIZE numbers) stamped at stamp [s], and returns its
+        sequence number."""
+        values = np.asarray(values, dtype=float).ravel()[:self.capacity]
+        seq = self.seq + 1
+        k = seq % len(self.slots)
+        self.slots['seq'][k] = -1
+        self.slots['stamp'][k] = stamp
+        self.slots['count'][k] = len(values)
+        self.slots['info'][k, :len(info)] = info
+        self.slots['data'][k, :len(values)] = values
+        self.slots['seq'][k] = seq
+        self.header['head'] = seq
+        self.seq = seq
+        return seq
+
+    def close(self):
+        """Unmaps and removes the ring."""
+        Ring.close(self)
+        self.block.unlink()
+        _written.discard(self.block.name)
+
+
+class RingReader(Ring):
+    """Maps the ring of a topic written by a running simulator, e.g.
+
+        reader = RingReader('scan')
+        seq, sample = reader.latest()
+        stamp, info, ranges = sample
+
+    The info and data of a sample are views of the shared memory, valid until
+    its slot is reused slots samples later, which valid(seq) tells."""
+    def __init__(self, topic, prefix=d.SHM_PREFIX):
+        if shared_memory is None:
+            raise RuntimeError('Reading shared memory needs Python 3.8+')
+        block = _open_untracked(ring_name(topic, prefix))
+        header = np.ndarray((), HEADER, buffer=block.buf)
+        if int(header['magic']) != MAGIC:
+            del header
+            block.close()
+            raise ValueError('%s is not a sensor ring' % block.name)
+        slots, capacity = int(header['slots']), int(header['capacity'])
+        del header
+        Ring.__init__(self, block, slots, capacity)
+
+    @property
+    def head(self):
+        """Returns the sequence number of the latest sample (-1 if none)."""
+        return int(self.header['head'])
+
+    def valid(self, seq):
+        """Returns whether sample seq is (still) in its slot."""
+        return seq >= 0 and int(self.slots['seq'][seq % len(self.slots)]) == seq
+
+    def read(self, seq):
+        """Returns (stamp, info, data) of sample seq, with info and data
+        views of its slot, or None if it is not (or no longer) in it."""
+        if not self.valid(seq):
+            return None
+        k = seq % len(self.slots)
+        stamp = float(self.slots['stamp'][k])
+        count = int(self.slots['count'][k])
+        sample = (stamp, self.slots['info'][k], self.slots['data'][k, :count])
+        return sample if self.valid(seq) else None
+
+    def latest(self):
+        """Returns the sequence number and sample (see read) of the latest
+        sample."""
+        seq = self.head
+        return seq, self.read(seq)
+
+    def wait(self, seq, timeout=None, poll=d.SHM_POLL):
+        """Waits (polling every poll seconds) for sample seq to be written,
+        and returns it (see read), or None after timeout seconds."""
+        end = None if timeout is None else time.time() + timeout
+        while self.head < seq:
+            if end is not None and time.time() >= end:
+                return None
+            time.sleep(poll)
+        return self.read(seq)
+
+
+def _open_untracked(name):
+    """Opens an existing shared memory block without the resource tracker
+    removing it when this process exits (as it would before Python 3.13)."""
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        block = shared_memory.SharedMemory(name)
+        if name not in _written: # else it is the writer's to remove
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(block._name, 'shared_memory')
+        return block
+
+
+class SharedMemoryPublisher(object):
+    """Writes the measurements to a ring per topic in shared memory (see
+    RingWriter), stamped with the time of clock (or the wall time if None).
+    A scan's info holds its angle_min, angle_max, angle_increment and
+    range_max, and its ranges are cut to scan_capacity values."""
+    def __init__(self, prefix=d.SHM_PREFIX, slots=d.SHM_SLOTS,
+            scan_capacity=d.SHM_SCAN_CAPACITY):
+        if shared_memory is None:
+            raise RuntimeError('Shared memory output needs Python 3.8+')
+        self.prefix = prefix
+        self.slots = slots
+        self.scan_capacity = scan_capacity
+        self.clock = None
+        self.started = False
+        self.rings = {}
+
+    def start(self):
+        """Creates the rings."""
+        if self.started:
+            return
+        for topic, size in TOPIC_SIZES.items():
+            self.rings[topic] = RingWriter(ring_name(topic, self.prefix),
+                    self.slots, size or self.scan_capacity)
+        self.started = True
+
+    def stop(self):
+        """Removes the rings."""
+        for ring in self.rings.values():
+            ring.close()
+        self.rings = {}
+        self.started = False
+
+    def set_param(self, name, value):
+        pass
+
+    def __write(self, topic, values, info=()):
+        if self.started:
+            stamp = self.clock.time if self.clock is not None else time.time()
+            self.rings[topic].write(stamp, values, info)
+
+    def publish_clock(self, sim_time):
+        pass # every sample is stamped
+
+    def publish_collision(self, pose, segment):
+        self.__write('collision', tuple(pose) + tuple(segment))
+
+    def publish_compass(self, bearing):
+        self.__write('compass', (bearing,))
+
+    def publish_degradation(self, sensor, policy, level, duration, allowed):
+        pass
+
+    def publish_encoders(self, right_ticks, left_ticks):
+        self.__write('encoders', (right_ticks, left_ticks))
+
+    def publish_gps(self, x, y):
+        self.__write('gps', (x, y))
+
+    def publish_ground_truth(self, x, y, theta):
+        self.__write('ground_truth', (x, y, theta))
+
+    def publish_gyro(self, angular_velocity):
+        self.__write('gyro', (angular_velocity,))
+
+    def publish_real_time_factor(self, factor):
+        pass
+
+    def publish_scan(self, laser, ranges):
+        self.__write('scan', ranges, (laser.min_angle, laser.max_angle,
+            laser.resolution, laser.range))
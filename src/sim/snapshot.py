@@ -0,0 +1,248 @@
+"""Snapshots of the state of a Simulation as compact binary blobs, which can
+be restored into it (or into another simulation of the same map) and forked
+into many child simulations running in parallel processes. A snapshot holds
+what changes as the simulation runs: the robot's pose and velocities, the
+odometer's partial ticks, the states of the random number generators (the
+global ones and those of the noise models), the sim time, the overload
+policies, the moving obstacles and the version and size of the static map,
+which must match when the snapshot is restored. The static map itself is not
+included. The state is written explicitly as numbers and arrays, not
+pickled, so a snapshot cannot run code when it is restored."""
+# Python imports
+import io
+import json
+import multiprocessing
+import numbers
+import random
+import zipfile
+import numpy as np
+
+# MSL Sim imports
+from sim.noise import CompassNoise, GpsNoise, GyroNoise, LaserNoise
+from sim.obstacles import DynamicObstacles
+from sim.overload import OverloadPolicy
+
+MAGIC = b'MSLS'
+FORMAT = 2
+# Classes whose instances a snapshot may hold, by name
+NOISE_MODELS = dict((cls.__name__, cls) for cls in (LaserNoise, GyroNoise,
+    GpsNoise, CompassNoise))
+POLICIES = {'OverloadPolicy': OverloadPolicy}
+
+_forked = None # (sim, blob, functions) inherited by forked processes
+
+
+def static_version(line_map):
+    """Returns the version of a map without its moving obstacles and tiles,
+    which only changes when the map is edited, and its size."""
+    version = line_map.version - line_map.obstacles_version
+    if line_map.tiles is not None:
+        version -= line_map.tiles.version
+    return version, len(line_map)
+
+
+def _encode(value, arrays):
+    """Returns value as plain (JSON) data, with its arrays moved to the list
+    arrays and referred to by index. Raises ValueError for anything else."""
+    if isinstance(value, np.random.RandomState):
+        return {'rng': _encode(value.get_state(), arrays)}
+    if isinstance(value, np.ndarray):
+        arrays.append(value)
+        return {'array': len(arrays) - 1}
+    if isinstance(value, (list, tuple)):
+        return [_encode(item, arrays) for item in value]
+    if isinstance(value, dict):
+        return {'dict': dict((str(key), _encode(item, arrays))
+            for key, item in value.items())}
+    if isinstance(value, np.generic):
+        value = value.item()
+    if value is None or isinstance(value, (numbers.Real, str)):
+        return value
+    raise ValueError('Cannot snapshot a %s' % type(value).__name__)
+
+
+def _decode(value, arrays):
+    """Returns the value encoded by _encode (with tuples as lists)."""
+    if isinstance(value, dict):
+        if 'array' in value:
+            return arrays[value['array']]
+        if 'dict' in value:
+            return dict((str(key), _decode(item, arrays))
+                    for key, item in value['dict'].items())
+        rng = np.random.RandomState()
+        rng.set_state(tuple(_decode(value['rng'], arrays)))
+        return rng
+    if isinstance(value, list):
+        return [_decode(item, arrays) for item in value]
+    return value
+
+
+def _encode_object(obj, arrays):
+    if obj is None:
+        return None
+    return {'type': type(obj).__name__, 'state': dict((key, _encode(value,
+        arrays)) for key, value in vars(obj).items())}
+
+
+def _decode_object(value, arrays, classes):
+    """Returns an object of one of classes (by name) with the attributes
+    encoded by _encode_object, without calling its constructor."""
+    if value is None:
+        return None
+    cls = classes[value['type']]
+    obj = cls.__new__(cls)
+    for key, item in value['state'].items():
+        setattr(obj, str(key), _decode(item, arrays))
+    return obj
+
+
+def _obstacles_state(obstacles):
+    return {'time': obstacles.time, 'loops': list(obstacles.loops),
+            'waypoints': list(obstacles.waypoints),
+            'segments': [obstacles.local[obstacles.owner == i]
+                for i in range(len(obstacles))]}
+
+
+def _same_obstacles(obstacles, state):
+    current = _obstacles_state(obstacles)
+    return current['loops'] == state['loops'] and all(
+            np.array_equal(a, b) for key in ('waypoints', 'segments')
+            for a, b in zip(current[key], state[key])) and \
+            len(current['waypoints']) == len(state['waypoints'])
+
+
+def take_snapshot(sim):
+    """Returns a snapshot of the state of a Simulation, as bytes: a zip of
+    arrays (as written by numpy.savez) holding the state as JSON and its
+    arrays, so that restoring it runs no code from the blob."""
+    robot = sim.robot
+    sensors = (robot.compass, robot.gps, robot.gyroscope, robot.laser)
+    arrays = []
+    version, internal, gauss_next = random.getstate()
+    state = {'pose': robot.pose, 'vel': robot.vel, 'ang_vel': robot.ang_vel,
+            'partial_ticks': (robot.odometer.right_partial_tick,
+                robot.odometer.left_partial_tick),
+            'laser_velocity': robot.laser.velocity,
+            'laser_resolution': robot.laser.resolution,
+            'random': (version, np.array(internal, dtype=np.uint32),
+                gauss_next),
+            'numpy_random': np.random.get_state(),
+            'time': sim.clock.time,
+            'map_version': static_version(sim.line_map),
+            'obstacles': _obstacles_state(sim.line_map.obstacles)}
+    state = dict((key, _encode(value, arrays)) for key, value in
+            state.items())
+    state['noise_models'] = [_encode_object(sensor.noise_model, arrays)
+            for sensor in sensors]
+    state['overload'] = dict((name, _encode_object(policy, arrays))
+            for name, policy in sim.overload.items())
+    f = io.BytesIO()
+    np.savez_compressed(f, state=np.frombuffer(json.dumps(state,
+        sort_keys=True).encode('utf-8'), dtype=np.uint8),
+        **dict(('array_%d' % i, a) for i, a in enumerate(arrays)))
+    return MAGIC + bytearray([FORMAT]) + f.getvalue()
+
+
+def _load(blob):
+    """Returns the state in a snapshot, with its arrays and objects."""
+    with np.load(io.BytesIO(blob[len(MAGIC) + 1:]),
+            allow_pickle=False) as data:
+        state = json.loads(data['state'].tobytes().decode('utf-8'))
+        arrays = [data['array_%d' % i] for i in range(len(data.files) - 1)]
+    for key, value in state.items():
+        if key not in ('noise_models', 'overload'):
+            state[key] = _decode(value, arrays)
+    version, internal, gauss_next = state['random']
+    state['random'] = (version, tuple(int(i) for i in internal), gauss_next)
+    state['noise_models'] = [_decode_object(model, arrays, NOISE_MODELS)
+            for model in state['noise_models']]
+    state['overload'] = dict((str(name), _decode_object(policy, arrays,
+        POLICIES)) for name, policy in state['overload'].items())
+    return state
+
+
+def restore_snapshot(sim, blob):
+    """Restores the state of a Simulation from a snapshot. Raises ValueError
+    if it is not a snapshot, or was taken of a different static map."""
+    blob = bytes(blob)
+    if blob[:len(MAGIC)] != MAGIC or bytearray(blob[len(MAGIC):
+            len(MAGIC) + 1])[0] != FORMAT:
+        raise ValueError('Not a simulation snapshot (of this version)')
+    try:
+        state = _load(blob)
+    except (IOError, OSError, KeyError, TypeError, ValueError,
+            zipfile.BadZipfile):
+        raise ValueError('Not a simulation snapshot (of this version)')
+    version = static_version(sim.line_map)
+    if tuple(state['map_version']) != version:
+        raise ValueError('The snapshot was taken of a different map, or '
+                'before it was edited (version and size %s, not %s)' %
+                (tuple(state['map_version']), version))
+    robot = sim.robot
+    robot.x, robot.y, robot.heading = state['pose']
+    robot.vel, robot.ang_vel = state['vel'], state['ang_vel']
+    robot.path = [robot.pose]
+    robot.collision = None
+    robot.changed = True
+    robot.odometer.right_partial_tick, robot.odometer.left_partial_tick = \
+            state['partial_ticks']
+    robot.laser.velocity = tuple(state['laser_velocity'])
+    robot.laser.resolution = state['laser_resolution']
+    sensors = (robot.compass, robot.gps, robot.gyroscope, robot.laser)
+    for sensor, model in zip(sensors, state['noise_models']):
+        sensor.noise_model = model
+    random.setstate(state['random'])
+    np.random.set_state(tuple(state['numpy_random']))
+    sim.clock.set(state['time'])
+    sim.overload = state['overload']
+    # Obstacles are moved back in time, or rebuilt if they have changed
+    line_map, obstacles = sim.line_map, state['obstacles']
+    if not _same_obstacles(line_map.obstacles, obstacles):
+        rebuilt = DynamicObstacles(line_map.obstacles.index.cell_size)
+        for segments, waypoints, loop in zip(obstacles['segments'],
+                obstacles['waypoints'], obstacles['loops']):
+            rebuilt.add(segments, waypoints, loop)
+        line_map.set_obstacles(rebuilt)
+    line_map.obstacles.update(obstacles['time'])
+    line_map.move_to(robot.pose, robot.laser.range)
+
+
+def _run_forked(i):
+    sim, blob, functions = _forked
+    # Children publish nothing (the publisher's threads are not forked), and
+    # restart the prefetching of tiles paused for the fork
+    sim.publisher = None
+    if sim.line_map.tiles is not None:
+        sim.line_map.tiles.resume()
+    restore_snapshot(sim, blob)
+    return functions[i](sim)
+
+
+def fork(sim, blob, functions, processes=None):
+    """Calls each of functions with the Simulation sim restored from a
+    snapshot, in parallel child processes (processes of them, by default one
+    per core), and returns the list of what they return (which must be
+    picklable). The children are forked from this process, so the functions
+    need not be picklable and the static map is shared with them
+    copy-on-write rather than copied. Every child starts with the same
+    random number generator states. The prefetching of a tiled map is paused
+    while the children are forked, so none inherits its lock held."""
+    global _forked
+    context = multiprocessing.get_context('fork') if hasattr(multiprocessing,
+            'get_context') else multiprocessing
+    tiles = sim.line_map.tiles
+    if tiles is not None:
+        tiles.pause()
+    _forked = (sim, blob, functions)
+    try:
+        pool = context.Pool(processes or min(len(functions),
+            multiprocessing.cpu_count()))
+        try:
+            return pool.map(_run_forked, range(len(functions)), chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        _forked = None
+        if tiles is not None:
+            tiles.resume()
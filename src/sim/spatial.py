@@ -0,0 +1,124 @@
+# Python imports
+import numpy as np
+
+# MSL Sim imports
+import sim.defaults as d
+
+
+def cell_ranges(segments, cell_size):
+    """Returns the (M, 4) integer column and row ranges (first column, first
+    row, last column, last row) of the cells each segment's bounding box
+    overlaps."""
+    low = np.minimum(segments[:, 0:2], segments[:, 2:4])
+    high = np.maximum(segments[:, 0:2], segments[:, 2:4])
+    return np.floor(np.hstack((low, high)) / cell_size).astype(np.int64)
+
+
+class SpatialIndex(object):
+    """A uniform grid of square cells listing the segments whose bounding box
+    overlaps each cell, so the segments near a point can be found without
+    looking at the others. Segments are identified by integer ids.
+
+    Segments that never move are added in bulk with build (which replaces the
+    previous bulk segments); segments that are added later or move are
+    inserted, updated and removed one by one, touching only the cells they
+    leave or enter."""
+    def __init__(self, cell_size=d.INDEX_CELL_SIZE):
+        self.cell_size = float(cell_size)
+        self.static = {} # (column, row) -> array of ids
+        self.dynamic = {} # (column, row) -> set of ids
+        self.ranges = {} # dynamic id -> its cell range
+
+    def build(self, segments, ids=None):
+        """Indexes an (M, 4) array of segments, with ids 0 to M - 1 unless
+        given, replacing the previously built ones."""
+        segments = np.asarray(segments, dtype=float).reshape(-1, 4)
+        ids = np.arange(len(segments)) if ids is None else np.asarray(ids)
+        self.static = {}
+        if len(segments) == 0:
+            return
+        ranges = cell_ranges(segments, self.cell_size)
+        widths = ranges[:, 2] - ranges[:, 0] + 1
+        heights = ranges[:, 3] - ranges[:, 1] + 1
+        counts = widths * heights
+        # One entry per (segment, cell) pair
+        owner = np.repeat(np.arange(len(segments)), counts)
+        offset = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts,
+                counts)
+        cols = ranges[owner, 0] + offset % widths[owner]
+        rows = ranges[owner, 1] + offset // widths[owner]
+        order = np.lexsort((rows, cols))
+        cols, rows, owner = cols[order], rows[order], ids[owner[order]]
+        starts = np.flatnonzero((np.diff(cols) != 0) | (np.diff(rows) != 0)) + 1
+        bounds = np.concatenate(([0], starts, [len(cols)]))
+        for start, stop in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+            self.static[(int(cols[start]), int(rows[start]))] = \
+                    owner[start:stop]
+
+    def insert(self, ids, segments):
+        """Adds segments with the given ids to the dynamic part."""
+        segments = np.asarray(segments, dtype=float).reshape(-1, 4)
+        for i, cells in zip(np.asarray(ids).tolist(),
+                cell_ranges(segments, self.cell_size).tolist()):
+            self.ranges[i] = cells
+            for key in self.__keys(cells):
+                self.dynamic.setdefault(key, set()).add(i)
+
+    def remove(self, ids):
+        """Removes segments from the dynamic part."""
+        for i in np.asarray(ids).tolist():
+            for key in self.__keys(self.ranges.pop(i)):
+                cell = self.dynamic[key]
+                cell.discard(i)
+                if not cell:
+                    del self.dynamic[key]
+
+    def update(self, ids, segments):
+        """Moves dynamic segments to their new positions. Only the segments
+        whose cells changed are touched."""
+        segments = np.asarray(segments, dtype=float).reshape(-1, 4)
+        ids = np.asarray(ids)
+        new = cell_ranges(segments, self.cell_size)
+        old = np.array([self.ranges[i] for i in ids.tolist()],
+                dtype=np.int64).reshape(-1, 4)
+        moved = np.flatnonzero(np.any(new != old, axis=1))
+        if len(moved):
+            self.remove(ids[moved])
+            self.insert(ids[moved], segments[moved])
+
+    @staticmethod
+    def __keys(cells):
+        col_1, row_1, col_2, row_2 = cells
+        return [(col, row) for col in range(col_1, col_2 + 1)
+                for row in range(row_1, row_2 + 1)]
+
+    def query(self, x_min, y_min, x_max, y_max):
+        """Returns the sorted ids of the segments whose cells overlap the
+        rectangle (a superset of the segments inside it)."""
+        col_1, row_1, col_2, row_2 = np.floor(np.array([x_min, y_min, x_max,
+            y_max]) / self.cell_size).astype(np.int64).tolist()
+        found = []
+        dynamic = set()
+        area = (col_2 - col_1 + 1) * (row_2 - row_1 + 1)
+        if area > len(self.static) + len(self.dynamic):
+            # Fewer cells are in use than in the rectangle
+            inside = lambda key: (col_1 <= key[0] <= col_2 and
+                    row_1 <= key[1] <= row_2)
+            found = [ids for key, ids in self.static.items() if inside(key)]
+            for key, ids in self.dynamic.items():
+                if inside(key):
+                    dynamic.update(ids)
+        else:
+            for key in self.__keys((col_1, row_1, col_2, row_2)):
+                ids = self.static.get(key)
+                if ids is not None:
+                    found.append(ids)
+                ids = self.dynamic.get(key)
+                if ids:
+                    dynamic.update(ids)
+        if dynamic:
+            found.append(np.fromiter(dynamic, dtype=np.int64,
+                count=len(dynamic)))
+        if not found:
+            return np.zeros(0, dtype=np.int64)
+        return np.unique(np.concatenate(found))
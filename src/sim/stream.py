@@ -0,0 +1,272 @@
+"""Streaming of the measurements to the clients of a local socket server, as
+compact binary frames, without ROS. Each frame is
+
+    topic (uint8, index in TOPICS), info count (uint8), value count (uint16),
+    seq (uint32), stamp [s] (float64), info (float64 each), values (float32)
+
+in little-endian order; seq counts the samples of each topic, so a gap means
+samples were dropped. Clients send velocity commands as COMMAND, (vel [m/s],
+ang_vel [rad/s]) as two little-endian float64. Each client has its own
+queue of frames, and a client that reads slowly only loses its own oldest
+frames. The server runs an asyncio event loop on its own thread (Python 3
+only); StreamClient is a plain socket client for test harnesses."""
+# Python imports
+import asyncio
+import os
+import socket
+import struct
+import threading
+import time
+from collections import deque
+import numpy as np
+
+# MSL Sim imports
+import sim.defaults as d
+
+TOPICS = ('clock', 'collision', 'compass', 'encoders', 'gps', 'ground_truth',
+        'gyro', 'real_time_factor', 'scan')
+FRAME = struct.Struct('<BBHId')
+COMMAND = struct.Struct('<dd')
+
+
+def encode_frame(topic, seq, stamp, values=(), info=()):
+    values = np.asarray(values, dtype='<f4').ravel()
+    info = np.asarray(info, dtype='<f8').ravel()
+    return FRAME.pack(TOPICS.index(topic), len(info), len(values),
+            seq & 0xffffffff, stamp) + info.tobytes() + values.tobytes()
+
+
+def decode_frame(header, body):
+    """Returns (topic, seq, stamp, info, values) of a frame from its header
+    and the rest of it."""
+    topic, num_info, num_values, seq, stamp = FRAME.unpack(header)
+    info = np.frombuffer(body, dtype='<f8', count=num_info)
+    values = np.frombuffer(body, dtype='<f4', count=num_values,
+            offset=8*num_info)
+    return TOPICS[topic], seq, stamp, info, values
+
+
+def body_size(header):
+    """Returns the size [bytes] of the rest of a frame from its header."""
+    _, num_info, num_values, _, _ = FRAME.unpack(header)
+    return 8*num_info + 4*num_values
+
+
+def parse_address(address):
+    """Returns (host, port) for 'host:port', or the path of a Unix socket."""
+    if '/' in address:
+        return address
+    host, port = address.rsplit(':', 1)
+    return host, int(port)
+
+
+class _Client(object):
+    """A connected client and the frames waiting to be sent to it."""
+    def __init__(self, writer):
+        self.writer = writer
+        self.frames = deque()
+        self.ready = asyncio.Event()
+        self.sent = 0
+        self.dropped = 0
+
+
+class SocketPublisher(object):
+    """Streams the measurements to every client connected to a server at
+    address ('host:port', port 0 for any free one, or the path of a Unix
+    socket), stamped with the time of clock, and keeps the latest velocity
+    command sent by a client for take_command. Each client has a queue of
+    queue_size frames; when it is full the oldest frame is dropped."""
+    def __init__(self, address=d.STREAM_ADDRESS,
+            queue_size=d.STREAM_QUEUE_SIZE):
+        self.address = address
+        self.queue_size = queue_size
+        self.clock = None
+        self.started = False
+        self.clients = set()
+        self.command = None
+        self.seq = dict((topic, 0) for topic in TOPICS)
+        self.sent = self.dropped = 0 # by clients that have disconnected
+        self.loop = None
+        self.error = None
+
+    def start(self):
+        """Starts the server on its own thread, once it is listening."""
+        if self.started:
+            return
+        ready = threading.Event()
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.__serve, args=(ready,))
+        self.thread.daemon = True
+        self.thread.start()
+        ready.wait()
+        if self.error is not None:
+            raise self.error
+        self.started = True
+
+    def stop(self):
+        """Disconnects the clients and stops the server."""
+        if self.started:
+            self.started = False
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+
+    def set_param(self, name, value):
+        pass
+
+    def take_command(self):
+        """Returns the latest velocity command (vel, ang_vel) received since
+        the last call, or None."""
+        command, self.command = self.command, None
+        return command
+
+    def summary(self):
+        clients = list(self.clients)
+        return 'stream: %d clients, %d frames sent, %d dropped' % (
+                len(clients), self.sent + sum(c.sent for c in clients),
+                self.dropped + sum(c.dropped for c in clients))
+
+    def __serve(self, ready):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.server = self.loop.run_until_complete(self.__listen())
+        except Exception as error:
+            self.error = error
+            ready.set()
+            return
+        ready.set()
+        self.loop.run_forever()
+        # Closing the connections (without waiting for slow clients to take
+        # what is left to send) ends the clients' tasks
+        self.server.close()
+        for client in list(self.clients):
+            client.writer.transport.abort()
+        self.loop.run_until_complete(asyncio.gather(
+            *asyncio.all_tasks(self.loop), return_exceptions=True))
+        self.loop.close()
+
+    async def __listen(self):
+        address = parse_address(self.address)
+        if isinstance(address, tuple):
+            server = await asyncio.start_server(self.__handle, *address)
+            self.port = server.sockets[0].getsockname()[1]
+        else:
+            if os.path.exists(address):
+                os.unlink(address)
+            server = await asyncio.start_unix_server(self.__handle, address)
+        return server
+
+    async def __handle(self, reader, writer):
+        client = _Client(writer)
+        self.clients.add(client)
+        sender = asyncio.ensure_future(self.__send(client))
+        try:
+            while True:
+                data = await reader.readexactly(COMMAND.size)
+                self.command = COMMAND.unpack(data)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.clients.discard(client)
+            self.sent += client.sent
+            self.dropped += client.dropped
+            sender.cancel()
+            writer.close()
+
+    async def __send(self, client):
+        try:
+            while True:
+                await client.ready.wait()
+                client.ready.clear()
+                while client.frames:
+                    client.writer.write(client.frames.popleft())
+                    client.sent += 1
+                    # Waits while the client is behind, without holding up
+                    # the simulation or the other clients
+                    await client.writer.drain()
+        except ConnectionError:
+            pass
+
+    def __broadcast(self, frame):
+        for client in self.clients:
+            if len(client.frames) >= self.queue_size:
+                client.frames.popleft()
+                client.dropped += 1
+            client.frames.append(frame)
+            client.ready.set()
+
+    def __send_frame(self, topic, values=(), info=()):
+        if not self.started:
+            return
+        seq = self.seq[topic]
+        self.seq[topic] += 1
+        if self.clients:
+            stamp = self.clock.time if self.clock is not None else time.time()
+            self.loop.call_soon_threadsafe(self.__broadcast,
+                    encode_frame(topic, seq, stamp, values, info))
+
+    def publish_clock(self, sim_time):
+        self.__send_frame('clock')
+
+    def publish_collision(self, pose, segment):
+        self.__send_frame('collision', tuple(pose) + tuple(segment))
+
+    def publish_compass(self, bearing):
+        self.__send_frame('compass', (bearing,))
+
+    def publish_degradation(self, sensor, policy, level, duration, allowed):
+        pass
+
+    def publish_encoders(self, right_ticks, left_ticks):
+        self.__send_frame('encoders', (right_ticks, left_ticks))
+
+    def publish_gps(self, x, y):
+        self.__send_frame('gps', (x, y))
+
+    def publish_ground_truth(self, x, y, theta):
+        self.__send_frame('ground_truth', (x, y, theta))
+
+    def publish_gyro(self, angular_velocity):
+        self.__send_frame('gyro', (angular_velocity,))
+
+    def publish_real_time_factor(self, factor):
+        self.__send_frame('real_time_factor', (factor,))
+
+    def publish_scan(self, laser, ranges):
+        self.__send_frame('scan', ranges, (laser.min_angle, laser.max_angle,
+            laser.resolution, laser.range))
+
+
+class StreamClient(object):
+    """A blocking client of a SocketPublisher's server, e.g.
+
+        client = StreamClient('127.0.0.1:11411')
+        client.send_velocity(0.5, 0.0)
+        topic, seq, stamp, info, values = client.read()
+    """
+    def __init__(self, address=d.STREAM_ADDRESS, timeout=None):
+        address = parse_address(address)
+        family = socket.AF_INET if isinstance(address, tuple) else \
+                socket.AF_UNIX
+        self.socket = socket.socket(family, socket.SOCK_STREAM)
+        self.socket.settimeout(timeout)
+        self.socket.connect(address)
+
+    def __receive(self, size):
+        data = b''
+        while len(data) < size:
+            chunk = self.socket.recv(size - len(data))
+            if not chunk:
+                raise EOFError('The simulator closed the stream')
+            data += chunk
+        return data
+
+    def read(self):
+        """Returns the next frame as (topic, seq, stamp, info, values)."""
+        header = self.__receive(FRAME.size)
+        return decode_frame(header, self.__receive(body_size(header)))
+
+    def send_velocity(self, vel, ang_vel):
+        self.socket.sendall(COMMAND.pack(vel, ang_vel))
+
+    def close(self):
+        self.socket.close()
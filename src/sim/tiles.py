@@ -0,0 +1,176 @@
+# Python imports
+import threading
+from collections import OrderedDict
+from math import cos, sin, floor
+import numpy as np
+try:
+    import queue
+except ImportError: # Python 2
+    import Queue as queue
+
+# MSL Sim imports
+import sim.defaults as d
+from sim.line_map import load_tile_index, build_tile_index
+
+
+class TileStore(object):
+    """Pages the segments of a binary (.npy) map file in and out by square
+    tiles, using the tile index next to it (built if missing, see
+    MapStreamWriter), so maps far bigger than memory can be simulated.
+
+    move_to makes the tiles within reach (plus a margin) of a robot active;
+    those are the tiles active_segments returns. Tiles ahead of each robot are
+    prefetched by a background thread, and tiles no robot needs are kept in a
+    least recently used cache until the memory budget [MB] is exceeded. The
+    version number changes every time the active tiles change."""
+    def __init__(self, filename, memory_budget=d.TILE_MEMORY_BUDGET,
+            margin=d.TILE_MARGIN, tile_size=None, prefetch=True):
+        index = load_tile_index(filename)
+        if index is None:
+            build_tile_index(filename, tile_size or d.MAP_WIDTH)
+            index = load_tile_index(filename)
+        self.source = np.load(filename, mmap_mode='r')
+        self.tile_size = float(index['tile_size'])
+        self.max_half_length = float(index['max_half_length'])
+        self.ids = index['ids']
+        offsets = index['offsets']
+        self.slices = dict(((int(col), int(row)), (offsets[i], offsets[i + 1]))
+                for i, (col, row) in enumerate(index['tiles']))
+        self.memory_budget = memory_budget * 2**20
+        self.margin = margin
+        self.version = 0
+        self.cache = OrderedDict() # key -> segments, least recent first
+        self.cache_bytes = 0
+        self.needed = {} # robot -> set of keys it needs
+        self.active = frozenset()
+        self.__active_segments = np.zeros((0, 4))
+        self.stats = {'loads': 0, 'prefetched': 0, 'stalls': 0, 'evictions': 0}
+        self.lock = threading.Lock()
+        self.prefetch = prefetch
+        self.requests = None
+        self.worker = None
+        self.pending = set() # keys requested from the prefetching thread
+        self.resume()
+
+    def close(self):
+        """Stops the prefetching thread."""
+        if self.requests is not None:
+            self.requests.put(None)
+            self.requests = None
+
+    def pause(self):
+        """Stops the prefetching thread and waits for it to read the tiles
+        already requested, so that no other thread holds the lock (as a fork
+        needs). resume starts it again."""
+        worker = self.worker
+        self.close()
+        if worker is not None:
+            worker.join()
+        self.worker = None
+
+    def resume(self):
+        """Starts the prefetching thread, if the store prefetches and it is
+        not running."""
+        if self.prefetch and self.requests is None:
+            self.requests = queue.Queue()
+            self.worker = threading.Thread(target=self.__prefetch_loop,
+                    args=(self.requests,))
+            self.worker.daemon = True
+            self.worker.start()
+
+    def tiles_within(self, x, y, radius):
+        """Returns the keys of the (non-empty) tiles that may hold a segment
+        coming within radius of (x, y)."""
+        radius += self.max_half_length # tiles hold segments by their midpoint
+        size = self.tile_size
+        keys = set()
+        for col in range(int(floor((x - radius)/size)),
+                int(floor((x + radius)/size)) + 1):
+            dx = max(col*size - x, 0, x - (col + 1)*size)
+            for row in range(int(floor((y - radius)/size)),
+                    int(floor((y + radius)/size)) + 1):
+                dy = max(row*size - y, 0, y - (row + 1)*size)
+                if (col, row) in self.slices and dx*dx + dy*dy <= radius*radius:
+                    keys.add((col, row))
+        return keys
+
+    def __read(self, key):
+        """Reads a tile from the map file (in file order, for the disk)."""
+        start, stop = self.slices[key]
+        return np.asarray(self.source[np.sort(self.ids[start:stop])],
+                dtype=float)
+
+    def __insert(self, key, segments):
+        """Adds a tile to the cache, evicting the least recently used tiles no
+        robot needs while over budget. Must be called with the lock held."""
+        if key in self.cache:
+            return
+        self.cache[key] = segments
+        self.cache_bytes += segments.nbytes
+        self.stats['loads'] += 1
+        for old in list(self.cache):
+            if self.cache_bytes <= self.memory_budget:
+                break
+            if old not in self.active:
+                self.cache_bytes -= self.cache.pop(old).nbytes
+                self.stats['evictions'] += 1
+
+    def __prefetch_loop(self, requests):
+        while True:
+            key = requests.get()
+            if key is None:
+                return
+            with self.lock:
+                if key in self.cache:
+                    self.pending.discard(key)
+                    continue
+            segments = self.__read(key)
+            with self.lock:
+                if key not in self.cache:
+                    self.stats['prefetched'] += 1
+                self.__insert(key, segments)
+                self.pending.discard(key)
+
+    def move_to(self, pose, reach, robot=0):
+        """Makes the tiles within reach + margin [m] of a robot at pose (x, y,
+        heading) active, reading any that are not cached, and prefetches the
+        tiles the robot would need after moving reach further ahead."""
+        x, y, heading = pose
+        radius = reach + self.margin
+        needed = self.tiles_within(x, y, radius)
+        if needed != self.needed.get(robot):
+            self.needed[robot] = needed
+            active = frozenset().union(*self.needed.values())
+            with self.lock:
+                # Once active, the prefetch thread can no longer evict them
+                self.active = active
+                missing = [key for key in active if key not in self.cache]
+            loaded = [(key, self.__read(key)) for key in missing]
+            with self.lock:
+                for key, segments in loaded:
+                    self.stats['stalls'] += key not in self.cache
+                    self.__insert(key, segments)
+                for key in active: # most recently used
+                    self.cache[key] = self.cache.pop(key)
+                tiles = [self.cache[key] for key in sorted(active)]
+            self.__active_segments = (np.vstack(tiles) if tiles
+                    else np.zeros((0, 4)))
+            self.version += 1
+        if self.requests is not None:
+            ahead = self.tiles_within(x + reach*cos(heading),
+                    y + reach*sin(heading), radius)
+            with self.lock:
+                ahead -= needed | self.pending | set(self.cache)
+                self.pending.update(ahead)
+            for key in ahead:
+                self.requests.put(key)
+
+    def active_segments(self):
+        """Returns the (M, 4) segments of the active tiles."""
+        return self.__active_segments
+
+    def active_tiles(self):
+        """Returns a dictionary of the segments of each active tile."""
+        with self.lock:
+            return dict((key, self.cache[key]) for key in self.active
+                    if key in self.cache) # unless still being read
@@ -0,0 +1,152 @@
+# Python imports
+import numpy as np
+from math import pi
+
+# MSL Sim imports
+import sim.defaults as d
+import sim.model as mod
+from sim.line_map import as_segments
+from sim.raycast import cast_scans
+
+
+class VectorEnv(object):
+    """K independent robots, each with its own pose, velocities and random
+    number generator, driving over one or more line maps. All the robots are
+    stepped together with array operations: a single call to step integrates
+    every pose, reads every odometer and scans every laser. The robot and
+    sensor properties (size, noise, laser geometry, etc.) are copied from a
+    template Robot."""
+    def __init__(self, num_envs, maps, map_ids=None, robot=None, seed=None,
+            reward_fn=None):
+        self.num_envs = num_envs
+        # Maps are stored as segment arrays; map_ids assigns a map to each robot
+        if not isinstance(maps, (list, tuple)):
+            maps = [maps]
+        self.maps = [as_segments(m) for m in maps]
+        if map_ids is None:
+            map_ids = np.arange(num_envs) % len(self.maps)
+        self.map_ids = np.asarray(map_ids, dtype=int)
+        self.reward_fn = reward_fn
+        self.configure(robot if robot is not None else mod.Robot())
+        self.seed(seed)
+        self.reset()
+
+    def configure(self, robot):
+        """Copies the robot and sensor properties from a template Robot."""
+        self.wheelbase = robot.wheelbase
+        self.wheel_rad = robot.wheel_rad
+        self.max_vel = robot.max_vel
+        self.max_ang_vel = robot.max_ang_vel
+        self.dt = 1.0/robot.odometer.freq
+        self.odom_res = robot.odometer.res
+        self.odom_noise = robot.odometer.noise
+        self.beam_angles = robot.laser.beam_angles()
+        self.laser_range = robot.laser.range
+        self.laser_noise = robot.laser.noise
+        self.laser_noise_table = robot.laser.noise_table
+
+    def seed(self, seed=None):
+        """Gives every robot its own random number generator, derived from a
+        single seed."""
+        seeds = np.random.RandomState(seed).randint(2**31 - 1,
+                size=self.num_envs)
+        self.rngs = [np.random.RandomState(s) for s in seeds]
+
+    def reset(self, poses=None):
+        """Places the robots at the given (K, 3) poses (the default initial
+        pose if None), stops them, and returns the observations."""
+        if poses is None:
+            poses = d.ROBOT_INIT_POSE
+        poses = np.broadcast_to(np.asarray(poses, dtype=float),
+                (self.num_envs, 3))
+        self.x, self.y, self.heading = [np.array(c) for c in poses.T]
+        self.vel = np.zeros(self.num_envs)
+        self.ang_vel = np.zeros(self.num_envs)
+        self.right_partial_tick = np.zeros(self.num_envs)
+        self.left_partial_tick = np.zeros(self.num_envs)
+        self.steps = 0
+        ticks = np.zeros((self.num_envs, 2), dtype=int)
+        return self.observe(ticks)
+
+    @property
+    def poses(self):
+        """Returns the (K, 3) array of poses (x, y, heading) [m, m, rad]."""
+        return np.column_stack((self.x, self.y, self.heading))
+
+    def __draw_noise(self, size):
+        """Returns a (K, size) array of standard normal samples, drawing each
+        row from the corresponding robot's generator."""
+        return np.array([rng.standard_normal(size) for rng in self.rngs])
+
+    def update_poses(self):
+        """Drives every robot along the arc given by its velocities for one
+        odometry period, as Robot.update_pose does."""
+        self.vel[np.abs(self.vel) < 1e-5] = 0
+        self.ang_vel[np.abs(self.ang_vel) < 1e-5] = 0
+        self.x, self.y, heading = mod.arc_step(self.x, self.y, self.heading,
+                self.vel * self.dt, self.ang_vel * self.dt)
+        self.heading = (heading + pi) % (2*pi) - pi
+
+    def read_odometers(self, noise):
+        """Returns a (K, 2) integer array of (right, left) ticks over one
+        odometry period, as Odometer.read does. Robots that are not moving
+        read zero ticks. noise is a (K, 2) array of standard normal samples."""
+        moving = (self.vel != 0) | (self.ang_vel != 0)
+        omega = self.wheelbase/(2*self.wheel_rad) * self.ang_vel
+        ticks = np.column_stack((self.vel + omega, self.vel - omega))
+        ticks = ticks * self.dt/(self.odom_res * pi/180)
+        ticks += noise * self.odom_noise
+        ticks += np.column_stack((self.right_partial_tick,
+            self.left_partial_tick))
+        ticks_int = np.floor(ticks)
+        partial = ticks - ticks_int
+        self.right_partial_tick = np.where(moving, partial[:, 0],
+                self.right_partial_tick)
+        self.left_partial_tick = np.where(moving, partial[:, 1],
+                self.left_partial_tick)
+        return np.where(moving[:, None], ticks_int, 0).astype(int)
+
+    def scan_lasers(self, noise):
+        """Returns a (K, B) array of laser ranges, zero where a beam hits
+        nothing. noise is a (K, B) array of standard normal samples."""
+        ranges = np.empty((self.num_envs, len(self.beam_angles)))
+        poses = self.poses
+        for map_id, segments in enumerate(self.maps):
+            robots = np.flatnonzero(self.map_ids == map_id)
+            if len(robots):
+                ranges[robots] = cast_scans(poses[robots], self.beam_angles,
+                        segments, self.laser_range)[0]
+        if self.laser_noise_table is None:
+            ranges += noise * self.laser_noise
+        else:
+            ranges += noise * np.interp(ranges, *self.laser_noise_table)
+        ranges[~np.isfinite(ranges)] = 0
+        return ranges
+
+    def observe(self, ticks):
+        """Scans the lasers and returns the observation dictionary."""
+        noise = self.__draw_noise(len(self.beam_angles))
+        return {'pose': self.poses,
+                'ticks': ticks,
+                'scan': self.scan_lasers(noise)}
+
+    def step(self, actions):
+        """Sets the (K, 2) velocity commands (vel [m/s], ang_vel [rad/s]),
+        clipped to the robot's limits, and advances every robot by one
+        odometry period. Returns a tuple (observations, rewards, dones, infos)
+        in the style of a vectorized Gym environment."""
+        actions = np.asarray(actions, dtype=float).reshape(self.num_envs, 2)
+        self.vel = np.clip(actions[:, 0], -self.max_vel, self.max_vel)
+        self.ang_vel = np.clip(actions[:, 1], -self.max_ang_vel,
+                self.max_ang_vel)
+        self.update_poses()
+        ticks = self.read_odometers(self.__draw_noise(2))
+        observations = self.observe(ticks)
+        self.steps += 1
+        if self.reward_fn is not None:
+            rewards = np.asarray(self.reward_fn(self, observations),
+                    dtype=float)
+        else:
+            rewards = np.zeros(self.num_envs)
+        dones = np.zeros(self.num_envs, dtype=bool)
+        return observations, rewards, dones, {}
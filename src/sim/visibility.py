@@ -0,0 +1,222 @@
+"""The visibility polygon of a point among segments, found with an angular
+sweep over the segments' endpoints, and the ranges of laser beams sampled from
+it. For n segments crossing each other k times, building it takes O((n + k)
+log n) distance comparisons, plus an insertion into and a removal from a list
+of the pieces in view for each piece, which is O(n + k) in the worst case
+(O((n + k)^2) in all) but a fast memory move in practice. Each beam then
+costs O(log n), against O(n) per beam for casting every beam through every
+segment."""
+# Python imports
+from math import cos, pi, sin
+import numpy as np
+
+# MSL Sim imports
+from sim.spatial import cell_ranges
+
+def candidate_pairs(segments):
+    """Returns (i, j) arrays of the pairs of segments (i < j) that share a
+    cell of a uniform grid whose cells are about as large as the segments,
+    which includes every pair that crosses."""
+    extents = np.abs(segments[:, 2:4] - segments[:, 0:2]).max(axis=1)
+    cell_size = max(2*np.median(extents), 1e-6)
+    ranges = cell_ranges(segments, cell_size)
+    widths = ranges[:, 2] - ranges[:, 0] + 1
+    counts = widths * (ranges[:, 3] - ranges[:, 1] + 1)
+    # One entry per (segment, cell), sorted by cell
+    owner = np.repeat(np.arange(len(segments)), counts)
+    offset = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts,
+            counts)
+    cols = ranges[owner, 0] + offset % widths[owner]
+    rows = ranges[owner, 1] + offset // widths[owner]
+    order = np.lexsort((owner, rows, cols))
+    cols, rows, owner = cols[order], rows[order], owner[order]
+    first = np.concatenate(([True], (np.diff(cols) != 0) |
+        (np.diff(rows) != 0)))
+    group_end = np.append(np.flatnonzero(first)[1:], len(owner))
+    group_end = group_end[np.cumsum(first) - 1]
+    # Each entry paired with the later entries of its cell
+    later = group_end - np.arange(len(owner)) - 1
+    left = np.repeat(np.arange(len(owner)), later)
+    right = left + 1 + np.arange(later.sum()) - np.repeat(np.cumsum(later) -
+            later, later)
+    pairs = np.unique(owner[left] * len(segments) + owner[right])
+    return pairs // len(segments), pairs % len(segments)
+
+
+def split_crossings(segments, eps=1e-9):
+    """Returns the (M', 4) segments with every segment split where another
+    crosses it (touching at an end is not crossing), so that no two of them
+    cross."""
+    segments = np.asarray(segments, dtype=float).reshape(-1, 4)
+    if len(segments) < 2:
+        return segments
+    i, j = candidate_pairs(segments)
+    p, e = segments[:, 0:2], segments[:, 2:4] - segments[:, 0:2]
+    # Solve p_i + t*e_i = p_j + u*e_j for each pair
+    denom = e[i, 0]*e[j, 1] - e[i, 1]*e[j, 0]
+    d_x, d_y = p[j, 0] - p[i, 0], p[j, 1] - p[i, 1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = (d_x*e[j, 1] - d_y*e[j, 0]) / denom
+        u = (d_x*e[i, 1] - d_y*e[i, 0]) / denom
+    crossing = (np.abs(denom) > eps) & (t > eps) & (t < 1 - eps) & \
+            (u > eps) & (u < 1 - eps)
+    if not np.any(crossing):
+        return segments
+    # Where each crossing falls along each of the two segments
+    cut = np.concatenate((i[crossing], j[crossing]))
+    where = np.concatenate((t[crossing], u[crossing]))
+    order = np.lexsort((where, cut))
+    cut, where = cut[order], where[order]
+    # Pieces from the previous crossing (or the start) to each crossing, and
+    # from the last crossing to the end
+    first = np.concatenate(([True], cut[1:] != cut[:-1]))
+    last = np.concatenate((cut[1:] != cut[:-1], [True]))
+    owner = np.concatenate((cut, cut[last]))
+    begin = np.concatenate((np.where(first, 0.0, np.roll(where, 1)),
+        where[last]))[:, None]
+    end = np.concatenate((where, np.ones(last.sum())))[:, None]
+    whole = np.ones(len(segments), dtype=bool)
+    whole[cut] = False
+    return np.vstack((segments[whole], np.hstack((p[owner] + begin*e[owner],
+        p[owner] + end*e[owner]))))
+
+
+def _ray_distances(origin, angles, segments):
+    """Returns the distance from origin along each ray at angles [rad] to the
+    line through the matching segment (one per ray)."""
+    c, s = np.cos(angles), np.sin(angles)
+    p_x, p_y = segments[:, 0] - origin[0], segments[:, 1] - origin[1]
+    e_x, e_y = segments[:, 2] - segments[:, 0], segments[:, 3] - segments[:, 1]
+    denom = c*e_y - s*e_x
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = (p_x*e_y - p_y*e_x) / denom
+    # Rays along a segment hit its nearer end
+    end = np.minimum(np.hypot(p_x, p_y), np.hypot(p_x + e_x, p_y + e_y))
+    return np.where(np.abs(denom) > 1e-12, t, end)
+
+
+class VisibilityPolygon(object):
+    """What can be seen from origin through (M, 4) segments, as the segment
+    piece visible in each angular interval between consecutive endpoint
+    bearings: bounds holds the K + 1 bearings [rad] from -pi to pi, visible
+    the index in pieces of the piece seen in each of the K intervals (-1 if
+    none) and pieces the segments, split where they cross each other or the
+    bearing pi."""
+    def __init__(self, origin, segments):
+        self.origin = (float(origin[0]), float(origin[1]))
+        pieces = self.__split_behind(split_crossings(segments))
+        self.pieces = pieces
+        self.bounds, self.visible = self.__sweep(pieces)
+
+    def __split_behind(self, segments):
+        """Splits the segments that cross the ray from origin at bearing pi,
+        where the bearings wrap round."""
+        o_x, o_y = self.origin
+        y_1, y_2 = segments[:, 1] - o_y, segments[:, 3] - o_y
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = y_1 / (y_1 - y_2)
+            x = segments[:, 0] + t*(segments[:, 2] - segments[:, 0]) - o_x
+        behind = (y_1*y_2 < 0) & (x < 0)
+        if not np.any(behind):
+            return segments
+        split = segments[behind]
+        point = split[:, 0:2] + t[behind, None]*(split[:, 2:4] - split[:, 0:2])
+        return np.vstack((segments[~behind], np.hstack((split[:, 0:2], point)),
+            np.hstack((point, split[:, 2:4]))))
+
+    def __sweep(self, pieces):
+        o_x, o_y = self.origin
+        first = np.arctan2(pieces[:, 1] - o_y, pieces[:, 0] - o_x)
+        second = np.arctan2(pieces[:, 3] - o_y, pieces[:, 2] - o_x)
+        low, high = np.minimum(first, second), np.maximum(first, second)
+        # Pieces with an end on the bearing pi (which atan2 may give as -pi)
+        # span from it to their other end the short way round
+        wrapped = high - low > pi
+        on_low = wrapped & (low + pi < pi - high)
+        low, high = (np.where(on_low, high, np.where(wrapped, -pi, low)),
+                np.where(on_low, pi, np.where(wrapped, low, high)))
+        # Pieces seen edge on (or through origin) hide nothing
+        kept = np.flatnonzero(high - low > 1e-12)
+        bounds = np.unique(np.concatenate(([-pi, pi], low[kept], high[kept])))
+        # Events per bound: pieces ending there, then pieces starting there
+        starts = np.searchsorted(bounds, low[kept])
+        ends = np.searchsorted(bounds, high[kept])
+        opening = [[] for _ in bounds]
+        closing = [[] for _ in bounds]
+        for piece, start, end in zip(kept.tolist(), starts.tolist(),
+                ends.tolist()):
+            opening[start].append(piece)
+            closing[end].append(piece)
+        coords = pieces.tolist()
+
+        def distance(piece, c, s):
+            x_1, y_1, x_2, y_2 = coords[piece]
+            e_x, e_y = x_2 - x_1, y_2 - y_1
+            return ((x_1 - o_x)*e_y - (y_1 - o_y)*e_x) / (c*e_y - s*e_x)
+
+        # Active pieces, nearest first; pieces that do not cross stay in the
+        # same order over the bearings they share
+        active = []
+        visible = np.full(len(bounds) - 1, -1, dtype=np.int64)
+        bounds_list = bounds.tolist()
+        for k in range(len(bounds) - 1):
+            for piece in closing[k]:
+                active.remove(piece)
+            if opening[k]:
+                middle = (bounds_list[k] + bounds_list[k + 1]) / 2.0
+                c, s = cos(middle), sin(middle)
+                for piece in opening[k]:
+                    key = distance(piece, c, s)
+                    low, high = 0, len(active)
+                    while low < high:
+                        half = (low + high) // 2
+                        if distance(active[half], c, s) < key:
+                            low = half + 1
+                        else:
+                            high = half
+                    active.insert(low, piece)
+            if active:
+                visible[k] = active[0]
+        return bounds, visible
+
+    def ranges(self, angles, max_range=np.inf):
+        """Returns the range along each bearing in angles [rad] to the nearest
+        piece (inf if none is within max_range). A bearing on a bound is
+        checked against the pieces seen on either side of it (round the
+        back for -pi)."""
+        angles = np.mod(np.asarray(angles, dtype=float) + pi, 2*pi) - pi
+        ranges = np.full(angles.shape, np.inf)
+        if not len(self.visible):
+            return ranges
+        last = len(self.visible) - 1
+        interval = np.clip(np.searchsorted(self.bounds, angles, side='right')
+                - 1, 0, last)
+        for side in (interval, np.mod(interval - 1, last + 1)):
+            piece = self.visible[side]
+            seen = piece >= 0
+            if side is not interval:
+                seen &= angles == self.bounds[interval]
+            if np.any(seen):
+                r = _ray_distances(self.origin, angles[seen],
+                        self.pieces[piece[seen]])
+                ranges[seen] = np.minimum(ranges[seen], np.where(r >= 0, r,
+                    np.inf))
+        ranges[ranges >= max_range] = np.inf
+        return ranges
+
+    def vertices(self):
+        """Returns the (V, 2) vertices of the boundary of what is seen,
+        counter-clockwise, two per interval in which a piece is seen."""
+        seen = np.flatnonzero(self.visible >= 0)
+        angles = np.column_stack((self.bounds[seen], self.bounds[seen + 1]))
+        pieces = self.pieces[np.repeat(self.visible[seen], 2)]
+        r = _ray_distances(self.origin, angles.ravel(), pieces)
+        return np.column_stack((self.origin[0] + r*np.cos(angles.ravel()),
+            self.origin[1] + r*np.sin(angles.ravel())))
+
+
+def sweep_ranges(origin, angles, segments, max_range):
+    """Returns the ranges (inf where nothing is within max_range) of beams cast
+    from origin at angles [rad] through the (M, 4) segments, by the
+    visibility polygon of origin."""
+    return VisibilityPolygon(origin, segments).ranges(angles, max_range)